@@ -0,0 +1,138 @@
+"""複数の月の勤怠データをまとめて出力するスクリプト
+
+to_csv.py・csv_to_xlsx.pyを月ごとに実行する代わりに、1つのプロセスで
+テンプレートと従業員のマッピングを1回だけ読み込み、全期間のデータを1回のクエリで読んで、
+月ごとのCSV(csv/YYYY-MM/*.csv)とExcelファイル(csv/YYYY-MM/data.xlsm)を作成する。
+
+使い方:
+    python batch_export.py 2023/04-2024/03
+    python batch_export.py 2023/04-2024/03 --csv   # CSVだけ
+    python batch_export.py 2023/04-2024/03 --xlsx  # Excelだけ
+"""
+
+from pathlib import Path
+import argparse
+import time
+
+import config
+import csv_to_xlsx
+import time_util
+import to_csv
+
+
+def batch_export(
+    months: list[tuple[int, int]],
+    write_csv: bool = True,
+    write_xlsx: bool = True,
+    incremental: bool = True,
+    use_summary: bool = True,
+    streaming: bool = False,
+) -> dict[tuple[int, int], float]:
+    """複数の月のCSVとExcelファイルを1つのプロセスで作成する
+
+    Args:
+        months (list[tuple[int, int]]): (年, 月)のリスト 古い順で連続していること
+        write_csv (bool): 従業員ごとのCSVを書き出す
+        write_xlsx (bool): Excelファイルを作成する
+        incremental (bool): Trueなら前回から内容が変わった従業員のCSV・シートだけを書き込む
+        use_summary (bool): Trueなら打刻の代わりに日ごとの集計(DailySummary)を読む
+        streaming (bool): TrueならExcelファイルを書き込み専用モードで作成する
+                          既存のファイルがありincrementalがTrueなら通常のモードで更新する
+
+    Returns:
+        dict: (年, 月) -> その月の出力にかかった秒数
+    """
+    start = time.perf_counter()
+    template_file = Path(config.TEMPLATE_PATH)
+    template = None
+    employee_mapping = {}
+    if write_xlsx:
+        # テンプレートと従業員のマッピングは全部の月で使い回す
+        employee_mapping = to_csv.load_employee_mapping(
+            Path(config.EMPLOYEE_LIST)
+        )
+        if not template_file.exists():
+            print(f"テンプレートファイル {template_file} が存在しません。")
+            return {}
+        template = csv_to_xlsx.load_template(template_file)
+    print(f"テンプレートの読み込み: {time.perf_counter() - start:.2f}秒")
+
+    timings = {}
+    month_rows = to_csv.iter_months_rows(months, use_summary)
+    while True:
+        month_start = time.perf_counter()
+        # 1か月目は全期間のデータを読む時間も含む
+        entry = next(month_rows, None)
+        if entry is None:
+            break
+        year, month, employee_rows = entry
+        output_dir = Path(config.CSV_PATH) / f"{year:04d}-{month:02d}"
+        if write_csv:
+            to_csv.write_employee_csvs(output_dir, employee_rows, incremental)
+        if write_xlsx:
+            output_dir.mkdir(exist_ok=True, parents=True)
+            output_file = output_dir / "data.xlsm"
+            if csv_to_xlsx.use_streaming(streaming, output_file, incremental):
+                csv_to_xlsx.stream_rows_to_excel(
+                    year,
+                    month,
+                    employee_rows,
+                    template_file,
+                    employee_mapping,
+                    output_file,
+                    template,
+                )
+            else:
+                csv_to_xlsx.rows_to_excel(
+                    year,
+                    month,
+                    employee_rows,
+                    template_file,
+                    employee_mapping,
+                    output_file,
+                    incremental,
+                    template,
+                )
+        timings[year, month] = time.perf_counter() - month_start
+        print(f"{year:04d}/{month:02d}: {timings[year, month]:.2f}秒")
+
+    print(f"合計: {time.perf_counter() - start:.2f}秒")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数の月の勤怠データをまとめて出力する")
+    parser.add_argument("range", help="年月の範囲 例: 2023/04-2024/03, 23/4~24/3")
+    parser.add_argument("--csv", action="store_true", help="CSVだけを出力する")
+    parser.add_argument("--xlsx", action="store_true", help="Excelファイルだけを出力する")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="前回から変更のない従業員も含めてすべて書き出す",
+    )
+    parser.add_argument(
+        "--from-records",
+        action="store_true",
+        help="日ごとの集計を使わずに打刻から作る",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Excelファイルを書き込み専用モードで作成する(既存のファイルがある場合は--fullも必要)",
+    )
+    args = parser.parse_args()
+    try:
+        months = time_util.parse_month_range(args.range)
+    except ValueError as e:
+        parser.error(str(e))
+    # どちらも指定されていなければ両方を出力する
+    write_csv = args.csv or not args.xlsx
+    write_xlsx = args.xlsx or not args.csv
+    batch_export(
+        months,
+        write_csv,
+        write_xlsx,
+        not args.full,
+        not args.from_records,
+        args.streaming,
+    )
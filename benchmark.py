@@ -0,0 +1,947 @@
+"""性能計測用のスクリプト
+
+合成データベースを一時フォルダに作成し、処理ごとの所要時間を計測する。
+本番のデータベース(config.DATABASE_PATH)には触らない。
+出力が一致することなどの確認はtests/のテスト(python -m pytest)で行う。
+
+使い方:
+    python benchmark.py export [従業員数] [年数]
+    python benchmark.py nfc [タップ数]
+    python benchmark.py engine [打刻数]
+    python benchmark.py sheets [シート数]
+    python benchmark.py jobs [従業員数] [年数] [プロセス数]
+    python benchmark.py pairs [打刻数]
+    python benchmark.py payroll [従業員数] [年数]
+    python benchmark.py memory [従業員数] [最大の年数]
+    python benchmark.py query [従業員数] [年数]
+    python benchmark.py period [回数]
+    python benchmark.py batch [従業員数] [月数]
+    python benchmark.py template [回数]
+    python benchmark.py stream [従業員数]
+    python benchmark.py cells [従業員数] [月数]
+    python benchmark.py startup [回数]
+    python benchmark.py clock [秒数] [回数]
+    python benchmark.py punch [タップ数]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import config
+import db_alchemy
+import pair_engine
+import payroll
+import time_util
+from db_alchemy import (
+    AttendanceRecord,
+    Employee,
+    IC_Card,
+    RecordQuery,
+    RecordType,
+)
+from tests.synthetic import make_synthetic_db, synthetic_mapping
+import to_csv
+
+
+def timed(label: str, func, *args, **kwargs):
+    """funcを実行して所要時間を表示する"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed:.3f}秒")
+    return result, elapsed
+
+
+def bench_export(employees: int = 500, years: int = 5):
+    """従業員ごとのクエリと1回のクエリでのCSV出力を比較する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        timed(
+            f"合成DB作成({employees}人×{years}年)",
+            make_synthetic_db,
+            tmp_path / "bench.db",
+            employees,
+            years,
+        )
+        config.CSV_PATH = str(tmp_path / "csv")
+        _, per_employee = timed(
+            "従業員ごとのクエリ",
+            to_csv.export_employee_attendance_to_csv,
+            2023,
+            12,
+            single_query=False,
+            incremental=False,
+            use_summary=False,
+        )
+        _, single = timed(
+            "1回のクエリ",
+            to_csv.export_employee_attendance_to_csv,
+            2023,
+            12,
+            single_query=True,
+            incremental=False,
+            use_summary=False,
+        )
+        print(f"速度比: {per_employee / single:.1f}倍")
+        _, summary = timed(
+            "日ごとの集計",
+            to_csv.export_employee_attendance_to_csv,
+            2023,
+            12,
+            incremental=False,
+        )
+        print(f"速度比(日ごとの集計): {per_employee / summary:.1f}倍")
+
+
+def bench_nfc(taps: int = 20):
+    """台本付きのダミーリーダーで連続読み取りの通知までの時間を計測する
+
+    各タップは「同じカードを2回検出(かざしたまま)→カードなし」の台本
+    """
+    from nfc_reader_QThread import NfcReader, ScriptedFrontend
+
+    script: list = []
+    expected = []
+    for i in range(taps):
+        ic_card_id = f"{i % 3:016x}"
+        script += [ic_card_id, ic_card_id, None, None, None]
+        expected.append(ic_card_id)
+
+    received = []
+    done = threading.Event()
+
+    def on_connect(tag):
+        received.append(tag.identifier.hex())
+        if len(received) == len(expected):
+            done.set()
+        # ダイアログを閉じたときのMainWindowと同じようにポーリングを再開する
+        reader.resume()
+
+    clf = ScriptedFrontend(script)
+    reader = NfcReader(
+        clf,
+        on_connect=on_connect,
+        continuous=True,
+        # 台本のNone1回はsenseのinterval(0.1秒)なので、3回分より短くする
+        debounce=0.15,
+        activate=ScriptedFrontend.activate,
+    )
+    thread = threading.Thread(target=reader.run)
+    start = time.perf_counter()
+    thread.start()
+    done.wait(timeout=taps * 5)
+    reader.stop()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    average, worst = reader.latency_stats()
+    print(
+        f"{len(received)}回のタップを{elapsed:.2f}秒で処理({clf.sense_count}回のsense)"
+    )
+    print(f"検出から通知まで 平均{average:.3f}ms 最大{worst:.3f}ms")
+
+
+def bench_engine(punches: int = 500):
+    """config.DATABASE_PROFILESの設定ごとに打刻の書き込み速度を計測する
+
+    打刻と同時に別スレッドで出力用のクエリを流し続け、
+    "database is locked"などのエラーになった回数も数える
+    """
+    for profile in config.DATABASE_PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = db_alchemy.create_db_engine(str(Path(tmp) / "bench.db"), profile)
+            db_alchemy.Session.configure(bind=engine)
+            with redirect_stdout(io.StringIO()):
+                db_alchemy.migrate(engine)
+                Employee.add("従業員0000")
+            employee = Employee.get_by_name("従業員0000")
+            assert employee is not None
+
+            stop = threading.Event()
+            errors = []
+            reads = 0
+
+            def read_loop():
+                nonlocal reads
+                while not stop.is_set():
+                    try:
+                        list(
+                            AttendanceRecord.iter_period_records(
+                                datetime(2000, 1, 1), datetime(2100, 1, 1)
+                            )
+                        )
+                        reads += 1
+                    except Exception as e:
+                        errors.append(e)
+
+            reader = threading.Thread(target=read_loop)
+            reader.start()
+            punch_time = datetime(2024, 1, 1, 9)
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                for i in range(punches):
+                    try:
+                        AttendanceRecord.punch(
+                            employee.employee_id,
+                            RecordType.IN if i % 2 == 0 else RecordType.OUT,
+                            punch_time + timedelta(minutes=i),
+                        )
+                    except Exception as e:
+                        errors.append(e)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            reader.join()
+            engine.dispose()
+            print(
+                f"{profile}: {punches / elapsed:.0f}打刻/秒 "
+                f"(同時に{reads}回読み込み, エラー{len(errors)}件)"
+            )
+            for error in errors[:3]:
+                print(f"    {error}")
+
+
+def _copy_sheet_by_value(source_ws, target_wb, target_name):
+    """セルごとに書式のオブジェクトを作り直してコピーする(比較用の以前の方法)"""
+    from openpyxl.styles import Alignment, Border, Font, PatternFill
+
+    ws2 = target_wb.create_sheet(target_name)
+    for row in source_ws.iter_rows():
+        for cell in row:
+            new_cell = ws2[cell.coordinate]
+            new_cell.value = cell.value
+            if cell.font:
+                new_cell.font = Font(
+                    name=cell.font.name,
+                    size=cell.font.size,
+                    bold=cell.font.bold,
+                    italic=cell.font.italic,
+                    vertAlign=cell.font.vertAlign,
+                    underline=cell.font.underline,
+                    strike=cell.font.strike,
+                    color=cell.font.color,
+                )
+            if cell.fill:
+                new_cell.fill = PatternFill(
+                    patternType=cell.fill.patternType,
+                    fgColor=cell.fill.fgColor,
+                    bgColor=cell.fill.bgColor,
+                )
+            if cell.border:
+                new_cell.border = Border(
+                    left=cell.border.left,
+                    right=cell.border.right,
+                    top=cell.border.top,
+                    bottom=cell.border.bottom,
+                    diagonal=cell.border.diagonal,
+                    outline=cell.border.outline,
+                    vertical=cell.border.vertical,
+                    horizontal=cell.border.horizontal,
+                )
+            if cell.alignment:
+                new_cell.alignment = Alignment(
+                    horizontal=cell.alignment.horizontal,
+                    vertical=cell.alignment.vertical,
+                    textRotation=cell.alignment.textRotation,
+                    wrapText=cell.alignment.wrapText,
+                    shrinkToFit=cell.alignment.shrinkToFit,
+                    indent=cell.alignment.indent,
+                    relativeIndent=cell.alignment.relativeIndent,
+                )
+            if cell.number_format:
+                new_cell.number_format = cell.number_format
+    for col_letter, column_dimension in source_ws.column_dimensions.items():
+        ws2.column_dimensions[col_letter].width = column_dimension.width
+    for row_number, row_dimension in source_ws.row_dimensions.items():
+        ws2.row_dimensions[row_number].height = row_dimension.height
+    return True
+
+
+def bench_sheets(sheets: int = 120):
+    """テンプレートからのシートのコピーの時間とメモリを方法ごとに計測する"""
+    from openpyxl import load_workbook
+    import csv_to_xlsx
+
+    template = load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+    template_types = [name for name in template.sheetnames if name != "button"]
+
+    def copy_all(copy_func, same_workbook: bool):
+        wb = load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+        source = wb if same_workbook else template
+        for i in range(sheets):
+            template_type = template_types[i % len(template_types)]
+            name = f"従業員{i:04d}"
+            copy_func(source[template_type], wb, name)
+            csv_to_xlsx.initialize_sheet(wb[name])
+        return wb
+
+    for label, copy_func, same_workbook in [
+        ("セルごとに書式を作成(以前の方法)", _copy_sheet_by_value, False),
+        ("共有スタイルを再利用(別ワークブック)", csv_to_xlsx.copy_sheet, False),
+        ("copy_worksheet(同じワークブック)", csv_to_xlsx.copy_sheet, True),
+    ]:
+        tracemalloc.start()
+        timed(label, copy_all, copy_func, same_workbook)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"    ピークメモリ {peak / 1024 / 1024:.1f}MB")
+
+
+def bench_jobs(employees: int = 200, years: int = 1, jobs: int = 0):
+    """従業員ごとの処理を直列とプロセスプールで実行し、時間を比較する"""
+    import csv_to_xlsx
+
+    jobs = jobs or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        make_synthetic_db(tmp_path / "bench.db", employees, years)
+        mapping = synthetic_mapping(employees)
+        for n in (1, jobs):
+            output_file = tmp_path / f"jobs{n}" / "data.xlsm"
+            with redirect_stdout(io.StringIO()):
+                _, elapsed = timed(
+                    "",
+                    csv_to_xlsx.db_to_excel,
+                    2023,
+                    12,
+                    Path(config.TEMPLATE_PATH),
+                    mapping,
+                    output_file,
+                    True,
+                    n,
+                    False,
+                    False,
+                )
+            print(f"--jobs {n}: {elapsed:.3f}秒")
+
+
+def random_punches(rng: random.Random, count: int, start: datetime):
+    """ペアになる打刻と押し忘れが混ざった、時刻順の打刻を作る"""
+    punches = []
+    t = start
+    for _ in range(count):
+        t += timedelta(minutes=rng.choice((1, 30, 240, 600, 1440)))
+        punches.append((rng.choice((RecordType.IN, RecordType.OUT)), t))
+    return punches
+
+
+def pairs_by_strftime(punches) -> dict[str, tuple[list, bool]]:
+    """以前の方法: strftimeで日ごとに分けてmake_pairsでペアにする"""
+    daily = {}
+    for record_type, record_time in punches:
+        daily.setdefault(record_time.strftime(to_csv.TIME_FORMAT), []).append(
+            (record_type, record_time)
+        )
+    return {day: pair_engine.make_pairs(day_punches) for day, day_punches in daily.items()}
+
+
+def bench_pairs(punches: int = 2_000_000):
+    """pair_engineとstrftime + make_pairsでのペアの作成の速度を比較する"""
+    rng = random.Random(0)
+    modes = [False] + ([True] if pair_engine.np is not None else [])
+    sample = random_punches(rng, punches, datetime(2000, 1, 1))
+    times = [t for _, t in sample]
+    types = pair_engine.encode_types(t for t, _ in sample)
+    print(f"打刻数: {punches}")
+    timed("strftime + make_pairs", pairs_by_strftime, sample)
+    for use_numpy in modes:
+        label = "NumPy" if use_numpy else "array"
+        days, _ = timed(f"日付キー ({label})", pair_engine.day_keys, times, use_numpy)
+        timed(f"pair_punches ({label})", pair_engine.pair_punches, types, days, use_numpy)
+
+
+def bench_payroll(employees: int = 100, years: int = 1):
+    """全従業員の1年分の労働時間の集計にかかる時間を計測する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        make_synthetic_db(Path(tmp) / "bench.db", employees, years)
+        mapping = synthetic_mapping(employees)
+        end_date = datetime(2024, 1, 1)
+        start_date = end_date - timedelta(days=365)
+        print(f"従業員数: {employees} 期間: {start_date:%Y/%m/%d}から1年")
+        with redirect_stdout(io.StringIO()):
+            results, elapsed = timed("", payroll.compute_totals, start_date, end_date, mapping)
+        print(f"日ごとの集計からの計算: {elapsed:.3f}秒")
+        total = payroll.sum_totals(r.total for r in results)
+        print(
+            f"合計 労働 {payroll.format_minutes(total.worked)} "
+            f"残業 {payroll.format_minutes(total.overtime)} 要確認 {total.lost}日"
+        )
+
+
+def _peak_rss(path: str, mode: str) -> tuple[int, int]:
+    """子プロセスで全打刻を読み、(件数, 最大RSS(KiB))を返す"""
+    # kioskの設定ではDBファイルをmmapするため、読んだページがRSSに含まれてしまう
+    db_alchemy.Session.configure(bind=db_alchemy.create_db_engine(path, "default"))
+    if mode == "get_all":
+        count = len(AttendanceRecord.get_all())
+    else:
+        count = sum(1 for _ in AttendanceRecord.iter_all())
+    return count, _vm_hwm()
+
+
+def _vm_hwm() -> int:
+    """このプロセスの最大RSS(KiB)
+
+    resource.getrusageのru_maxrssはexec前の親プロセスの分を引き継ぐので、VmHWMを読む
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise RuntimeError("VmHWMを取得できません")
+
+
+def bench_memory(employees: int = 30, years: int = 8):
+    """打刻履歴の年数を増やしながら、全打刻を読むときの最大RSSを比較する
+
+    計測ごとに新しいプロセスで実行する(/proc/self/statusを読むのでLinuxのみ)
+    """
+    context = multiprocessing.get_context("spawn")
+    n = 1
+    while n <= years:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "bench.db"
+            with redirect_stdout(io.StringIO()):
+                engine = make_synthetic_db(path, employees, n)
+            # 接続を閉じてWALをDBファイルに書き戻す(WALのインデックスもmmapされるため)
+            engine.dispose()
+            results = []
+            for mode in ("get_all", "iter_all"):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results.append(executor.submit(_peak_rss, str(path), mode).result())
+            (count, rss_all), (_, rss_stream) = results
+            print(
+                f"{n}年分({count}件): get_all {rss_all / 1024:.1f}MB"
+                f" / iter_all {rss_stream / 1024:.1f}MB"
+            )
+        n *= 2
+
+
+def bench_query(employees: int = 20, years: int = 1):
+    """複数の従業員の打刻をRecordQueryの1回のクエリと従業員ごとのクエリで読む時間を比較する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        make_synthetic_db(Path(tmp) / "bench.db", employees, years)
+        employee_ids = list(range(1, employees + 1))
+        query = RecordQuery().employees(*employee_ids).pay_period(2023, 12)
+        _, batch_time = timed("複数の従業員を1回のクエリで", list, query.iter())
+
+        def per_employee():
+            return [
+                (employee_id, record_type, record_time)
+                for employee_id in employee_ids
+                for record_type, record_time in AttendanceRecord.iter_employee_records(
+                    employee_id, query.start_date, query.end_date
+                )
+            ]
+
+        _, single_time = timed("従業員ごとのクエリ", per_employee)
+        print(f"速度比: {single_time / batch_time:.1f}倍")
+
+
+def _pay_period_by_loop(year: int, month: int) -> tuple[datetime, datetime, list[str]]:
+    """以前のto_csv.pay_period(1日ずつwhileで進める方法)"""
+    one_day = timedelta(days=1)
+    day = config.START_DAY
+    if month == 1:
+        year -= 1
+        month = 13
+    now = datetime(year=year, month=month - 1, day=day)
+    start_date = now
+    period = []
+    while day != config.START_DAY - 1:
+        period.append(now.date().strftime(to_csv.TIME_FORMAT))
+        now += one_day
+        day = now.day
+    period.append(now.date().strftime(to_csv.TIME_FORMAT))
+    return start_date, now + one_day, period
+
+
+def bench_period(repeat: int = 100):
+    """集計期間の計算を以前の方法と比べ、複数年の出力を想定して速度を計測する"""
+    # 1年分(12か月)をrepeat回出力するときの集計期間の計算
+    year_months = [(2030, month) for month in range(1, 13)]
+    timed(
+        "whileループ",
+        lambda: [_pay_period_by_loop(*m) for _ in range(repeat) for m in year_months],
+    )
+    timed(
+        "time_util.pay_period",
+        lambda: [to_csv.pay_period(*m) for _ in range(repeat) for m in year_months],
+    )
+
+
+def bench_batch(employees: int = 30, months: int = 12):
+    """月ごとの出力とbatch_exportでの複数の月の出力を比較する"""
+    import batch_export
+    import csv_to_xlsx
+
+    year_months = time_util.parse_month_range("2023/01-2023/12")[-months:]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        make_synthetic_db(tmp_path / "bench.db", employees, 2)
+        mapping = synthetic_mapping(employees)
+        config.TEMPLATE_PATH = str(Path(config.TEMPLATE_PATH).resolve())
+        mapping_file = tmp_path / "employee_list.txt"
+        mapping_file.write_text(json.dumps(mapping, ensure_ascii=False), "utf-8")
+        config.EMPLOYEE_LIST = str(mapping_file)
+
+        def per_month():
+            for year, month in year_months:
+                output_dir = Path(config.CSV_PATH) / f"{year:04d}-{month:02d}"
+                csv_to_xlsx.db_to_excel(
+                    year,
+                    month,
+                    Path(config.TEMPLATE_PATH),
+                    mapping,
+                    output_dir / "data.xlsm",
+                    True,
+                    incremental=False,
+                )
+
+        config.CSV_PATH = str(tmp_path / "per_month")
+        with redirect_stdout(io.StringIO()):
+            _, single = timed("", per_month)
+        print(f"月ごと({len(year_months)}か月): {single:.2f}秒")
+
+        config.CSV_PATH = str(tmp_path / "batch")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            _, batch = timed(
+                "", batch_export.batch_export, year_months, incremental=False
+            )
+        print(f"batch_export: {batch:.2f}秒 (速度比 {single / batch:.1f}倍)")
+        for line in output.getvalue().splitlines():
+            if line[:4].isdigit():  # 月ごとの時間
+                print("    " + line)
+
+
+def bench_template(repeat: int = 20):
+    """テンプレートの読み込みをload_workbookとキャッシュ(load_template)で比較する"""
+    from openpyxl import load_workbook
+
+    import csv_to_xlsx
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        config.TEMPLATE_CACHE_PATH = str(tmp_path / "cache")
+        template_file = tmp_path / "template.xlsm"
+        template_file.write_bytes(Path(config.TEMPLATE_PATH).read_bytes())
+
+        timed("load_workbook", lambda: [
+            load_workbook(template_file, keep_vba=True) for _ in range(repeat)
+        ])
+        timed("load_template(キャッシュ作成)", csv_to_xlsx.load_template, template_file)
+        timed("load_template", lambda: [
+            csv_to_xlsx.load_template(template_file) for _ in range(repeat)
+        ])
+
+
+def _export_workbook(db_path: str, mode: str, output_file: str, employees: int):
+    """子プロセスでワークブックを作成し、(秒数, 最大RSS(KiB))を返す"""
+    import csv_to_xlsx
+
+    db_alchemy.Session.configure(bind=db_alchemy.create_db_engine(db_path, "default"))
+    config.TEMPLATE_CACHE_PATH = str(Path(output_file).parent.parent / "cache")
+    export = (
+        csv_to_xlsx.stream_rows_to_excel
+        if mode == "stream"
+        else csv_to_xlsx.rows_to_excel
+    )
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        export(
+            2023,
+            12,
+            to_csv.iter_employee_rows(2023, 12),
+            Path(config.TEMPLATE_PATH),
+            synthetic_mapping(employees),
+            Path(output_file),
+        )
+    return time.perf_counter() - start, _vm_hwm()
+
+
+def bench_stream(employees: int = 300):
+    """通常のモードと書き込み専用モードでワークブックの作成の時間・メモリを比較する
+
+    計測ごとに新しいプロセスで実行する(/proc/self/statusを読むのでLinuxのみ)
+    """
+    context = multiprocessing.get_context("spawn")
+    config.TEMPLATE_PATH = str(Path(config.TEMPLATE_PATH).resolve())
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        with redirect_stdout(io.StringIO()):
+            engine = make_synthetic_db(tmp_path / "bench.db", employees, 1)
+        engine.dispose()
+        for mode in ("normal", "stream"):
+            output_file = tmp_path / mode / "data.xlsm"
+            output_file.parent.mkdir()
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                elapsed, rss = executor.submit(
+                    _export_workbook,
+                    str(tmp_path / "bench.db"),
+                    mode,
+                    str(output_file),
+                    employees,
+                ).result()
+            print(f"{mode}: {elapsed:.2f}秒 最大RSS {rss / 1024:.1f}MB")
+
+
+def _write_rows_by_cell(ws, rows) -> int:
+    """1セルずつ読み書きする(比較用の以前の方法 見るセルは書き込むセルに直してある)"""
+    cells = 0
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, value in enumerate(row, start=1):
+            cell_value = ws[row_idx][col_idx - 1].value
+            if cell_value in [None, "", to_csv.BLANK, to_csv.LOST]:
+                ws.cell(row=row_idx, column=col_idx, value=value)
+                cells += 1
+    return cells
+
+
+def bench_cells(employees: int = 30, months: int = 12):
+    """1年分のワークブックに同じ期間をもう一度書き込むときの、シートへの書き込みを比較する"""
+    from openpyxl import load_workbook
+
+    import batch_export
+    import csv_to_xlsx
+
+    year_months = time_util.parse_month_range("2023/01-2023/12")[-months:]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        with redirect_stdout(io.StringIO()):
+            make_synthetic_db(tmp_path / "bench.db", employees, 2)
+        config.TEMPLATE_PATH = str(Path(config.TEMPLATE_PATH).resolve())
+        config.TEMPLATE_CACHE_PATH = str(tmp_path / "cache")
+        mapping_file = tmp_path / "employee_list.txt"
+        mapping_file.write_text(
+            json.dumps(synthetic_mapping(employees), ensure_ascii=False), "utf-8"
+        )
+        config.EMPLOYEE_LIST = str(mapping_file)
+        config.CSV_PATH = str(tmp_path / "csv")
+        with redirect_stdout(io.StringIO()):
+            batch_export.batch_export(year_months, write_csv=False, incremental=False)
+
+        # 押し忘れを後から直した場合を想定して、一部のセルを押し忘れの表示に戻しておく
+        rng = random.Random(0)
+        for year, month in year_months:
+            path = Path(config.CSV_PATH) / f"{year:04d}-{month:02d}" / "data.xlsm"
+            wb = load_workbook(path, keep_vba=True)
+            for ws in wb.worksheets[1:]:
+                for _ in range(5):
+                    ws.cell(row=rng.randint(2, 32), column=rng.randint(2, 5), value=to_csv.LOST)
+            wb.save(path)
+
+        elapsed = {"cell": 0.0, "diff": 0.0}
+        cells = {"cell": 0, "diff": 0}
+        writers = {
+            "cell": _write_rows_by_cell,
+            "diff": csv_to_xlsx.write_rows_to_sheet,
+        }
+        for year, month, employee_rows in to_csv.iter_months_rows(year_months):
+            path = Path(config.CSV_PATH) / f"{year:04d}-{month:02d}" / "data.xlsm"
+            for mode, write in writers.items():
+                wb = load_workbook(path, keep_vba=True)
+                start = time.perf_counter()
+                for employee_name, rows in employee_rows:
+                    cells[mode] += write(wb[employee_name], rows)
+                elapsed[mode] += time.perf_counter() - start
+
+        print(f"{len(year_months)}か月 x {employees}人のシートへの書き込み")
+        print(f"1セルずつ: {elapsed['cell']:.3f}秒 {cells['cell']}セルを書き込み")
+        print(
+            f"差分: {elapsed['diff']:.3f}秒 {cells['diff']}セルを変更"
+            f" (速度比 {elapsed['cell'] / elapsed['diff']:.1f}倍)"
+        )
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            _, rerun = timed(
+                "", batch_export.batch_export, year_months, False, True, False
+            )
+        print(f"batch_exportでの再出力(--full --xlsx): {rerun:.2f}秒")
+        for line in output.getvalue().splitlines():
+            if "セルを変更" in line:
+                print("    " + line.split("(")[-1].rstrip(")"))
+
+
+# 子プロセスでmain.pyと同じ手順でウィンドウを表示し、描画までとNFCリーダーの準備までの時間を測る
+# eagerでは以前と同じように、すべて読み込んで準備してからウィンドウを表示する
+STARTUP_SCRIPT = """
+import json, os, sys, time
+t0 = float(os.environ["BENCH_T0"])
+eager = sys.argv[1] == "eager"
+if eager:
+    import nfc, nfc_reader_QThread, db_alchemy, punch_writer, punch_dialog, register_dialog
+import main
+app = main.QApplication([])
+window = main.MainWindow()
+if eager:
+    window.start_services()
+window.show()
+app.processEvents()
+painted = time.time() - t0
+if not eager:
+    window.start_services()
+ready = time.time() - t0
+window.close()
+print(json.dumps({"painted": painted, "ready": ready}))
+"""
+
+
+def _parse_importtime(stderr: str) -> list[tuple[int, str]]:
+    """-X importtimeの出力から、直接importされたモジュールの(累積マイクロ秒, 名前)を返す"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+def bench_startup(runs: int = 5):
+    """main.pyの起動から時計の描画・NFCリーダーの準備までの時間を計測する
+
+    子プロセスを画面なし(QT_QPA_PLATFORM=offscreen)で起動する。
+    -X importtimeで読み込みに時間のかかったモジュールも表示する
+    """
+    repo = Path(__file__).resolve().parent
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        # 本番のデータベース・ジャーナルに触らないよう、一時フォルダで起動する
+        with redirect_stdout(io.StringIO()):
+            engine = make_synthetic_db(tmp_path / config.DATABASE_PATH, 10, 1)
+        engine.dispose()
+        env = dict(
+            os.environ,
+            QT_QPA_PLATFORM="offscreen",
+            PYTHONPATH=str(repo),
+            PYTHONDONTWRITEBYTECODE="1",
+        )
+
+        def run(mode: str, *options: str) -> tuple[dict, str]:
+            env["BENCH_T0"] = repr(time.time())
+            proc = subprocess.run(
+                [sys.executable, *options, "-c", STARTUP_SCRIPT, mode],
+                cwd=tmp,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            return json.loads(proc.stdout.splitlines()[-1]), proc.stderr
+
+        results = {
+            mode: [run(mode)[0] for _ in range(runs)] for mode in ("eager", "lazy")
+        }
+        # importtimeの計測自体が遅くなるので、時間の計測とは別に1回起動する
+        _, profile = run("lazy", "-X", "importtime")
+
+    for mode, mode_results in results.items():
+        painted = statistics.median(r["painted"] for r in mode_results)
+        ready = statistics.median(r["ready"] for r in mode_results)
+        print(f"{mode}: 時計の描画まで {painted:.3f}秒 NFCリーダーの準備まで {ready:.3f}秒")
+
+    print("読み込みに時間のかかったモジュール(-X importtime 累積):")
+    for cumulative, name in sorted(_parse_importtime(profile), reverse=True)[:10]:
+        print(f"    {cumulative / 1000:8.1f}ms {name}")
+
+
+def _run_clock(display_class, seconds: int) -> dict:
+    """時計のラベルをseconds秒動かし、更新のたびの時刻と表示を記録する"""
+    from PySide6.QtCore import QEventLoop, QTimer
+    from PySide6.QtWidgets import QLabel
+
+    ticks = []  # (更新した時刻, 表示)
+    counts = {"set_text": 0}
+
+    class Recorded(display_class):
+        def update_time(self):
+            super().update_time()
+            ticks.append((time.time(), self.text()))
+
+    def counted(set_text):
+        def wrapper(text):
+            counts["set_text"] += 1
+            set_text(text)
+
+        return wrapper
+
+    display = Recorded()
+    # 日付と時刻が別々のラベルなら、それぞれのsetTextを数える
+    labels = [display] if isinstance(display, QLabel) else display.findChildren(QLabel)
+    for label in labels:
+        label.setText = counted(label.setText)
+    display.show()
+    loop = QEventLoop()
+    QTimer.singleShot(seconds * 1000, loop.quit)
+    wall, cpu = time.perf_counter(), time.process_time()
+    loop.exec()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    display.timer.stop()
+    display.close()
+
+    shown = [int(text[-8:-6]) * 3600 + int(text[-5:-3]) * 60 + int(text[-2:]) for _, text in ticks]
+    steps = [b - a for a, b in zip(shown, shown[1:])]
+    # 秒が変わってから表示が変わるまでの遅れ
+    lateness = [(t % 1) * 1000 for t, _ in ticks[1:]]
+    return {
+        "ticks": len(ticks),
+        "set_text": counts["set_text"],
+        "skipped": sum(step > 1 for step in steps),
+        "repeated": sum(step == 0 for step in steps),
+        "late_mean": statistics.mean(lateness),
+        "late_max": max(lateness),
+        "cpu": cpu / wall * 100,
+    }
+
+
+def bench_clock(seconds: int = 10, repeat: int = 100_000):
+    """時計の表示の更新を以前の方法(1000ミリ秒ごとのタイマーとstrftime)と比較する
+
+    秒が飛んだ・同じ秒を表示した回数、秒の変わり目から表示までの遅れ、CPU使用率を表示する
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication, QLabel
+
+    import main_window
+
+    class OldTimeDisplay(QLabel):
+        def __init__(self):
+            super().__init__()
+            self.setStyleSheet(config.StyleSheets.time_display)
+            self.timer = QTimer()
+            self.timer.timeout.connect(self.update_time)
+            self.timer.start(1000)
+            self.update_time()
+
+        def update_time(self):
+            current_time = time_util.current_time()
+            self.setText(time_util.datetime_to_string(current_time, "%m/%d %H:%M:%S"))
+
+    app = QApplication.instance() or QApplication([])
+    for label, display_class in (
+        ("以前", OldTimeDisplay),
+        ("LocalClock", main_window.TimeDisplay),
+    ):
+        r = _run_clock(display_class, seconds)
+        print(
+            f"{label}: {seconds}秒で{r['ticks']}回更新 setText {r['set_text']}回 "
+            f"秒が飛んだ {r['skipped']}回 同じ秒 {r['repeated']}回 "
+            f"遅れ 平均{r['late_mean']:.1f}ms 最大{r['late_max']:.1f}ms "
+            f"CPU {r['cpu']:.2f}%"
+        )
+
+    clock = time_util.LocalClock()
+    timestamps = [time.time() + i * 0.37 for i in range(repeat)]
+    _, by_strftime = timed(
+        f"strftime {repeat}回",
+        lambda: [
+            datetime.fromtimestamp(t, time_util.TZ).strftime("%m/%d %H:%M:%S")
+            for t in timestamps
+        ],
+    )
+    _, by_clock = timed(
+        f"LocalClock {repeat}回", lambda: [clock.text(t) for t in timestamps]
+    )
+    print(f"速度比 {by_strftime / by_clock:.1f}倍")
+    app.processEvents()
+
+
+def _tap_to_paint(dialog, ic_card_id: str) -> float:
+    """ダイアログに打刻を表示し、描画されるまでの秒数を返す"""
+    from PySide6.QtWidgets import QApplication
+
+    read_at = time.perf_counter()
+    employee, last_state = IC_Card.find_employee_and_state(ic_card_id)
+    dialog.bind(employee, last_state, time_util.current_time(), read_at)
+    dialog.show()
+    painted = len(dialog.latencies)
+    while len(dialog.latencies) == painted:
+        QApplication.processEvents()
+    elapsed = time.perf_counter() - read_at
+    dialog.reject()
+    return elapsed
+
+
+def bench_punch(taps: int = 30):
+    """タップのたびにPunchDialogを作る場合と、1つを使い回す場合の描画までの時間を比較する"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # offscreenはウィンドウのサイズの通知に対応していないという警告を出さない
+    os.environ.setdefault("QT_LOGGING_RULES", "default.warning=false")
+    from PySide6.QtWidgets import QApplication
+
+    from punch_dialog import PunchDialog
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        with redirect_stdout(io.StringIO()):
+            engine = make_synthetic_db(Path(tmp) / "bench.db", 3, 1)
+            cards = []
+            for employee in Employee.get_all():
+                cards.append(f"BENCH_CARD_{employee.employee_id}")
+                IC_Card.assign(cards[-1], employee)
+            db_alchemy.card_resolver.preload()
+
+        results = {}
+        with redirect_stdout(io.StringIO()):
+            # 最初の1回はフォントなどの読み込みを含むので計測しない
+            _tap_to_paint(PunchDialog(), cards[0])
+            results["new"] = [
+                _tap_to_paint(PunchDialog(), cards[i % len(cards)]) for i in range(taps)
+            ]
+            dialog = PunchDialog()
+            results["reuse"] = [
+                _tap_to_paint(dialog, cards[i % len(cards)]) for i in range(taps)
+            ]
+        engine.dispose()
+
+    for label, key in (("タップごとに作成", "new"), ("使い回し", "reuse")):
+        elapsed = [r * 1000 for r in results[key]]
+        print(
+            f"{label}: 読み取りから描画まで 中央値{statistics.median(elapsed):.1f}ms "
+            f"最大{max(elapsed):.1f}ms"
+        )
+    app.processEvents()
+
+
+BENCHMARKS = {
+    "export": bench_export,
+    "nfc": bench_nfc,
+    "engine": bench_engine,
+    "sheets": bench_sheets,
+    "jobs": bench_jobs,
+    "pairs": bench_pairs,
+    "payroll": bench_payroll,
+    "memory": bench_memory,
+    "query": bench_query,
+    "period": bench_period,
+    "batch": bench_batch,
+    "template": bench_template,
+    "stream": bench_stream,
+    "cells": bench_cells,
+    "startup": bench_startup,
+    "clock": bench_clock,
+    "punch": bench_punch,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(__doc__)
+        exit()
+    BENCHMARKS[sys.argv[1]](*map(int, sys.argv[2:]))
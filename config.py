@@ -11,7 +11,35 @@ DATABASE_PATH = "nfc_records.db"  # データベースファイルのパス
 EMPLOYEE_LIST = "employee_list.txt"  # 従業員名、対応するテンプレート
 CSV_PATH = "csv"  # csvファイルの出力フォルダ(このフォルダを親フォルダとしてYYYY-MMの子フォルダを作成します)
 TEMPLATE_PATH = "template.xlsm"
+TEMPLATE_CACHE_PATH = ".template_cache"  # 解析済みのテンプレートを保存するフォルダ
 LOG_FILE_PATH: str = "application.log"  # ログファイルの設定(未実装)
+PUNCH_JOURNAL_PATH = "punch_journal.jsonl"  # DBに書き込む前の打刻を記録するファイル
+
+# データベース(SQLite)の設定
+# 打刻アプリ・to_csv.py・csv_to_xlsx.pyを同時に動かしても"database is locked"にならないよう、
+# WALモードにして、ロック中は busy_timeout(ミリ秒)まで待つ
+DATABASE_PROFILE = "kiosk"
+DATABASE_PROFILES: dict[str, dict] = {
+    "default": {},  # SQLiteの既定値のまま
+    "kiosk": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",  # WALモードなら電源断でもDBは壊れない
+        "busy_timeout": 5000,
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -8000,  # 負の値はKiB単位(約8MB)
+    },
+}
+
+# 給与計算の設定(payroll.py)
+# 深夜の時間帯 22時から翌5時まで 変更したら python db_alchemy.py rebuild で日ごとの集計を作り直す
+NIGHT_HOURS: tuple[int, int] = (22, 5)
+# テンプレート種別(EMPLOYEE_LISTの値)ごとの計算方法
+# overtime_after: 1日の労働時間(分)がこれを超えた分を残業とする Noneなら残業を計算しない
+PAYROLL_RULES: dict[str, dict] = {
+    "正社員": {"overtime_after": 8 * 60},
+    "パート": {"overtime_after": 8 * 60},
+    "ドクター": {"overtime_after": None},
+}
 
 # GUIの設定
 WINDOW_SIZE: tuple[int, int] = (480, 400)  # ウィンドウのサイズ
@@ -26,11 +54,19 @@ class StyleSheets:
     bg_punch_out: str = (
         "font-size: 24px; font-weight:bold; background-color: #2C3E50; color: white;"
     )
+    # 打刻確認のダイアログに1回だけ設定し、status(出勤/退勤)のプロパティで切り替える
+    punch_dialog: str = (
+        f'QDialog[status="IN"], QDialog[status="IN"] * {{ {bg_punch_in} }}\n'
+        f'QDialog[status="OUT"], QDialog[status="OUT"] * {{ {bg_punch_out} }}'
+    )
 
 
 # 自動で閉じるウィンドウのタイマー設定
 TIME_OUT: int = 10
 
+# 同じICカードのタップを無視する時間(秒) 打刻確認の表示時間(TIME_OUT)より長くする
+DUPLICATE_TAP_WINDOW: int = 30
+
 
 class MessageTexts:
 
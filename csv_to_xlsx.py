@@ -1,41 +1,33 @@
 import csv
+import hashlib
+import io
 import json
-from openpyxl import load_workbook
+import pickle
+import zipfile
+from xml.etree import ElementTree
+import openpyxl
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.workbook.defined_name import DefinedName
 from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl.formatting.rule import FormulaRule
 from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.xml.constants import SHEET_MAIN_NS
 from pathlib import Path
 import config
 import to_csv
 import time_util
-from openpyxl.styles import Font, PatternFill, Border, Alignment
+from openpyxl.styles.cell_style import StyleArray
+from copy import copy, deepcopy
+from typing import Iterable, Optional
+import argparse
 import sys
 
 PRINT_AREA = "O1:V38"
 VALIDATE_AREA = CellRange("G2:G33")
 HIGHLIGHT_AREA = CellRange("A2:G33")
-
-
-def load_employee_mapping(file_path: Path) -> dict:
-    """
-    従業員名とテンプレート種別のマッピング情報を読み込む。
-
-    Args:
-        file_path (Path): JSON形式のマッピングファイルパス
-
-    Returns:
-        dict: 従業員名とテンプレート種別のマッピング
-    """
-    try:
-        with file_path.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"{file_path} が見つかりません。")
-        exit()
-    except json.JSONDecodeError:
-        print(f"{file_path} の形式が正しくありません。")
-        exit()
+# CSVの値で上書きしてよいセルの値(入力されたことがないか、未定・押し忘れの表示)
+OVERWRITABLE_VALUES = (None, "", to_csv.BLANK, to_csv.LOST)
 
 
 def get_csv_files(folder_path: Path) -> list:
@@ -52,30 +44,149 @@ def get_csv_files(folder_path: Path) -> list:
         print(f"フォルダ {folder_path} が存在しません。")
         exit()
 
-    return [file for file in folder_path.iterdir() if file.suffix == ".csv"]
+    # 出力するシートの順番がファイルシステムによらないように並べ替える
+    return sorted(file for file in folder_path.iterdir() if file.suffix == ".csv")
+
 
+def read_csv_rows(csv_path: Path) -> list[list[str]]:
+    """CSVファイルの行をすべて読み込む"""
+    # to_csvはBOM付きで書き出すので、BOMを取り除いて読み込む
+    with csv_path.open(mode="r", encoding="utf-8-sig") as f:
+        return list(csv.reader(f))
 
-def write_csv_to_sheet(ws, csv_path: Path):
+
+def write_csv_to_sheet(ws, csv_path: Path) -> int:
     """
     CSVの内容を指定されたシートに書き込む。
 
     Args:
         ws (Worksheet): 書き込み先のシート
         csv_path (Path): CSVファイルのパス
+
+    Returns:
+        int: 値を変更したセルの数
+    """
+    with csv_path.open(mode="r", encoding="utf-8-sig") as f:
+        return write_rows_to_sheet(ws, csv.reader(f))
+
+
+def diff_rows(current_rows: Iterable[tuple], rows: Iterable[list[str]]):
+    """
+    シートの今の値とCSVの行を比べて、書き込むセルを返す。
+
+    今まで入力されたことのないセルと、未定・押し忘れの表示のセルだけを上書きする。
+    手で修正した時刻や備考はそのまま残し、値が同じセルは書き込まない。
+
+    Args:
+        current_rows (Iterable[tuple]): 1行目からのシートの値(iter_rowsのvalues_onlyと同じ形式)
+        rows (Iterable[list[str]]): to_csv.make_rowsが返す形式の行
+
+    Yields:
+        tuple[int, int, str]: (行番号, 列番号, 値) 行番号・列番号は1から始まる
+    """
+    for row_idx, (current, row) in enumerate(zip(current_rows, rows), start=1):
+        for col_idx, (cell_value, value) in enumerate(zip(current, row), start=1):
+            if cell_value != value and cell_value in OVERWRITABLE_VALUES:
+                yield row_idx, col_idx, value
+
+
+def write_rows_to_sheet(ws, rows: Iterable[list[str]]) -> int:
+    """
+    CSVの行と同じ形式の行を指定されたシートに書き込む。
+
+    書き込む範囲の今の値をiter_rowsで一度に読み、diff_rowsで変わるセルだけを書き込む。
+
+    Args:
+        ws (Worksheet): 書き込み先のシート
+        rows (Iterable[list[str]]): to_csv.make_rowsが返す形式の行
+
+    Returns:
+        int: 値を変更したセルの数
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    current_rows = ws.iter_rows(
+        min_row=1,
+        max_row=len(rows),
+        max_col=max(len(row) for row in rows),
+        values_only=True,
+    )
+    # 読み終えてから書き込む
+    changes = list(diff_rows(current_rows, rows))
+    for row_idx, col_idx, value in changes:
+        ws.cell(row=row_idx, column=col_idx, value=value)
+    return len(changes)
+
+
+def load_template(template_file: Path) -> Workbook:
+    """テンプレートのワークブックを読み込む
+
+    load_workbookで解析したワークブックをconfig.TEMPLATE_CACHE_PATHにpickleで保存しておき、
+    2回目以降は解析せずにそれを読み込む。キャッシュはテンプレートのパス・更新日時・サイズと
+    openpyxl・Pythonのバージョンで区別するので、テンプレートを読まずにキャッシュを選べる。
+    キャッシュが読めない場合(バージョンの違いや壊れたファイル)はテンプレートから作り直す。
+    VBAのパーツ(vba_archive)はZipFileのままではpickleできないので、中身のバイト列を一緒に保存する。
+    呼び出すたびに別のワークブックを返すので、変更しても他に影響しない
+
+    Args:
+        template_file (Path): テンプレートExcelファイルのパス
+
+    Returns:
+        Workbook: keep_vba=Trueで読み込んだのと同じワークブック
     """
-    with csv_path.open(mode="r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        for row_idx, row in enumerate(reader, start=1):  # 行番号は1から始まる
-            for col_idx, value in enumerate(row, start=1):  # 列番号は1から始まる
-                cell_value = ws[row_idx][col_idx].value
-                if cell_value in [None, "", to_csv.BLANK, to_csv.LOST]:
-                    # 今まで入力されたことのないセル、もしくはLOSTのセルのみ入力する
-                    ws.cell(row=row_idx, column=col_idx, value=value)
+    cache_dir = Path(config.TEMPLATE_CACHE_PATH)
+    stat = template_file.stat()
+    key = json.dumps(
+        [
+            str(template_file.resolve()),
+            stat.st_mtime_ns,
+            stat.st_size,
+            openpyxl.__version__,
+            list(sys.version_info[:2]),
+        ]
+    )
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    cache_file = cache_dir / f"{template_file.name}.{digest}.pickle"
+
+    try:
+        with cache_file.open("rb") as f:
+            wb, vba_data = pickle.load(f)
+    except FileNotFoundError:
+        wb = None
+    except Exception as e:
+        print(f"テンプレートのキャッシュ {cache_file} を読み込めないため作り直します: {e}")
+        wb = None
+    if wb is None:
+        wb = load_workbook(template_file, keep_vba=True)
+        # load_workbookが作ったメモリ上のZipFileを閉じて、中身をバイト列として取り出す
+        vba_buffer = wb.vba_archive.fp
+        wb.vba_archive.close()
+        vba_data = vba_buffer.getvalue()
+        wb.vba_archive = None
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        # 書きかけのファイルを読まないよう、書き終えてから置き換える
+        temp_file = cache_file.with_suffix(".tmp")
+        with temp_file.open("wb") as f:
+            pickle.dump((wb, vba_data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        temp_file.replace(cache_file)
+        # 同じテンプレートの古いキャッシュを削除する
+        for old_file in cache_dir.glob(f"{template_file.name}.*.pickle"):
+            if old_file != cache_file:
+                old_file.unlink(missing_ok=True)
+
+    wb.vba_archive = zipfile.ZipFile(io.BytesIO(vba_data))
+    return wb
 
 
 def copy_sheet(source_ws, target_wb, target_name):
     """
-    wb1のws1シートをwb2にコピーする。値、書式、列の幅、行の高さを含む。
+    wb1のws1シートをwb2にコピーする。値、書式、列の幅、行の高さ、
+    結合セル、印刷・ページの設定、シートの設定を含む。
+
+    コピー元が同じワークブックのシートならopenpyxlのcopy_worksheetでコピーする。
+    別のワークブックの場合、書式は種類ごとに1回だけ作成し、
+    同じ書式のセルにはワークブック内の共有スタイルのインデックスを使い回す。
 
     Args:
         source_ws (Worksheet): コピー元のシート
@@ -85,63 +196,43 @@ def copy_sheet(source_ws, target_wb, target_name):
     Returns:
         bool: コピーに成功すればTrue,すでに存在していた場合False
     """
-    # 新しいシートを作成
     if target_name in target_wb.sheetnames:
         return False
+
+    if source_ws.parent is target_wb:
+        # 同じワークブック内ならスタイルのインデックスをそのままコピーできる
+        ws2 = target_wb.copy_worksheet(source_ws)
+        ws2.title = target_name
+        return True
+
+    # 新しいシートを作成
     ws2 = target_wb.create_sheet(target_name)
 
+    # コピー元のスタイル -> コピー先のワークブックでのスタイル
+    styles: dict[tuple, StyleArray] = {}
+
     # セルの値と書式をコピー
     for row in source_ws.iter_rows():
         for cell in row:
             # 新しいシートにセルの値をコピー
-            new_cell = ws2[cell.coordinate]
-            new_cell.value = cell.value
+            new_cell = ws2.cell(row=cell.row, column=cell.column, value=cell.value)
+            if not cell.has_style:
+                continue
+
+            key = tuple(cell._style)
+            style = styles.get(key)
+            if style is not None:
+                new_cell._style = copy(style)
+                continue
 
             # スタイル（フォント、色、罫線、配置など）をコピー
-            if cell.font:
-                new_cell.font = Font(
-                    name=cell.font.name,
-                    size=cell.font.size,
-                    bold=cell.font.bold,
-                    italic=cell.font.italic,
-                    vertAlign=cell.font.vertAlign,
-                    underline=cell.font.underline,
-                    strike=cell.font.strike,
-                    color=cell.font.color,
-                )
-
-            if cell.fill:
-                new_cell.fill = PatternFill(
-                    patternType=cell.fill.patternType,
-                    fgColor=cell.fill.fgColor,
-                    bgColor=cell.fill.bgColor,
-                )
-
-            if cell.border:
-                new_cell.border = Border(
-                    left=cell.border.left,
-                    right=cell.border.right,
-                    top=cell.border.top,
-                    bottom=cell.border.bottom,
-                    diagonal=cell.border.diagonal,
-                    outline=cell.border.outline,
-                    vertical=cell.border.vertical,
-                    horizontal=cell.border.horizontal,
-                )
-
-            if cell.alignment:
-                new_cell.alignment = Alignment(
-                    horizontal=cell.alignment.horizontal,
-                    vertical=cell.alignment.vertical,
-                    textRotation=cell.alignment.textRotation,
-                    wrapText=cell.alignment.wrapText,
-                    shrinkToFit=cell.alignment.shrinkToFit,
-                    indent=cell.alignment.indent,
-                    relativeIndent=cell.alignment.relativeIndent,
-                )
-
-            if cell.number_format:
-                new_cell.number_format = cell.number_format
+            new_cell.font = copy(cell.font)
+            new_cell.fill = copy(cell.fill)
+            new_cell.border = copy(cell.border)
+            new_cell.alignment = copy(cell.alignment)
+            new_cell.protection = copy(cell.protection)
+            new_cell.number_format = cell.number_format
+            styles[key] = copy(new_cell._style)
 
     # 列幅をコピー
     for col_letter, column_dimension in source_ws.column_dimensions.items():
@@ -151,6 +242,14 @@ def copy_sheet(source_ws, target_wb, target_name):
     for row_number, row_dimension in source_ws.row_dimensions.items():
         ws2.row_dimensions[row_number].height = row_dimension.height
 
+    # copy_worksheetと同じく、結合セル・印刷とページの設定・シートの設定をコピー
+    ws2.sheet_format = copy(source_ws.sheet_format)
+    ws2.sheet_properties = copy(source_ws.sheet_properties)
+    ws2.merged_cells = copy(source_ws.merged_cells)
+    ws2.page_margins = copy(source_ws.page_margins)
+    ws2.page_setup = copy(source_ws.page_setup)
+    ws2.print_options = copy(source_ws.print_options)
+
     return True
 
 
@@ -171,8 +270,8 @@ def initialize_sheet(ws) -> None:
     validation.errorTitle = "入力エラー"
     validation.prompt = "選択肢から選んでください"
     validation.promptTitle = "備考欄の入力"
-    # シートに入力規則を追加
-    ws.add_data_validation(validation)
+    # シートに入力規則を追加(書き込み専用のシートにはadd_data_validationがない)
+    ws.data_validations.append(validation)
     validation.add(VALIDATE_AREA)
 
     # 条件付き書式の追加 なぜかうまくいかない
@@ -182,7 +281,12 @@ def initialize_sheet(ws) -> None:
 
 
 def csv_to_excel(
-    folder_path: Path, template_file: Path, employee_mapping: dict, output_file: Path
+    folder_path: Path,
+    template_file: Path,
+    employee_mapping: dict,
+    output_file: Path,
+    incremental: bool = True,
+    streaming: bool = False,
 ):
     """
     CSVデータを従業員名に対応するテンプレートシートに書き込む。
@@ -192,51 +296,209 @@ def csv_to_excel(
         template_file (Path): テンプレートExcelファイルのパス
         employee_mapping (dict): 従業員名とテンプレートのマッピング
         output_file (Path): 出力されるExcelファイルのパス
+        incremental (bool): Trueなら前回から内容が変わった従業員のシートだけを書き込む
+        streaming (bool): Trueなら書き込み専用モード(stream_rows_to_excel)で作成する
+                          既存のファイルがありincrementalがTrueなら通常のモードで更新する
     """
     year = int(folder_path.name.split("-")[0])
     month = int(folder_path.name.split("-")[1])
 
-    # テンプレートファイルを読み込む
-    if not template_file.exists():
-        print(f"テンプレートファイル {template_file} が存在しません。")
-        return
-
-    template = load_workbook(template_file, keep_vba=True)
-    temp_types = template.sheetnames
-    if not output_file.exists():
-        template.save(output_file)
-
-    wb = load_workbook(output_file, keep_vba=True)
-    wb.defined_names["year"] = DefinedName(name="year", attr_text=year)
-    wb.defined_names["month"] = DefinedName(name="month", attr_text=month)
-
     # CSVファイルを取得
     csv_files = get_csv_files(folder_path)
     if not csv_files:
         print("指定されたフォルダにCSVファイルがありません。")
         return
 
-    # 各CSVファイルを処理
-    for csv_file in csv_files:
-        employee_name = csv_file.stem
-        template_type = employee_mapping.get(employee_name)
+    # CSVはシートに書き込むときに1ファイルずつ読む
+    employee_rows = (
+        (csv_file.stem, read_csv_rows(csv_file)) for csv_file in csv_files
+    )
 
+    if use_streaming(streaming, output_file, incremental):
+        stream_rows_to_excel(
+            year, month, employee_rows, template_file, employee_mapping, output_file
+        )
+        return
+    rows_to_excel(
+        year,
+        month,
+        employee_rows,
+        template_file,
+        employee_mapping,
+        output_file,
+        incremental,
+    )
+
+
+def db_to_excel(
+    year: int,
+    month: int,
+    template_file: Path,
+    employee_mapping: dict,
+    output_file: Path,
+    write_csv: bool = False,
+    jobs: int = 1,
+    incremental: bool = True,
+    use_summary: bool = True,
+    streaming: bool = False,
+):
+    """
+    CSVファイルを経由せずに、データベースの勤怠記録を直接ワークブックに書き込む。
+
+    Args:
+        year (int): 年
+        month (int): 月
+        template_file (Path): テンプレートExcelファイルのパス
+        employee_mapping (dict): 従業員名とテンプレートのマッピング
+        output_file (Path): 出力されるExcelファイルのパス
+        write_csv (bool): Trueなら従業員ごとのCSVも出力フォルダに書き出す
+        jobs (int): 打刻から作るときに、打刻の読み込み・ペアリング・行の作成を並列に行うプロセス数
+                    use_summaryがTrueなら1にする
+        incremental (bool): Trueなら前回から内容が変わった従業員のシート・CSVだけを書き込む
+        use_summary (bool): Trueなら打刻の代わりに日ごとの集計(DailySummary)を読む
+        streaming (bool): Trueなら書き込み専用モード(stream_rows_to_excel)で作成する
+                          既存のファイルがありincrementalがTrueなら通常のモードで更新する
+    """
+    to_csv.check_jobs(jobs, use_summary)
+    output_dir = output_file.parent
+    output_dir.mkdir(exist_ok=True, parents=True)
+    csv_written = to_csv.load_manifest(output_dir)["csv"]
+
+    def employee_rows():
+        for employee_name, rows in to_csv.iter_employee_rows(
+            year, month, jobs, use_summary
+        ):
+            digest = to_csv.rows_hash(rows)
+            if write_csv and not (
+                incremental
+                and csv_written.get(employee_name) == digest
+                and (output_dir / f"{employee_name}.csv").exists()
+            ):
+                to_csv.write_employee_csv(output_dir, employee_name, rows)
+                csv_written[employee_name] = digest
+            yield employee_name, rows
+
+    if use_streaming(streaming, output_file, incremental):
+        stream_rows_to_excel(
+            year, month, employee_rows(), template_file, employee_mapping, output_file
+        )
+    else:
+        rows_to_excel(
+            year,
+            month,
+            employee_rows(),
+            template_file,
+            employee_mapping,
+            output_file,
+            incremental,
+        )
+    if write_csv:
+        manifest = to_csv.load_manifest(output_dir)
+        manifest["csv"] = csv_written
+        to_csv.save_manifest(output_dir, manifest)
+
+
+def sheet_names(workbook_file: Path) -> list[str]:
+    """ワークブックを読み込まずに、シート名だけをxl/workbook.xmlから読む"""
+    with zipfile.ZipFile(workbook_file) as archive:
+        root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in root.iter(f"{{{SHEET_MAIN_NS}}}sheet")]
+
+
+def rows_to_excel(
+    year: int,
+    month: int,
+    employee_rows: Iterable[tuple[str, list[list[str]]]],
+    template_file: Path,
+    employee_mapping: dict,
+    output_file: Path,
+    incremental: bool = True,
+    template: Optional[Workbook] = None,
+):
+    """
+    従業員ごとの行を従業員名に対応するテンプレートシートに書き込む。
+
+    出力フォルダのマニフェストに前回書き込んだ行のハッシュ値を記録しておき、
+    incrementalがTrueなら内容が変わった従業員のシートだけを書き込む。
+    employee_rowsは1人ずつ読んでその場でシートに書き込むので、全員分の行をためない。
+    ワークブックは最初に書き込むシートが見つかった時点で開き、
+    1人も変わっていなければワークブックを開かずに終了する。
+
+    Args:
+        year (int): 年
+        month (int): 月
+        employee_rows (Iterable[tuple[str, list[list[str]]]]): (従業員名, 行)
+        template_file (Path): テンプレートExcelファイルのパス
+        employee_mapping (dict): 従業員名とテンプレートのマッピング
+        output_file (Path): 出力されるExcelファイルのパス
+        incremental (bool): Falseなら変更のない従業員のシートも書き込む
+        template (Optional[Workbook]): 読み込み済みのテンプレート
+                                       複数の月をまとめて出力するときに使い回す
+    """
+    # テンプレートファイルを読み込む
+    if template is None and not template_file.exists():
+        print(f"テンプレートファイル {template_file} が存在しません。")
+        return
+
+    written = to_csv.load_manifest(output_file.parent)["xlsx"]
+    existing_sheets = set()
+    if output_file.exists():
+        existing_sheets = set(sheet_names(output_file))
+    else:
+        written = {}
+
+    wb = None
+    changed = 0  # 書き込んだシートの数
+    cells = 0  # 値を変更したセルの数
+    # 従業員ごとに処理
+    for employee_name, rows in employee_rows:
+        template_type = employee_mapping.get(employee_name)
         if not template_type:
             print(
                 f"{employee_name} のテンプレート情報が見つかりません。スキップします。"
             )
             continue
+        digest = to_csv.rows_hash(rows)
+        # 変更がなくてもシートがなくなっている従業員は書き込む
+        if (
+            incremental
+            and written.get(employee_name) == digest
+            and employee_name in existing_sheets
+        ):
+            continue
+
+        if wb is None:
+            if template is None:
+                template = load_template(template_file)
+            if output_file.exists():
+                wb = load_workbook(output_file, keep_vba=True)
+            else:
+                # 新しく作る場合はテンプレートの複製から始める(保存して読み直さない)
+                wb = load_template(template_file)
+            wb.defined_names["year"] = DefinedName(name="year", attr_text=year)
+            wb.defined_names["month"] = DefinedName(name="month", attr_text=month)
 
         # テンプレートを従業員名のシートとしてコピー
-        if copy_sheet(template[template_type], wb, employee_name):
+        # 出力先にテンプレートのシートが残っていれば、そちらからコピーする方が速い
+        if template_type in wb.sheetnames:
+            source_ws = wb[template_type]
+        else:
+            source_ws = template[template_type]
+        if copy_sheet(source_ws, wb, employee_name):
             initialize_sheet(wb[employee_name])
         else:
             print(employee_name, "がすでに存在していたため上書きします")
 
-        # CSVデータを書き込み
-        write_csv_to_sheet(wb[employee_name], csv_file)
+        # データを書き込み
+        cells += write_rows_to_sheet(wb[employee_name], rows)
+        written[employee_name] = digest
+        changed += 1
+
+    if wb is None:
+        print(f"前回から変更がないため {output_file} は更新しませんでした。")
+        return
 
-    for temp in temp_types:
+    for temp in template.sheetnames:
         if temp == "button":
             continue
         # 初期Sheetを削除
@@ -245,16 +507,271 @@ def csv_to_excel(
 
     # 新しいExcelファイルを保存
     wb.save(output_file)
-    print(f"新しいExcelファイルが作成されました：{output_file}")
+    manifest = to_csv.load_manifest(output_file.parent)
+    manifest["xlsx"] = written
+    to_csv.save_manifest(output_file.parent, manifest)
+    print(
+        f"新しいExcelファイルが作成されました：{output_file}"
+        f"({changed}人分のシートを更新、{cells}セルを変更)"
+    )
+
+
+# 書き込み専用モードのワークブックに引き継ぐ、ワークブック全体の書式の表
+WORKBOOK_STYLE_TABLES = (
+    "_fonts",
+    "_fills",
+    "_borders",
+    "_alignments",
+    "_protections",
+    "_number_formats",
+    "_date_formats",
+    "_timedelta_formats",
+    "_colors",
+    "_cell_styles",
+    "_named_styles",
+    "_differential_styles",
+    "_table_styles",
+)
+
+
+def _copy_style_table(table):
+    """書式の表を、要素の順番(インデックス)を変えずに複製する"""
+    if isinstance(table, tuple):
+        return table
+    if isinstance(table, (list, set)):
+        # IndexedListは中の辞書も作り直す必要があるので、copyではなくコンストラクタで複製する
+        return type(table)(table)
+    return deepcopy(table)
+
+
+def _copy_vba_archive(archive: Optional[zipfile.ZipFile]) -> Optional[zipfile.ZipFile]:
+    """VBAのパーツを、テンプレートとファイル位置を共有しない別のZipFileに複製する"""
+    if archive is None:
+        return None
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as copied:
+        for info in archive.infolist():
+            copied.writestr(info, archive.read(info.filename))
+    return zipfile.ZipFile(buffer)
+
+
+def stream_sheet(source_ws, target_wb, target_name, rows=None):
+    """
+    テンプレートのシートを書き込み専用のシートとして書き出す。
+
+    copy_worksheetと同じく、値・書式・列の幅・行の高さ・結合セル・印刷設定をコピーし、
+    rowsがあればwrite_rows_to_sheetと同じ規則でCSVの行を重ねて書き込む。
+    行は1行ずつ一時ファイルに書き出されるので、メモリに残るのはシートの設定だけになる
+
+    Args:
+        source_ws (Worksheet): コピー元のテンプレートのシート
+        target_wb (Workbook): 書き込み専用モードのワークブック
+        target_name (str): シート名
+        rows (Optional[list[list[str]]]): to_csv.make_rowsが返す形式の行
+
+    Returns:
+        WriteOnlyWorksheet: 書き出したシート
+    """
+    ws = target_wb.create_sheet(target_name)
+    # 行を書き始める前に設定しておく必要がある
+    ws.sheet_format = copy(source_ws.sheet_format)
+    ws.sheet_properties = copy(source_ws.sheet_properties)
+    for attr in ("row_dimensions", "column_dimensions"):
+        target = getattr(ws, attr)
+        for key, dim in getattr(source_ws, attr).items():
+            target[key] = copy(dim)
+            target[key].worksheet = ws
+    ws.merged_cells = copy(source_ws.merged_cells)
+    ws.page_margins = copy(source_ws.page_margins)
+    ws.page_setup = copy(source_ws.page_setup)
+    ws.print_options = copy(source_ws.print_options)
+    ws.legacy_drawing = source_ws.legacy_drawing
+
+    # CSVの値を書き込むセル (行, 列) -> 値
+    # iter_rowsはないセルを作ってしまうので、テンプレートのセルを直接見る
+    rows = rows or []
+    source_cells = source_ws._cells
+    current_rows = (
+        tuple(
+            cell.value if cell is not None else None
+            for cell in (
+                source_cells.get((row_idx, col_idx))
+                for col_idx in range(1, len(row) + 1)
+            )
+        )
+        for row_idx, row in enumerate(rows, start=1)
+    )
+    values = {
+        (row_idx, col_idx): value
+        for row_idx, col_idx, value in diff_rows(current_rows, rows)
+    }
+
+    max_row = max([source_ws.max_row] + [row for row, _ in values])
+    max_column = max([source_ws.max_column] + [column for _, column in values])
+    for row_idx in range(1, max_row + 1):
+        cells = []
+        for col_idx in range(1, max_column + 1):
+            source_cell = source_ws._cells.get((row_idx, col_idx))
+            if (row_idx, col_idx) in values:
+                cell = WriteOnlyCell(ws, values[row_idx, col_idx])
+            elif source_cell is not None:
+                cell = WriteOnlyCell(ws)
+                cell._value = source_cell._value
+                cell.data_type = source_cell.data_type
+            else:
+                cells.append(None)
+                continue
+            if source_cell is not None:
+                if source_cell.has_style:
+                    cell._style = copy(source_cell._style)
+                if source_cell.comment:
+                    cell.comment = copy(source_cell.comment)
+            cells.append(cell)
+        ws.append(cells)
+    return ws
+
+
+def use_streaming(streaming: bool, output_file: Path, incremental: bool) -> bool:
+    """書き込み専用モードで作成するかどうかを決める
+
+    書き込み専用モードはテンプレートからすべてのシートを作り直すため、
+    既存のファイルに入力した備考や手で直した時刻が失われる。
+    そのため既存のファイルがある場合は、incrementalがFalse(--full)のときだけ使う
+
+    Args:
+        streaming (bool): 書き込み専用モードが指定されたかどうか
+        output_file (Path): 出力されるExcelファイルのパス
+        incremental (bool): Falseならすべてのシートを書き直す(--full)
+
+    Returns:
+        bool: Trueならstream_rows_to_excel、Falseならrows_to_excelで作成する
+    """
+    if streaming and incremental and output_file.exists():
+        print(
+            f"{output_file} がすでにあるため、入力済みの内容を残すよう通常のモードで更新します"
+            "(書き込み専用モードで作り直すには--fullを付けてください)。"
+        )
+        return False
+    return streaming
+
+
+def stream_rows_to_excel(
+    year: int,
+    month: int,
+    employee_rows: Iterable[tuple[str, list[list[str]]]],
+    template_file: Path,
+    employee_mapping: dict,
+    output_file: Path,
+    template: Optional[Workbook] = None,
+):
+    """
+    rows_to_excelと同じワークブックを、openpyxlの書き込み専用モードで作成する。
+
+    従業員ごとのシートは行を書き込んだ時点で一時ファイルに書き出されるので、
+    従業員が多くてもメモリの使用量はテンプレートと1シート分で済む。
+    既存のファイルは読み込まずにすべてのシートを作り直す。
+    VBA(vbaProject.bin)と名前の定義year・monthはテンプレートから引き継ぐ
+
+    Args:
+        year (int): 年
+        month (int): 月
+        employee_rows (Iterable[tuple[str, list[list[str]]]]): (従業員名, 行)
+        template_file (Path): テンプレートExcelファイルのパス
+        employee_mapping (dict): 従業員名とテンプレートのマッピング
+        output_file (Path): 出力されるExcelファイルのパス
+        template (Optional[Workbook]): 読み込み済みのテンプレート
+    """
+    if template is None:
+        if not template_file.exists():
+            print(f"テンプレートファイル {template_file} が存在しません。")
+            return
+        template = load_template(template_file)
+
+    wb = Workbook(write_only=True)
+    # テンプレートの書式の表を同じ順番で複製すれば、セルの書式のインデックスをそのまま使える
+    # 複数の月を続けて書き出すときに、前の月の出力がテンプレートの表を変えないよう出力ごとに複製する
+    for attr in WORKBOOK_STYLE_TABLES:
+        setattr(wb, attr, _copy_style_table(getattr(template, attr)))
+    wb.loaded_theme = template.loaded_theme
+    wb.code_name = template.code_name
+    wb.calculation = copy(template.calculation)
+    wb.vba_archive = _copy_vba_archive(template.vba_archive)
+    for name, defined_name in template.defined_names.items():
+        wb.defined_names[name] = copy(defined_name)
+    wb.defined_names["year"] = DefinedName(name="year", attr_text=year)
+    wb.defined_names["month"] = DefinedName(name="month", attr_text=month)
+
+    if "button" in template.sheetnames:
+        stream_sheet(template["button"], wb, "button")
+
+    written = {}
+    for employee_name, rows in employee_rows:
+        template_type = employee_mapping.get(employee_name)
+        if not template_type:
+            print(
+                f"{employee_name} のテンプレート情報が見つかりません。スキップします。"
+            )
+            continue
+        ws = stream_sheet(template[template_type], wb, employee_name, rows)
+        initialize_sheet(ws)
+        # 行はすでに書き出したので、シートを閉じて一時ファイルを確定させる
+        ws.close()
+        written[employee_name] = to_csv.rows_hash(rows)
+
+    wb.save(output_file)
+    manifest = to_csv.load_manifest(output_file.parent)
+    manifest["xlsx"] = written
+    to_csv.save_manifest(output_file.parent, manifest)
+    print(
+        f"新しいExcelファイルが作成されました：{output_file}"
+        f"({len(written)}人分のシートを書き込み)"
+    )
 
 
 # メイン処理
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="勤怠データをExcelファイルに出力する")
+    parser.add_argument("date", nargs="?", help="年と月 例: 2024/08, 2024/8, 24/08, 24/8")
+    parser.add_argument(
+        "--from-db",
+        action="store_true",
+        help="CSVファイルを経由せずにデータベースから直接書き込む",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="--from-dbのときに従業員ごとのCSVも書き出す",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="--from-db --from-recordsのときに従業員ごとの処理を並列に行うプロセス数",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="前回から変更のない従業員も含めてすべてのシートを書き込む",
+    )
+    parser.add_argument(
+        "--from-records",
+        action="store_true",
+        help="--from-dbのときに日ごとの集計を使わずに打刻から作る",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="書き込み専用モードで作成する(従業員が多いとき用 すべてのシートを作り直す"
+        "既存のファイルがある場合は--fullも必要)",
+    )
+    args = parser.parse_args()
+    if args.jobs > 1 and not (args.from_db and args.from_records):
+        parser.error("--jobsは--from-db --from-recordsと一緒に指定してください")
     input_str: str
-    if len(sys.argv) != 2:
+    if args.date is None:
         input_str = input("年と月を入力 例: 2024/08, 2024/8, 24/08, 24/8 ->")
     else:
-        input_str = sys.argv[1]
+        input_str = args.date
     year, month = time_util.parse_date_string(input_str)
     folder_path = Path(config.CSV_PATH) / f"{year:04d}-{month:02d}"
     # CSVファイルが格納されたフォルダのパス
@@ -262,7 +779,29 @@ if __name__ == "__main__":
     output_file = folder_path / "data.xlsm"  # 出力される新規Excelファイルのパス
 
     # 従業員名とテンプレートのマッピングを読み込む
-    employee_mapping = load_employee_mapping(Path(config.EMPLOYEE_LIST))
-
-    # CSVからExcelへのデータ転送
-    csv_to_excel(folder_path, template_file, employee_mapping, output_file)
+    employee_mapping = to_csv.load_employee_mapping(Path(config.EMPLOYEE_LIST))
+
+    if args.from_db:
+        # データベースからExcelへ直接書き込む
+        db_to_excel(
+            year,
+            month,
+            template_file,
+            employee_mapping,
+            output_file,
+            args.csv,
+            args.jobs,
+            not args.full,
+            not args.from_records,
+            args.streaming,
+        )
+    else:
+        # CSVからExcelへのデータ転送
+        csv_to_excel(
+            folder_path,
+            template_file,
+            employee_mapping,
+            output_file,
+            not args.full,
+            args.streaming,
+        )
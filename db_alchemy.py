@@ -1,4 +1,16 @@
-from sqlalchemy import ForeignKey, create_engine, desc
+from sqlalchemy import (
+    ForeignKey,
+    Index,
+    create_engine,
+    event,
+    desc,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import (
     DeclarativeBase,
     mapped_column,
@@ -6,16 +18,60 @@ from sqlalchemy.orm import (
     relationship,
     sessionmaker,
 )
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import enum
-from config import DATABASE_PATH, DEBUG, EMPLOYEE_LIST
-from typing import Any, Optional
+from config import (
+    DATABASE_PATH,
+    DATABASE_PROFILE,
+    DATABASE_PROFILES,
+    DEBUG,
+    EMPLOYEE_LIST,
+    NIGHT_HOURS,
+    START_DAY,
+)
+from typing import Any, Iterator, Optional
+from pair_engine import pair_days
 import time_util
 import os
 import json
+import sys
+import threading
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+
+def create_db_engine(path: str = DATABASE_PATH, profile: str = DATABASE_PROFILE):
+    """config.DATABASE_PROFILESの設定を適用したエンジンを作成する
+
+    PRAGMAは接続ごとの設定なので、接続するたびにconnectイベントで適用する。
+    接続はQueuePoolで使い回すため、打刻のたびに接続し直すことはない。
+
+    Args:
+        path (str): データベースファイルのパス
+        profile (str): DATABASE_PROFILESのキー
+    """
+    pragmas = DATABASE_PROFILES[profile]
+    engine = create_engine(
+        f"sqlite:///{path}",
+        echo=False,
+        poolclass=QueuePool,
+        pool_size=5,
+        # 打刻の書き込みスレッドとGUIのスレッドで接続を共有する
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
+    return engine
 
-engine = create_engine(f"sqlite:///{DATABASE_PATH}", echo=False)
+
+engine = create_db_engine()
 Session = sessionmaker(bind=engine)
 
 
@@ -77,6 +133,7 @@ class Employee(Base):
                 )
                 session.add(new_employee)
                 session.commit()
+                card_resolver.invalidate()
                 print(f"新しい従業員 '{name}' が追加されました。")
             else:
                 print(f"従業員 '{name}' はすでに存在しています。")
@@ -98,13 +155,15 @@ class IC_Card(Base):
         updated_at TEXT NOT NULL,
         FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
         )
+    CREATE UNIQUE INDEX IF NOT EXISTS ix_IC_Card_ic_card_number
+        ON IC_Card (ic_card_number)
     """
 
     __tablename__ = "IC_Card"
 
     card_id: Mapped[int] = mapped_column(primary_key=True)
     employee_id: Mapped[int] = mapped_column(ForeignKey(Employee.employee_id))
-    ic_card_number: Mapped[str]
+    ic_card_number: Mapped[str] = mapped_column(unique=True, index=True)
     created_at: Mapped[datetime]
     updated_at: Mapped[datetime]
 
@@ -145,6 +204,7 @@ class IC_Card(Base):
 
             # 変更をコミット
             session.commit()
+            card_resolver.update(ic_card_number, employee)
 
     @classmethod
     def find_by_ic_card_number(cls: Any, ic_card_number: str):
@@ -156,6 +216,7 @@ class IC_Card(Base):
         cls: Any, ic_card_number: str
     ) -> Optional[Employee]:
         """ICカードナンバーと紐づけられた従業員のレコードを返す
+        card_resolverのキャッシュから返すため、通常はIC_Cardの版を確かめる軽いクエリだけで済む
 
         Args:
             cls (IC_Card): なんでAnyにしなければならないんだ…
@@ -164,17 +225,31 @@ class IC_Card(Base):
         Returns:
             Optional[Employee]
         """
-        with Session() as session:
-            ic_card = (
-                session.query(cls).filter_by(ic_card_number=ic_card_number).first()
-            )
-            if ic_card is None:
-                print(
-                    f"ICカード'{ic_card_number}'がテーブルIC_Cardの中にみつかりません"
-                )
-                return None
-            employee_id: int = ic_card.employee_id
-            return session.query(Employee).filter_by(employee_id=employee_id).first()
+        employee = card_resolver.resolve(ic_card_number)
+        if employee is None:
+            print(f"ICカード'{ic_card_number}'がテーブルIC_Cardの中にみつかりません")
+        return employee
+
+    @classmethod
+    def find_employee_and_state(
+        cls, ic_card_number: str
+    ) -> tuple[Optional[Employee], Optional["PunchState"]]:
+        """
+        ICカードナンバーと紐づけられた従業員と、その最終打刻の状態を1回の問い合わせで返す。
+        タップされたときに使う
+
+        Args:
+            ic_card_number (str): ICカードナンバー
+
+        Returns:
+            tuple[Optional[Employee], Optional[PunchState]]: 見つからなければ(None, None)
+                打刻記録がなければ状態はNone
+        """
+        employee, state = card_resolver.resolve_with_state(ic_card_number)
+        if employee is None:
+            print(f"ICカード'{ic_card_number}'がテーブルIC_Cardの中にみつかりません")
+            return None, None
+        return employee, state
 
     def __repr__(self):
         return (
@@ -183,6 +258,107 @@ class IC_Card(Base):
         )
 
 
+class CardResolver:
+    """ICカードナンバー -> 従業員の対応をメモリ上に保持するキャッシュ
+
+    最初の問い合わせで全件を1回のクエリで読み込み、以降は辞書から返す。
+    IC_Card.assignとEmployee.addがコミットしたときに更新・破棄される。
+    別のプロセス(register_ic_card.pyなど)でカードが登録・付け替え・削除された場合に対応するため、
+    問い合わせのたびにIC_Cardの版(件数・最大のcard_id・最後のupdated_at)を1回の軽いクエリで読み、
+    読み込んだときの版と違えば全件を読み込み直す。タップではresolve_with_stateで版と最終打刻の状態を
+    同じクエリで読む。
+    DBを手で編集してカードを付け替えた場合はupdated_atも更新すること
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._employees: Optional[dict[str, Employee]] = None
+        self._version: Optional[tuple] = None
+
+    @staticmethod
+    def _version_subquery():
+        """IC_Cardの版(件数・最大のcard_id・最後のupdated_at)を読むサブクエリ"""
+        return select(
+            func.count().label("count"),
+            func.max(IC_Card.card_id).label("max_card_id"),
+            func.max(IC_Card.updated_at).label("last_updated_at"),
+        ).subquery()
+
+    @classmethod
+    def _read_version(cls, session) -> tuple:
+        return tuple(session.execute(select(*cls._version_subquery().c)).one())
+
+    def _load(self, session) -> dict[str, Employee]:
+        rows = (
+            session.query(IC_Card.ic_card_number, Employee)
+            .join(Employee, IC_Card.employee_id == Employee.employee_id)
+            .all()
+        )
+        return {ic_card_number: employee for ic_card_number, employee in rows}
+
+    def _refresh(self):
+        """版が変わっていれば(まだ読み込んでいなければ)対応表を読み込み直す。ロックは呼び出し側で取る"""
+        with Session() as session:
+            # 版と対応表を同じトランザクションで読み、食い違わないようにする
+            version = self._read_version(session)
+            if self._employees is None or version != self._version:
+                self._employees = self._load(session)
+                self._version = version
+
+    def preload(self):
+        """対応表を読み込んでおく(最初の打刻を速くするため)"""
+        with self._lock:
+            self._refresh()
+
+    def resolve(self, ic_card_number: str) -> Optional[Employee]:
+        """ICカードナンバーと紐づけられた従業員を返す。見つからなければNone"""
+        with self._lock:
+            self._refresh()
+            return self._employees.get(ic_card_number)
+
+    def resolve_with_state(
+        self, ic_card_number: str
+    ) -> tuple[Optional[Employee], Optional["PunchState"]]:
+        """ICカードナンバーと紐づけられた従業員と、その最終打刻の状態を返す
+
+        IC_Cardの版とPunchStateを1回のクエリで読むので、キャッシュが新しければ
+        タップ1回あたりのDBの問い合わせは1回で済む
+        """
+        version = self._version_subquery()
+        card_employee_id = (
+            select(IC_Card.employee_id)
+            .where(IC_Card.ic_card_number == ic_card_number)
+            .scalar_subquery()
+        )
+        statement = (
+            select(*version.c, PunchState)
+            .select_from(version)
+            .outerjoin(PunchState, PunchState.employee_id == card_employee_id)
+        )
+        with self._lock, Session() as session:
+            *row_version, state = session.execute(statement).one()
+            if self._employees is None or tuple(row_version) != self._version:
+                # カードが登録・付け替えられたときだけ対応表を読み込み直す
+                self._employees = self._load(session)
+                self._version = tuple(row_version)
+            return self._employees.get(ic_card_number), state
+
+    def update(self, ic_card_number: str, employee: Employee):
+        """カードの紐づけ先を更新する(読み込み前なら何もしない)"""
+        with self._lock:
+            if self._employees is not None:
+                self._employees[ic_card_number] = employee
+
+    def invalidate(self):
+        """キャッシュを破棄し、次の問い合わせで読み込み直す"""
+        with self._lock:
+            self._employees = None
+            self._version = None
+
+
+card_resolver = CardResolver()
+
+
 class AttendanceRecord(Base):
     """
     CREATE TABLE IF NOT EXISTS AttendanceRecord (
@@ -194,9 +370,16 @@ class AttendanceRecord(Base):
         updated_at TEXT NOT NULL,
         FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
     )
+    CREATE INDEX IF NOT EXISTS ix_AttendanceRecord_employee_id_record_time
+        ON AttendanceRecord (employee_id, record_time)
     """
 
     __tablename__ = "AttendanceRecord"
+    __table_args__ = (
+        Index(
+            "ix_AttendanceRecord_employee_id_record_time", "employee_id", "record_time"
+        ),
+    )
 
     record_id: Mapped[int] = mapped_column(primary_key=True)
     employee_id: Mapped[int] = mapped_column(ForeignKey(Employee.employee_id))
@@ -235,27 +418,111 @@ class AttendanceRecord(Base):
                 updated_at=punch_time,
             )
             session.add(new_record)
+            # 最終打刻の状態と日ごとの集計も同じトランザクションで更新する
+            PunchState.advance(session, employee_id, record_type, punch_time)
+            DailySummary.refresh(session, employee_id, punch_time)
             session.commit()
             print(f"記録しました{new_record}")
 
+    @classmethod
+    def exists(
+        cls: Any, employee_id: int, record_type: RecordType, punch_time: datetime
+    ) -> bool:
+        """同じ従業員・種別・時刻の打刻がすでに記録されているかどうか"""
+        with Session() as session:
+            return (
+                session.query(cls.record_id)
+                .filter_by(
+                    employee_id=employee_id,
+                    record_type=record_type,
+                    record_time=punch_time,
+                )
+                .first()
+                is not None
+            )
+
     @classmethod
     def get_employee_records(
         cls,
-        employee_id,
-        start_date=datetime(year=2000, month=1, day=1),
-        end_date=datetime.now(),
-    ):
+        employee_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> list["AttendanceRecord"]:
+        """従業員の期間内の打刻を時刻の昇順で返す
+
+        Args:
+            employee_id (int): 従業員ID
+            start_date (Optional[datetime]): 期間の開始(含む) Noneなら最初の打刻から
+            end_date (Optional[datetime]): 期間の終了(含まない) Noneなら最新の打刻まで
+        """
+        return RecordQuery().employees(employee_id).between(start_date, end_date).all()
+
+    @classmethod
+    def iter_all(
+        cls, batch_size: int = 1000
+    ) -> Iterator[tuple[int, int, RecordType, datetime]]:
+        """全打刻をget_allのようにORMのオブジェクトにせず、ストリーミングで返す
+
+        読み取り専用の集計向け。batch_size行ずつDBから取り出すので、
+        打刻履歴が増えてもメモリの使用量は変わらない
+
+        Yields:
+            tuple: (record_id, employee_id, record_type, record_time) record_idの昇順
+        """
         with Session() as session:
-            return (
-                session.query(cls)
-                .filter_by(employee_id=employee_id)
-                .filter(
-                    start_date <= AttendanceRecord.record_time,
-                    AttendanceRecord.record_time < end_date,
+            query = (
+                session.query(
+                    cls.record_id, cls.employee_id, cls.record_type, cls.record_time
                 )
-                .order_by(AttendanceRecord.record_time)
-                .all()
+                .order_by(cls.record_id)
+                .yield_per(batch_size)
             )
+            for record_id, employee_id, record_type, record_time in query:
+                yield record_id, employee_id, record_type, record_time
+
+    @classmethod
+    def iter_employee_records(
+        cls,
+        employee_id: int,
+        start_date: datetime,
+        end_date: datetime,
+        batch_size: int = 1000,
+    ) -> Iterator[tuple[RecordType, datetime]]:
+        """従業員の期間内の打刻をget_employee_recordsのようにORMのオブジェクトにせず、
+        ストリーミングで返す
+
+        Args:
+            employee_id (int): 従業員ID
+            start_date (datetime): 期間の開始(この時刻を含む)
+            end_date (datetime): 期間の終了(この時刻を含まない)
+            batch_size (int): 一度にDBから取り出す行数
+
+        Yields:
+            tuple: (record_type, record_time) record_timeの昇順
+        """
+        query = RecordQuery().employees(employee_id).between(start_date, end_date)
+        for _, record_type, record_time in query.iter(batch_size):
+            yield record_type, record_time
+
+    @classmethod
+    def iter_period_records(
+        cls, start_date: datetime, end_date: datetime, batch_size: int = 1000
+    ) -> Iterator[tuple[int, RecordType, datetime]]:
+        """全従業員の期間内の打刻を1回のクエリでストリーミングで返す
+
+        (employee_id, record_time)の昇順に並んでいるため、
+        itertools.groupbyで従業員ごと・日付ごとにまとめることができる
+
+        Args:
+            start_date (datetime): 期間の開始(この時刻を含む)
+            end_date (datetime): 期間の終了(この時刻を含まない)
+            batch_size (int): 一度にDBから取り出す行数
+
+        Yields:
+            tuple: (employee_id, record_type, record_time)
+        """
+        query = RecordQuery().between(start_date, end_date)
+        yield from query.iter(batch_size)
 
     def __repr__(self):
         return (
@@ -268,9 +535,567 @@ class AttendanceRecord(Base):
         return f"AttendanceRecord: {time_util.datetime_to_string(self.record_time)}{self.record_type.value} {self.employee_id}"
 
 
+class RecordQuery:
+    """AttendanceRecordの範囲指定のクエリを組み立てる
+
+    期間の片側・両側を省略でき(省略した側は制限なし)、
+    集計期間(config.START_DAY締め)や複数の従業員を1つのSQL文で指定できる。
+    実行するたびにSQL文を作るので、長時間動いているプロセスでも最新の打刻まで読める
+
+    例:
+        RecordQuery().employees(1, 2).pay_period(2024, 8).iter()
+    """
+
+    def __init__(
+        self,
+        employee_ids: Optional[tuple[int, ...]] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ):
+        self.employee_ids = employee_ids
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def employees(self, *employee_ids: int) -> "RecordQuery":
+        """対象の従業員を絞り込む 指定しなければ全従業員"""
+        return RecordQuery(
+            tuple(sorted(set(employee_ids))), self.start_date, self.end_date
+        )
+
+    def between(
+        self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None
+    ) -> "RecordQuery":
+        """期間を指定する 開始は含み、終了は含まない Noneならその側は制限なし"""
+        return RecordQuery(self.employee_ids, start_date, end_date)
+
+    def pay_period(self, year: int, month: int) -> "RecordQuery":
+        """指定された月の集計期間(前の月のSTART_DAY日から)を期間にする"""
+        return self.between(*time_util.pay_period_range(year, month, START_DAY))
+
+    def conditions(self) -> list:
+        """WHERE句の条件のリスト"""
+        conditions = []
+        if self.employee_ids is not None:
+            if len(self.employee_ids) == 1:
+                conditions.append(AttendanceRecord.employee_id == self.employee_ids[0])
+            else:
+                conditions.append(AttendanceRecord.employee_id.in_(self.employee_ids))
+        if self.start_date is not None:
+            conditions.append(self.start_date <= AttendanceRecord.record_time)
+        if self.end_date is not None:
+            conditions.append(AttendanceRecord.record_time < self.end_date)
+        return conditions
+
+    def statement(self, *columns):
+        """SELECT文を作る
+
+        (employee_id, record_time)のインデックスの順に並べるので、並べ替えは発生しない
+        """
+        return (
+            select(*columns)
+            .where(*self.conditions())
+            .order_by(AttendanceRecord.employee_id, AttendanceRecord.record_time)
+        )
+
+    def iter(self, batch_size: int = 1000) -> Iterator[tuple[int, RecordType, datetime]]:
+        """打刻をストリーミングで返す
+
+        Yields:
+            tuple: (employee_id, record_type, record_time) (employee_id, record_time)の昇順
+        """
+        statement = self.statement(
+            AttendanceRecord.employee_id,
+            AttendanceRecord.record_type,
+            AttendanceRecord.record_time,
+        ).execution_options(yield_per=batch_size)
+        with Session() as session:
+            for employee_id, record_type, record_time in session.execute(statement):
+                yield employee_id, record_type, record_time
+
+    def all(self) -> list[AttendanceRecord]:
+        """打刻をAttendanceRecordのリストで返す"""
+        with Session() as session:
+            return list(session.scalars(self.statement(AttendanceRecord)))
+
+
+class PunchState(Base):
+    """従業員ごとの最終打刻の状態
+
+    AttendanceRecord.punchが同じトランザクションで更新するため、
+    打刻履歴をたどらずに最終打刻を1行の読み込みで取得できる。
+    punchを通さずに打刻を追加・変更・削除しても古い状態のままになり、
+    DailySummaryのrecord_countのように食い違いを見つける手段もないので、
+    そのときは必ずrebuild(python db_alchemy.py rebuild)を実行すること
+    CREATE TABLE IF NOT EXISTS PunchState (
+        employee_id INTEGER PRIMARY KEY,
+        record_type TEXT NOT NULL CHECK (record_type IN ('IN', 'OUT')),
+        record_time TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
+    )
+    """
+
+    __tablename__ = "PunchState"
+
+    employee_id: Mapped[int] = mapped_column(
+        ForeignKey(Employee.employee_id), primary_key=True
+    )
+    record_type: Mapped[RecordType]
+    record_time: Mapped[datetime]
+    updated_at: Mapped[datetime]
+
+    @classmethod
+    def get(cls, employee_id: int) -> Optional["PunchState"]:
+        """従業員の最終打刻の状態を返す。打刻記録がなければNone"""
+        with Session() as session:
+            return session.get(cls, employee_id)
+
+    @classmethod
+    def advance(
+        cls,
+        session,
+        employee_id: int,
+        record_type: RecordType,
+        record_time: datetime,
+    ):
+        """打刻を状態に反映する。コミットは呼び出し側で行う
+
+        既存の状態より古い打刻(後から追加された過去の打刻など)では更新しない
+        """
+        state = session.get(cls, employee_id)
+        if state is None:
+            session.add(
+                cls(
+                    employee_id=employee_id,
+                    record_type=record_type,
+                    record_time=record_time,
+                    updated_at=time_util.current_time(),
+                )
+            )
+        elif state.record_time <= record_time.replace(tzinfo=None):
+            # DBにはタイムゾーンなしで保存されているので、揃えて比較する
+            state.record_type = record_type
+            state.record_time = record_time
+            state.updated_at = time_util.current_time()
+
+    @classmethod
+    def rebuild(cls, bind=None):
+        """打刻履歴から全従業員の状態を作り直す"""
+        bind = bind or Session.kw["bind"]
+        latest = (
+            select(
+                AttendanceRecord.employee_id,
+                func.max(AttendanceRecord.record_time).label("record_time"),
+            )
+            .group_by(AttendanceRecord.employee_id)
+            .subquery()
+        )
+        with Session(bind=bind) as session:
+            rows = (
+                session.query(
+                    AttendanceRecord.employee_id,
+                    AttendanceRecord.record_type,
+                    AttendanceRecord.record_time,
+                )
+                .join(
+                    latest,
+                    (AttendanceRecord.employee_id == latest.c.employee_id)
+                    & (AttendanceRecord.record_time == latest.c.record_time),
+                )
+                .order_by(AttendanceRecord.employee_id, AttendanceRecord.record_id)
+                .all()
+            )
+            # 同時刻の打刻が複数ある場合は後に記録されたものを採用する
+            states = {
+                employee_id: (record_type, record_time)
+                for employee_id, record_type, record_time in rows
+            }
+            now = time_util.current_time()
+            session.query(cls).delete()
+            session.add_all(
+                cls(
+                    employee_id=employee_id,
+                    record_type=record_type,
+                    record_time=record_time,
+                    updated_at=now,
+                )
+                for employee_id, (record_type, record_time) in states.items()
+            )
+            session.commit()
+        print(f"{len(states)}人分の最終打刻の状態を作り直しました。")
+
+
+class DailySummary(Base):
+    """従業員ごと・日ごとの打刻の集計
+
+    AttendanceRecord.punchが同じトランザクションで打刻した日の行を作り直すため、
+    月末の出力は打刻を全部読まずに、従業員・日ごとに1行を読むだけでよい
+    in1〜out2はCSVに書き込む最初の2組のペア(押し忘れの側はNULL)
+    worked_minutes・night_minutesはペアになった時間と、そのうち深夜(config.NIGHT_HOURS)の時間(分)
+    record_countは集計した打刻の数で、punchを通さずに打刻が追加・削除された日を見つけるのに使う
+    CREATE TABLE IF NOT EXISTS DailySummary (
+        employee_id INTEGER NOT NULL,
+        work_date DATE NOT NULL,
+        first_in DATETIME,
+        last_out DATETIME,
+        in1 DATETIME,
+        out1 DATETIME,
+        in2 DATETIME,
+        out2 DATETIME,
+        pair_count INTEGER NOT NULL,
+        lost BOOLEAN NOT NULL,
+        worked_minutes INTEGER NOT NULL,
+        night_minutes INTEGER NOT NULL,
+        record_count INTEGER NOT NULL,
+        updated_at DATETIME NOT NULL,
+        PRIMARY KEY (employee_id, work_date),
+        FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
+    )
+    """
+
+    __tablename__ = "DailySummary"
+
+    employee_id: Mapped[int] = mapped_column(
+        ForeignKey(Employee.employee_id), primary_key=True
+    )
+    work_date: Mapped[date] = mapped_column(primary_key=True)
+    first_in: Mapped[Optional[datetime]]
+    last_out: Mapped[Optional[datetime]]
+    in1: Mapped[Optional[datetime]]
+    out1: Mapped[Optional[datetime]]
+    in2: Mapped[Optional[datetime]]
+    out2: Mapped[Optional[datetime]]
+    pair_count: Mapped[int]
+    lost: Mapped[bool]
+    worked_minutes: Mapped[int]
+    night_minutes: Mapped[int]
+    record_count: Mapped[int]
+    updated_at: Mapped[datetime]
+
+    @classmethod
+    def summarize(cls, punches: list[tuple[RecordType, datetime]]) -> dict:
+        """1日分の打刻(時刻順)から集計の列の値を作る"""
+        punch_pairs, has_lost = next(iter(pair_days(punches).values()), ([], False))
+        return cls.columns(punch_pairs, has_lost, len(punches))
+
+    @staticmethod
+    def columns(punch_pairs: list, has_lost: bool, record_count: int) -> dict:
+        """1日分のペア(pair_engine.pair_daysの結果)から集計の列の値を作る"""
+        ins = [punch_in for punch_in, _ in punch_pairs if punch_in is not None]
+        outs = [punch_out for _, punch_out in punch_pairs if punch_out is not None]
+        worked = night = 0.0
+        for punch_in, punch_out in punch_pairs:
+            if punch_in is None or punch_out is None:
+                continue
+            worked += (punch_out - punch_in).total_seconds()
+            night += time_util.night_seconds(punch_in, punch_out, NIGHT_HOURS)
+        # 最大2ペアまで(CSVの出勤1～2、退勤1～2)
+        first_pairs = punch_pairs[:2] + [(None, None)] * (2 - len(punch_pairs[:2]))
+        return {
+            "first_in": ins[0] if ins else None,
+            "last_out": outs[-1] if outs else None,
+            "in1": first_pairs[0][0],
+            "out1": first_pairs[0][1],
+            "in2": first_pairs[1][0],
+            "out2": first_pairs[1][1],
+            "pair_count": len(punch_pairs),
+            "lost": has_lost,
+            "worked_minutes": int(worked // 60),
+            "night_minutes": int(night // 60),
+            "record_count": record_count,
+        }
+
+    @classmethod
+    def refresh(cls, session, employee_id: int, punch_time: datetime):
+        """打刻した日の集計を、その日の打刻から作り直す。コミットは呼び出し側で行う
+
+        過去の日の打刻が後から追加された場合も、その日だけを作り直せばよい
+        """
+        work_date = punch_time.date()
+        start = datetime.combine(work_date, datetime.min.time())
+        punches = (
+            session.query(AttendanceRecord.record_type, AttendanceRecord.record_time)
+            .filter(
+                AttendanceRecord.employee_id == employee_id,
+                start <= AttendanceRecord.record_time,
+                AttendanceRecord.record_time < start + timedelta(days=1),
+            )
+            .order_by(AttendanceRecord.record_time)
+            .all()
+        )
+        summary = session.get(cls, (employee_id, work_date))
+        if summary is None:
+            summary = cls(employee_id=employee_id, work_date=work_date)
+            session.add(summary)
+        for key, value in cls.summarize(punches).items():
+            setattr(summary, key, value)
+        summary.updated_at = time_util.current_time()
+
+    @classmethod
+    def rebuild(cls, bind=None):
+        """打刻履歴から全従業員・全日の集計を作り直す"""
+        bind = bind or Session.kw["bind"]
+        now = time_util.current_time()
+        count = 0
+        with Session(bind=bind) as session:
+            session.query(cls).delete()
+            rows = []
+            records = session.execute(
+                select(
+                    AttendanceRecord.employee_id,
+                    AttendanceRecord.record_type,
+                    AttendanceRecord.record_time,
+                )
+                .order_by(AttendanceRecord.employee_id, AttendanceRecord.record_time)
+                .execution_options(yield_per=1000)
+            )
+            # 従業員ごとに全期間の打刻をまとめてペアにする
+            for employee_id, employee_records in groupby(records, key=itemgetter(0)):
+                punches = [
+                    (record_type, record_time)
+                    for _, record_type, record_time in employee_records
+                ]
+                counts = Counter(record_time.date() for _, record_time in punches)
+                for work_date, (punch_pairs, has_lost) in pair_days(punches).items():
+                    rows.append(
+                        {
+                            "employee_id": employee_id,
+                            "work_date": work_date,
+                            "updated_at": now,
+                            **cls.columns(punch_pairs, has_lost, counts[work_date]),
+                        }
+                    )
+                if len(rows) >= 1000:
+                    session.execute(insert(cls), rows)
+                    count += len(rows)
+                    rows = []
+            if rows:
+                session.execute(insert(cls), rows)
+                count += len(rows)
+            session.commit()
+        print(f"{count}日分の打刻の集計を作り直しました。")
+
+    @classmethod
+    def refresh_stale(
+        cls, start_date: datetime, end_date: datetime, bind=None
+    ) -> int:
+        """期間内で打刻履歴と食い違っている日の集計を作り直す
+
+        punchを通さずに追加・変更・削除された打刻(make_test_records.pyや手での修正など)に
+        対応するため、従業員・日ごとの打刻の数と最後に更新された日時を集計と比べ、
+        打刻の数が違うか、集計より後に更新された打刻がある日だけを作り直す。
+        打刻がなくなった日の集計は削除する。
+        書き込みのトランザクションを開くので、出力のたびではなく
+        python db_alchemy.py refreshから明示的に呼ぶ。
+        SQLiteのツールなどで時刻だけを直してupdated_atを更新しなかった場合は
+        見つけられないので、rebuildを使うこと
+
+        Args:
+            start_date (datetime): 期間の開始(この日を含む)
+            end_date (datetime): 期間の終了(この日を含まない)
+            bind (Engine): 対象のエンジン。省略した場合はSessionのエンジン
+
+        Returns:
+            int: 作り直した(削除した)日数
+        """
+        bind = bind or Session.kw["bind"]
+        start = datetime.combine(start_date.date(), datetime.min.time())
+        end = datetime.combine(end_date.date(), datetime.min.time())
+        employee_ids = select(Employee.employee_id)
+        work_date = func.date(AttendanceRecord.record_time).label("work_date")
+        records = (
+            select(
+                AttendanceRecord.employee_id,
+                work_date,
+                func.count().label("record_count"),
+                func.max(AttendanceRecord.updated_at).label("updated_at"),
+            )
+            .where(
+                # 従業員ごとに(employee_id, record_time)のインデックスで期間だけを読む
+                AttendanceRecord.employee_id.in_(employee_ids),
+                start <= AttendanceRecord.record_time,
+                AttendanceRecord.record_time < end,
+            )
+            .group_by(AttendanceRecord.employee_id, work_date)
+            .subquery()
+        )
+        # 食い違っている日だけをDBの中で探す(どちらも日付・日時を同じ形式の文字列で保存している)
+        changed = (
+            select(records.c.employee_id, records.c.work_date)
+            .outerjoin(
+                cls,
+                (cls.employee_id == records.c.employee_id)
+                & (cls.work_date == records.c.work_date),
+            )
+            .where(
+                (cls.employee_id.is_(None))
+                | (cls.record_count != records.c.record_count)
+                | (cls.updated_at < records.c.updated_at)
+            )
+        )
+        day_records = (
+            select(AttendanceRecord.record_id)
+            .where(
+                AttendanceRecord.employee_id == cls.employee_id,
+                cls.work_date <= AttendanceRecord.record_time,
+                AttendanceRecord.record_time < func.date(cls.work_date, "+1 day"),
+            )
+            .exists()
+        )
+        removed = select(cls.employee_id, cls.work_date).where(
+            cls.employee_id.in_(employee_ids),
+            start.date() <= cls.work_date,
+            cls.work_date < end.date(),
+            ~day_records,
+        )
+        with Session(bind=bind) as session:
+            stale = session.execute(changed).all()
+            for employee_id, day in stale:
+                cls.refresh(session, employee_id, datetime.fromisoformat(day))
+            gone = session.execute(removed).all()
+            for employee_id, day in gone:
+                session.query(cls).filter_by(
+                    employee_id=employee_id, work_date=day
+                ).delete()
+            session.commit()
+        count = len(stale) + len(gone)
+        if count:
+            print(f"{count}日分の集計を打刻履歴に合わせて作り直しました。")
+        return count
+
+    @classmethod
+    def iter_period(
+        cls, start_date: datetime, end_date: datetime, batch_size: int = 1000
+    ) -> Iterator[Any]:
+        """全従業員の期間内の集計を(employee_id, work_date)の昇順で返す
+
+        ORMのオブジェクトを作らずに、CSVの行と労働時間の集計に必要な列だけを
+        属性で参照できる行として返す。
+        読むだけで書き込まないので、打刻アプリの書き込みと競合しない。
+        punchを通さずに変更した打刻は、先にrefresh_stale(python db_alchemy.py refresh)で反映すること
+
+        Args:
+            start_date (datetime): 期間の開始(この日を含む)
+            end_date (datetime): 期間の終了(この日を含まない)
+            batch_size (int): 一度にDBから取り出す行数
+        """
+        with Session() as session:
+            query = (
+                session.query(
+                    cls.employee_id,
+                    cls.work_date,
+                    cls.in1,
+                    cls.out1,
+                    cls.in2,
+                    cls.out2,
+                    cls.pair_count,
+                    cls.lost,
+                    cls.worked_minutes,
+                    cls.night_minutes,
+                )
+                .filter(
+                    start_date.date() <= cls.work_date,
+                    cls.work_date < end_date.date(),
+                )
+                .order_by(cls.employee_id, cls.work_date)
+                .yield_per(batch_size)
+            )
+            yield from query
+
+
+def migrate(bind=None):
+    """既存のデータベースを現在のモデルの定義に合わせる
+
+    足りないテーブルとインデックスを作成する。何度実行しても結果は同じで、
+    既存のデータを削除・変更することはない。
+    ただし、日ごとの集計(DailySummary)に足りない列があれば追加して打刻履歴から作り直す。
+    IC_Card.ic_card_numberに重複がある場合は一意インデックスを作成せずに重複を表示する。
+
+    Args:
+        bind (Engine): 対象のエンジン。省略した場合はSessionのエンジン
+    """
+    bind = bind or Session.kw["bind"]
+    # 足りないテーブルを作成(既存のテーブルには何もしない)
+    Base.metadata.create_all(bind)
+
+    # 打刻履歴があるのに最終打刻の状態が空なら、履歴から作成する
+    with Session(bind=bind) as session:
+        needs_state = (
+            session.query(PunchState).first() is None
+            and session.query(AttendanceRecord).first() is not None
+        )
+    if needs_state:
+        PunchState.rebuild(bind)
+
+    # 日ごとの集計の列が増えていれば追加して、打刻履歴から作り直す
+    inspector = inspect(bind)
+    table = DailySummary.__table__
+    existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+    missing_columns = [c for c in table.columns if c.name not in existing_columns]
+    if missing_columns:
+        with bind.begin() as connection:
+            for column in missing_columns:
+                column_type = column.type.compile(bind.dialect)
+                connection.execute(
+                    text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                )
+                print(f"{table.name}に列{column.name}を追加しました。")
+    # 日ごとの集計も最終打刻の状態と同様に、空なら打刻履歴から作成する
+    with Session(bind=bind) as session:
+        needs_summary = bool(missing_columns) or (
+            session.query(DailySummary).first() is None
+            and session.query(AttendanceRecord).first() is not None
+        )
+    if needs_summary:
+        DailySummary.rebuild(bind)
+
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                duplicates = _find_duplicates(bind, index)
+                if duplicates:
+                    print(
+                        f"{table.name}に重複した値があるため{index.name}を作成できません。"
+                        f"重複を解消してから再度実行してください: {duplicates}"
+                    )
+                    continue
+            index.create(bind)
+            print(f"インデックス{index.name}を作成しました。")
+
+
+def _find_duplicates(bind, index: Index) -> list:
+    """一意インデックスの対象の列で重複している値を返す"""
+    columns = list(index.columns)
+    with bind.connect() as connection:
+        return connection.execute(
+            select(*columns).group_by(*columns).having(func.count() > 1)
+        ).all()
+
+
 if __name__ == "__main__":
-    # データベースの初期化
-    Base.metadata.create_all(engine)
+    # データベースの初期化・マイグレーション
+    migrate()
+
+    if sys.argv[1:] == ["rebuild"]:
+        # 打刻履歴から最終打刻の状態と日ごとの集計を作り直す
+        PunchState.rebuild()
+        DailySummary.rebuild()
+        exit()
+
+    if sys.argv[1:2] == ["refresh"]:
+        # punchを通さずに変更された打刻を、最終打刻の状態と日ごとの集計に反映する
+        # 年と月を指定すればその集計期間だけ、省略すればすべての期間を調べる
+        if sys.argv[2:]:
+            period = RecordQuery().pay_period(*time_util.parse_date_string(sys.argv[2]))
+            start_date, end_date = period.start_date, period.end_date
+        else:
+            start_date, end_date = datetime.min, datetime.max
+        PunchState.rebuild()
+        DailySummary.refresh_stale(start_date, end_date)
+        exit()
 
     # EMPLOYEE_LISTに書かれている従業員名が登録されていなかったら登録する
     if os.path.exists(EMPLOYEE_LIST):
@@ -1,9 +1,9 @@
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import QApplication
 from main_window import MainWindow
 from loguru import logger
 import config
 from pathlib import Path
-from auto_close_window import AutoCloseMessageBox
 
 logger.add(config.LOG_FILE_PATH, level="TRACE", rotation="10 MB")
 
@@ -13,6 +13,9 @@ def main():
     app = QApplication([])
     window = MainWindow()
     window.show()
+    # 時計を描画してから、打刻の書き込み・DB・NFCリーダーを準備する
+    app.processEvents()
+    QTimer.singleShot(0, window.start_services)
     app.exec()
 
 
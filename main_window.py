@@ -1,29 +1,71 @@
-import nfc
-from PySide6.QtCore import QTimer, Slot
-from PySide6.QtWidgets import QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton
+from typing import Optional
+import time
+
+from PySide6.QtCore import Qt, QTimer, Slot
+from PySide6.QtWidgets import (
+    QApplication,
+    QDialog,
+    QHBoxLayout,
+    QMainWindow,
+    QLabel,
+    QVBoxLayout,
+    QWidget,
+    QPushButton,
+)
 
 from config import StyleSheets, WINDOW_SIZE, MessageTexts, DEBUG
-from auto_close_window import AutoCloseMessageBox
-from punch_dialog import PunchDialog
-from nfc_reader_QThread import NfcReader, NfcReaderMock
-import db_alchemy
 import time_util
-from register_dialog import EmployeeSelectionDialog
+from tap_filter import TapFilter
 
+# nfc・SQLAlchemy・ダイアログは読み込みに時間がかかるので、時計を表示してから
+# start_servicesやスロットの中でimportする
 
-class TimeDisplay(QLabel):
-    def __init__(self, *args, **kwargs):
+TICK_MARGIN_MS = 2  # 時計の更新を秒の変わり目からどれだけ遅らせるか(ミリ秒)
+
+
+class TimeDisplay(QWidget):
+    """現在時刻を表示するウィジェット
+
+    秒の変わり目に合わせてタイマーを掛け直すので、表示する秒が飛んだり遅れたりしない。
+    日付と時刻は別々のラベルで、文字列はtime_util.LocalClockで作る。
+    表示が変わったラベルだけをsetTextするので、日付のラベルは1日に1回しか描き直さない
+    """
+
+    def __init__(self, *args, clock: Optional[time_util.LocalClock] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.setStyleSheet(StyleSheets.time_display)
+        self.date_label = QLabel()
+        self.time_label = QLabel()
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.date_label)
+        layout.addWidget(self.time_label)
+        layout.addStretch()
+        self.setLayout(layout)
+        # 1つのラベルに表示していたときと同じく、日付と時刻の間を空白1文字分あける
+        self.date_label.ensurePolished()
+        layout.setSpacing(self.date_label.fontMetrics().horizontalAdvance(" "))
+        self.clock = clock or time_util.LocalClock()
         self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.update_time)
-        self.timer.start(1000)  # 1秒ごとに時刻を更新
         self.update_time()  # 最初に時刻を表示
 
+    def text(self) -> str:
+        """表示している「月/日 時:分:秒」"""
+        return f"{self.date_label.text()} {self.time_label.text()}"
+
     def update_time(self):
         try:
-            current_time = time_util.current_time()
-            self.setText(time_util.datetime_to_string(current_time, "%m/%d %H:%M:%S"))
+            now = self.clock.clock()
+            date_text, time_text = self.clock.fields(now)
+            if date_text != self.date_label.text():
+                self.date_label.setText(date_text)
+            if time_text != self.time_label.text():
+                self.time_label.setText(time_text)
+            # 次の秒の変わり目の少し後に更新する(早く起きて同じ秒を表示しないように)
+            self.timer.start(int(self.clock.until_next_second(now) * 1000) + TICK_MARGIN_MS)
         except KeyboardInterrupt:
             print("KeyboardInterrupt 終了します")
             exit()
@@ -56,14 +98,45 @@ class MainWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+        # 同じカードの続けてのタップを無視する
+        self.tap_filter = TapFilter()
+        self.nfc_reader = None
+        self.punch_dialog = None  # start_servicesで作成する
+
+    def start_services(self):
+        """時計を表示した後に、打刻の書き込み・DB・NFCリーダーを準備する
+
+        main.pyがウィンドウを表示してからイベントループの中で呼び出す
+        """
+        import db_alchemy
+        import punch_writer
+        from sqlalchemy.orm import configure_mappers
+
+        # 打刻の書き込みスレッドを起動する(前回書き込めなかった打刻はスレッドが先に書き込む)
+        punch_writer.writer.start()
+        QApplication.instance().aboutToQuit.connect(punch_writer.writer.stop)
+
+        # 最初のタップで待たないように、ORMの設定と打刻用のダイアログの作成を済ませておく
+        configure_mappers()
+        from punch_dialog import PunchDialog
+
+        self.punch_dialog = PunchDialog()
+
+        # ICカード→従業員の対応表を先に読み込んでおく
+        db_alchemy.card_resolver.preload()
+
         # NfcReaderを起動
+        import nfc
+        from nfc_reader_QThread import NfcReader, NfcReaderMock
+
         try:
             clf = nfc.ContactlessFrontend("usb")
-            self.nfc_reader = NfcReader(clf)
+            self.nfc_reader = NfcReader(clf, continuous=True)
         except OSError as e:
             if DEBUG:
                 print("デバッグモードで起動します、読み込みボタンを表示します")
                 self.nfc_reader = NfcReaderMock()
+                layout = self.centralWidget().layout()
                 self.debug_button = QPushButton("読み込み(未登録カード)")
                 self.debug_button.clicked.connect(self.mock_card_read_error)
                 layout.addWidget(self.debug_button)
@@ -71,6 +144,8 @@ class MainWindow(QMainWindow):
                 self.debug_button.clicked.connect(self.mock_card_read)
                 layout.addWidget(self.debug_button)
             else:
+                from auto_close_window import AutoCloseMessageBox
+
                 msg = AutoCloseMessageBox(
                     title="エラー", text=f"{e}\nカードリーダーを接続してください"
                 )
@@ -87,11 +162,31 @@ class MainWindow(QMainWindow):
     @Slot(str)  # スロットで受け取るデータ型を指定
     def update_label(self, ic_card_id):
         """NFCリーダーからシグナルを受け取ったときに呼び出されるスロット"""
+        read_at = time.perf_counter()  # 打刻確認が描画されるまでの時間を測る
+        if not self.tap_filter.accept(ic_card_id):
+            # DBに問い合わせる前に重複したタップを捨てる
+            print(
+                f"ICカード'{ic_card_id}'の重複したタップを無視しました"
+                f"(これまでに{self.tap_filter.suppressed}回)"
+            )
+            self.nfc_reader.resume()
+            return
+        import db_alchemy
+
         punch_time = time_util.current_time()
-        if db_alchemy.IC_Card.find_employee_by_ic_card_number(ic_card_id):
-            dialog = PunchDialog(ic_card_id, punch_time)
-            dialog.exec()
+        # 従業員と最終打刻の状態を1回の問い合わせで読み、ダイアログに渡す
+        employee, last_state = db_alchemy.IC_Card.find_employee_and_state(ic_card_id)
+        if employee is not None:
+            result = self.punch_dialog.punch(employee, last_state, punch_time, read_at)
+            if result == QDialog.Rejected:
+                # キャンセルした場合はすぐにかざし直せるようにする
+                self.tap_filter.forget(ic_card_id)
         else:
+            # 登録後すぐに打刻できるようにする
+            self.tap_filter.forget(ic_card_id)
+            # 未登録のカードはまれなので、登録用のダイアログは初めて使うときに読み込む
+            from register_dialog import EmployeeSelectionDialog
+
             dialog = EmployeeSelectionDialog()
             dialog.employee_selected.connect(
                 lambda emp: db_alchemy.IC_Card.assign(ic_card_id, emp)
@@ -99,9 +194,19 @@ class MainWindow(QMainWindow):
             dialog.exec()
             # msg = AutoCloseMessageBox(title="エラー", text="登録されていないカードです")
             # msg.exec()
-        # nfc_readerを再起動する
-        self.nfc_reader.wait()
-        self.nfc_reader.start()
+        # 一時停止しているnfc_readerのポーリングを再開する
+        self.nfc_reader.resume()
+
+    def closeEvent(self, event):
+        """ウィンドウを閉じるときにnfc_readerのスレッドを終了する"""
+        suppressed, cards = self.tap_filter.suppressed_stats()
+        if suppressed:
+            # 読み取りの調子が悪いカード・リーダーを見つけるための記録
+            print(f"重複したタップを{suppressed}回無視しました 多いカード: {cards}")
+        if self.nfc_reader is not None:
+            self.nfc_reader.stop()
+            self.nfc_reader.wait()
+        super().closeEvent(event)
 
     def reset_label(self):
         """ラベルを初期状態にリセット"""
@@ -109,6 +214,8 @@ class MainWindow(QMainWindow):
 
     def mock_card_read_error(self):
         """デバッグ用: ボタンを押すと仮想カードIDを読み込む"""
+        import db_alchemy
+
         # 仮のICカードIDと現在の時刻を使ってスロットを呼び出し
         card_num = 0
         mock_ic_card_id = f"DEBUG_CARD_{card_num:03d}"
@@ -122,6 +229,8 @@ class MainWindow(QMainWindow):
 
     def mock_card_read(self):
         """デバッグ用: ボタンを押すと仮想カードIDを読み込む"""
+        import db_alchemy
+
         # 仮のICカードIDと現在の時刻を使ってスロットを呼び出し
         # データベースから適当に一つカードを取得
         mock_ic_card_id = db_alchemy.IC_Card.get_all()[0].ic_card_number
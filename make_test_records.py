@@ -1,14 +1,14 @@
 from datetime import datetime, timedelta
 import random
-from db_alchemy import Employee, AttendanceRecord, RecordType
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from db_alchemy import (
+    Employee,
+    AttendanceRecord,
+    DailySummary,
+    PunchState,
+    RecordType,
+    Session,
+)
 import time_util
-from config import DATABASE_PATH
-
-# SQLiteエンジンを作成し、データベースに接続
-engine = create_engine(f"sqlite:///{DATABASE_PATH}", echo=True)
-Session = sessionmaker(bind=engine)
 
 
 def insert_random_attendance_records(num_records: int = 20):
@@ -59,6 +59,10 @@ def insert_random_attendance_records(num_records: int = 20):
         session.commit()
         print(f"{num_records}件の勤怠記録が挿入されました。")
 
+    # punchを通さずに挿入したので、最終打刻の状態と日ごとの集計を作り直す
+    PunchState.rebuild()
+    DailySummary.rebuild()
+
 
 # 実行
 insert_random_attendance_records(20)
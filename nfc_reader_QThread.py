@@ -1,8 +1,12 @@
 from PySide6.QtCore import QThread, Signal
 import nfc
+from collections import deque
 from typing import Callable, Optional
+import threading
 import time
 
+from config import DEBUG
+
 
 class NfcReaderMock(QThread):
     """NFCリーダーがつながっていない場合にテストするためのダミークラス"""
@@ -16,21 +20,83 @@ class NfcReaderMock(QThread):
     def run(self):
         pass
 
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class ScriptedTarget:
+    """ScriptedFrontendが返すターゲット。activate後のtagとしても振る舞う"""
+
+    sel_res = None
+    sensf_res = None
+
+    def __init__(self, ic_card_id: str):
+        self.identifier = bytes.fromhex(ic_card_id)
+
+
+class ScriptedFrontend:
+    """nfc.ContactlessFrontendの代わりに台本どおりにカードを検出するダミー
+
+    scriptの要素を1回のsenseごとに1つずつ返す。要素はICカードID(16進数の文字列)か、
+    カードがないことを表すNone。台本が終わった後は常にNoneを返す。
+    NfcReaderのactivateにはScriptedFrontend.activateを渡す
+    """
+
+    def __init__(self, script: list[Optional[str]]):
+        self.script = deque(script)
+        self.sense_count = 0
+
+    def sense(self, *targets, iterations: int = 1, interval: float = 0.1):
+        self.sense_count += 1
+        ic_card_id = self.script.popleft() if self.script else None
+        if ic_card_id is None:
+            time.sleep(interval)
+            return None
+        return ScriptedTarget(ic_card_id)
+
+    @staticmethod
+    def activate(clf, target: ScriptedTarget) -> ScriptedTarget:
+        return target
+
 
 class NfcReader(QThread):
     """NFCリーダーをQThreadで動作させるクラス
     読み取りが完了したらon_connectを実行し、結果をメインスレッドに通知
     https://github.com/haraisao/nfc_reader を多分に参考にしています
+
+    continuous=Trueの場合はスレッドを終了せずにポーリングを続け、カードごとに通知する。
+    通知した後は一時停止するので、ダイアログなどを閉じたらresumeを呼ぶこと。
+    同じカードをdebounce秒以内に続けて検出した場合は、かざしたままとみなして通知しない。
     """
 
     nfc_connected = Signal(str)  # 読み取ったICカードIDをシグナルで送る
 
     def __init__(
-        self, clf: nfc.ContactlessFrontend, on_connect: Optional[Callable] = None
+        self,
+        clf: nfc.ContactlessFrontend,
+        on_connect: Optional[Callable] = None,
+        continuous: bool = False,
+        debounce: float = 2.0,
+        activate: Optional[Callable] = None,
     ):
         super().__init__()
         self.on_connect = on_connect or self.default_on_connect
         self.clf = clf
+        self.activate = activate or nfc.tag.activate
+        self.continuous = continuous
+        self.debounce = debounce
+        self.last_ic_card_id: Optional[str] = None
+        self.last_seen = 0.0
+        self.latencies: deque[float] = deque(maxlen=100)  # 検出から通知までの秒数
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._stopping = False
         self.toggle = True
         self.suica = self.set_felica("0003")  # iphone エキスプレスカード
         self.blank = self.set_felica("FFFF")  # felica ブランクカード
@@ -76,14 +142,75 @@ class NfcReader(QThread):
         else:
             return True
 
+    def pause(self):
+        """ポーリングを一時停止する"""
+        self._resumed.clear()
+
+    def resume(self):
+        """一時停止したポーリングを再開する"""
+        self._resumed.set()
+
+    def stop(self):
+        """ポーリングを終了する(現在のsenseが終わり次第runから抜ける)"""
+        self._stopping = True
+        self._resumed.set()
+
+    def is_duplicate(self, ic_card_id: str, now: float) -> bool:
+        """かざしたままのカードを再び検出しただけかどうか"""
+        duplicate = (
+            ic_card_id == self.last_ic_card_id and now - self.last_seen < self.debounce
+        )
+        self.last_ic_card_id = ic_card_id
+        self.last_seen = now
+        return duplicate
+
+    def latency_stats(self) -> tuple[float, float]:
+        """直近の検出から通知までの時間(平均, 最大)をミリ秒で返す"""
+        if not self.latencies:
+            return 0.0, 0.0
+        return (
+            sum(self.latencies) / len(self.latencies) * 1000,
+            max(self.latencies) * 1000,
+        )
+
     def run(self):
+        if self.continuous:
+            self.run_continuous()
+            return
         while self.sense() is None:
             time.sleep(0.1)
         if self.on_discover(self.target):
-            tag = nfc.tag.activate(self.clf, self.target)
+            tag = self.activate(self.clf, self.target)
             self.on_connect(tag)
             return
 
+    def run_continuous(self):
+        """stopが呼ばれるまでポーリングを続ける"""
+        while not self._stopping:
+            self._resumed.wait()
+            if self._stopping:
+                break
+            if self.sense() is None:
+                continue
+            detected_at = time.perf_counter()
+            if not self.on_discover(self.target):
+                continue
+            tag = self.activate(self.clf, self.target)
+            if not tag:
+                continue
+            if self.is_duplicate(tag.identifier.hex(), detected_at):
+                continue
+            # 通知を受け取った側がresumeするまで次のカードを読まない
+            self.pause()
+            self.on_connect(tag)
+            self.latencies.append(time.perf_counter() - detected_at)
+            if DEBUG:
+                average, worst = self.latency_stats()
+                print(
+                    f"検出から通知まで{self.latencies[-1] * 1000:.1f}ms"
+                    f"(平均{average:.1f}ms, 最大{worst:.1f}ms)"
+                )
+
 
 if __name__ == "__main__":
 
@@ -0,0 +1,203 @@
+"""打刻のペアリングを行うモジュール
+
+make_pairsは1日分の打刻をペアにする。pair_punchesは同じ規則で、
+期間全体の打刻を配列で一括してペアにする。
+- 出勤の次が同じ日の退勤ならペアにする
+- それ以外の出勤は(出勤, なし)として押し忘れ
+- ペアにならなかった退勤は(なし, 退勤)として押し忘れ
+
+打刻は(日付, 時刻)の昇順に並んだ平行な配列で渡す。
+NumPyがあればベクトル演算で、なければarrayモジュールと1回のループで計算する。
+CSVの出力・日ごとの集計・労働時間の集計はpair_daysを通してpair_punchesを使う。
+"""
+
+from array import array
+from datetime import date, datetime
+from typing import NamedTuple, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPyはなくても動く
+    np = None
+
+IN = 0
+OUT = 1
+MISSING = -1  # ペアの片方がないことを表すインデックス
+# これより少ない打刻は、NumPyの配列を作るよりarrayと1回のループで計算する方が速い
+NUMPY_MIN_PUNCHES = 256
+
+
+class Pairs(NamedTuple):
+    """ペアリングの結果。すべて同じ長さの配列で、i番目が1つのペアを表す
+
+    in_index, out_index: 元の配列でのインデックス(片方がなければMISSING)
+    day: ペアの日付キー
+    lost: 押し忘れのペアなら1
+    """
+
+    in_index: Sequence[int]
+    out_index: Sequence[int]
+    day: Sequence[int]
+    lost: Sequence[int]
+
+
+def make_pairs(punches):
+    """
+    打刻データをペアリングする関数。
+
+    Args:
+        punches (list[tuple]): 打刻データ [(type, time), ...]。
+                               type は "IN" または "OUT"。
+    Returns:
+        tuple: (punch_pairs, has_lost)
+               punch_pairs: [(IN_time, OUT_time), ...]
+               has_lost: True ifペアリングに失敗した打刻がある場合。
+    """
+    has_lost = False
+    punch_pairs = []
+
+    punches.reverse()  # リストを逆順にして処理しやすくする
+
+    while punches:
+        punch_type, punch_time = punches.pop()
+        if punch_type.name == "IN":  # "IN"の場合
+            if punches and punches[-1][0].name == "OUT":  # 次が"OUT"ならペアにする
+                _, next_time = punches.pop()
+                punch_pairs.append((punch_time, next_time))
+            else:  # 次が"OUT"でない、または打刻がない場合
+                punch_pairs.append((punch_time, None))
+                has_lost = True
+        elif punch_type.name == "OUT":  # "OUT"のみの場合
+            punch_pairs.append((None, punch_time))
+            has_lost = True
+
+    return punch_pairs, has_lost
+
+
+def encode_types(record_types) -> array:
+    """RecordTypeの列を IN=0, OUT=1 の配列に変換する"""
+    return array("b", (IN if t.name == "IN" else OUT for t in record_types))
+
+
+def day_keys(times: Sequence[datetime], use_numpy: bool = True) -> Sequence[int]:
+    """日時の列を日付キー(date.toordinal)の配列に変換する
+
+    strftimeで文字列を作らずに、日付ごとに異なる整数を求める。
+    """
+    if np is not None and use_numpy:
+        return np.fromiter((t.toordinal() for t in times), np.int64, len(times))
+    return array("q", (t.toordinal() for t in times))
+
+
+def pair_punches(types: Sequence[int], days: Sequence[int], use_numpy: bool = True) -> Pairs:
+    """期間全体の打刻を1回でペアにする
+
+    Args:
+        types (Sequence[int]): 打刻の種類 IN(0)またはOUT(1)
+        days (Sequence[int]): 打刻の日付キー(日付ごとに異なる整数)
+        use_numpy (bool): FalseならNumPyがあっても使わない
+
+    Returns:
+        Pairs: 日付・時刻の順に並んだペア
+    """
+    if np is not None and use_numpy:
+        return _pair_numpy(np.asarray(types, dtype=np.int8), np.asarray(days))
+    return _pair_array(types, days)
+
+
+def _pair_numpy(types, days) -> Pairs:
+    n = len(types)
+    is_in = types == IN
+    # 次の打刻とペアになる出勤
+    pairs_next = np.zeros(n, dtype=bool)
+    pairs_next[:-1] = is_in[:-1] & (types[1:] == OUT) & (days[1:] == days[:-1])
+    # 前の出勤とペアになった退勤
+    paired_out = np.zeros(n, dtype=bool)
+    paired_out[1:] = pairs_next[:-1]
+
+    # ペアの先頭は、すべての出勤とペアにならなかった退勤
+    starts = np.flatnonzero(is_in | ~paired_out)
+    starts_in = is_in[starts]
+    in_index = np.where(starts_in, starts, MISSING)
+    out_index = np.where(
+        starts_in, np.where(pairs_next[starts], starts + 1, MISSING), starts
+    )
+    lost = (in_index == MISSING) | (out_index == MISSING)
+    return Pairs(in_index, out_index, days[starts], lost.astype(np.int8))
+
+
+def _pair_array(types: Sequence[int], days: Sequence[int]) -> Pairs:
+    in_index = array("q")
+    out_index = array("q")
+    pair_days = array("q")
+    lost = array("b")
+    n = len(types)
+    i = 0
+    while i < n:
+        if types[i] == IN:
+            if i + 1 < n and types[i + 1] == OUT and days[i + 1] == days[i]:
+                in_index.append(i)
+                out_index.append(i + 1)
+                lost.append(0)
+                pair_days.append(days[i])
+                i += 2
+                continue
+            in_index.append(i)
+            out_index.append(MISSING)
+        else:
+            in_index.append(MISSING)
+            out_index.append(i)
+        lost.append(1)
+        pair_days.append(days[i])
+        i += 1
+    return Pairs(in_index, out_index, pair_days, lost)
+
+
+def pairs_by_day(pairs: Pairs, times: Sequence[datetime]) -> dict[int, tuple[list, bool]]:
+    """ペアを日付キーごとにまとめ、make_pairsと同じ形式で返す
+
+    Returns:
+        dict: 日付キー -> ([(IN_time, OUT_time), ...], has_lost)
+    """
+    result: dict[int, tuple[list, bool]] = {}
+    for in_i, out_i, day, lost in zip(
+        pairs.in_index, pairs.out_index, pairs.day, pairs.lost
+    ):
+        day = int(day)
+        if day not in result:
+            result[day] = ([], False)
+        punch_pairs, has_lost = result[day]
+        punch_pairs.append(
+            (
+                times[in_i] if in_i != MISSING else None,
+                times[out_i] if out_i != MISSING else None,
+            )
+        )
+        if lost:
+            result[day] = (punch_pairs, True)
+    return result
+
+
+def pair_days(punches: Sequence[tuple], use_numpy: bool = True) -> dict[date, tuple[list, bool]]:
+    """時刻順の打刻(何日分でもよい)を1回でペアにし、日付ごとにmake_pairsと同じ形式で返す
+
+    日付ごとに分けてmake_pairsを呼ぶのと同じ結果になる。渡したリストは変更しない
+
+    Args:
+        punches (Sequence[tuple]): 打刻データ [(type, time), ...] 時刻の昇順
+        use_numpy (bool): FalseならNumPyがあっても使わない
+
+    Returns:
+        dict: 日付 -> ([(IN_time, OUT_time), ...], has_lost) 打刻のある日だけ
+    """
+    times = [punch_time for _, punch_time in punches]
+    use_numpy = use_numpy and len(times) >= NUMPY_MIN_PUNCHES
+    pairs = pair_punches(
+        encode_types(record_type for record_type, _ in punches),
+        day_keys(times, use_numpy),
+        use_numpy,
+    )
+    return {
+        date.fromordinal(day): result
+        for day, result in pairs_by_day(pairs, times).items()
+    }
@@ -0,0 +1,184 @@
+"""勤怠記録から労働時間・深夜時間・残業時間を計算するモジュール
+
+日ごとの労働時間・深夜時間は打刻のたびに日ごとの集計(DailySummary)に記録されているので、
+期間の集計は従業員・日ごとに1行を読んで合計するだけでよい。
+残業時間の計算方法はテンプレート種別(EMPLOYEE_LISTの値)ごとにconfig.PAYROLL_RULESで設定する。
+時間はすべて分単位の整数で扱う。
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+import argparse
+
+import config
+from db_alchemy import Employee
+import time_util
+import to_csv
+
+ONE_DAY = timedelta(days=1)
+
+
+class Totals(NamedTuple):
+    """労働時間の集計(分)
+
+    lostは押し忘れのある日数(日ごとの集計では0か1)
+    """
+
+    worked: int = 0
+    night: int = 0
+    overtime: int = 0
+    lost: int = 0
+
+
+class EmployeeTotals(NamedTuple):
+    """従業員1人分の集計結果"""
+
+    name: str
+    template: Optional[str]
+    daily: dict  # 日付(date) -> Totals
+    total: Totals
+
+
+def sum_totals(totals: Iterable[Totals]) -> Totals:
+    """Totalsを項目ごとに合計する"""
+    worked = night = overtime = lost = 0
+    for t in totals:
+        worked += t.worked
+        night += t.night
+        overtime += t.overtime
+        lost += t.lost
+    return Totals(worked, night, overtime, lost)
+
+
+def daily_totals(summary, template: Optional[str]) -> Totals:
+    """1日分の集計から労働時間・深夜時間・残業時間を求める
+
+    Args:
+        summary: DailySummary.iter_periodの行
+        template (Optional[str]): テンプレート種別
+
+    Returns:
+        Totals: その日の集計 片方が押し忘れのペアは時間に含めない
+    """
+    overtime_after = config.PAYROLL_RULES.get(template, {}).get("overtime_after")
+    overtime = 0
+    if overtime_after is not None:
+        overtime = max(0, summary.worked_minutes - overtime_after)
+    return Totals(
+        summary.worked_minutes, summary.night_minutes, overtime, int(summary.lost)
+    )
+
+
+def employee_totals(
+    name: str, template: Optional[str], daily_summaries: dict
+) -> EmployeeTotals:
+    """日ごとの集計から従業員1人分の集計を作る
+
+    Args:
+        name (str): 従業員名
+        template (Optional[str]): テンプレート種別
+        daily_summaries (dict): 日付 -> DailySummary.iter_periodの行
+
+    Returns:
+        EmployeeTotals: 日ごとと期間全体の集計
+    """
+    daily = {
+        day: daily_totals(summary, template)
+        for day, summary in daily_summaries.items()
+    }
+    return EmployeeTotals(name, template, daily, sum_totals(daily.values()))
+
+
+def compute_totals(
+    start_date: datetime, end_date: datetime, employee_mapping: dict
+) -> list[EmployeeTotals]:
+    """期間内の全従業員の集計を、日ごとの集計を1回のクエリで読んで計算する
+
+    Args:
+        start_date (datetime): 期間の開始(この日を含む)
+        end_date (datetime): 期間の終了(この日を含まない)
+        employee_mapping (dict): 従業員名 -> テンプレート種別
+
+    Returns:
+        list[EmployeeTotals]: employee_id順の従業員ごとの集計
+    """
+    results = []
+    for name, daily_summaries in to_csv.iter_daily_summaries(
+        Employee.get_all(), start_date, end_date
+    ):
+        template = employee_mapping.get(name)
+        if template not in config.PAYROLL_RULES:
+            print(f"{name} のテンプレート種別({template})の計算方法が設定されていません。")
+        results.append(employee_totals(name, template, daily_summaries))
+    return results
+
+
+def month_totals(
+    year: int, month: int, employee_mapping: dict, until: Optional[datetime] = None
+) -> list[EmployeeTotals]:
+    """指定された月の集計期間の集計を計算する
+
+    Args:
+        year (int): 年
+        month (int): 月
+        employee_mapping (dict): 従業員名 -> テンプレート種別
+        until (Optional[datetime]): 指定すればこの日時の日までを集計する(今月のここまで)
+
+    Returns:
+        list[EmployeeTotals]: 従業員ごとの集計
+    """
+    start_date, end_date, _ = to_csv.pay_period(year, month)
+    if until is not None:
+        # 日ごとに集計しているので、untilの日の分まで含める
+        next_day = datetime.combine(until.date() + ONE_DAY, datetime.min.time())
+        end_date = min(end_date, next_day)
+    return compute_totals(start_date, end_date, employee_mapping)
+
+
+def format_minutes(minutes: int) -> str:
+    """分を H:MM の形式にする"""
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def print_totals(results: list[EmployeeTotals], detail: bool = False):
+    """集計結果を表示する"""
+    for result in results:
+        total = result.total
+        print(
+            f"{result.name}({result.template}) "
+            f"出勤日数 {len(result.daily)} "
+            f"労働 {format_minutes(total.worked)} "
+            f"深夜 {format_minutes(total.night)} "
+            f"残業 {format_minutes(total.overtime)} "
+            f"要確認 {total.lost}日"
+        )
+        if detail:
+            for day, t in sorted(result.daily.items()):
+                print(
+                    f"    {day.strftime(to_csv.TIME_FORMAT)} "
+                    f"労働 {format_minutes(t.worked)} "
+                    f"深夜 {format_minutes(t.night)} "
+                    f"残業 {format_minutes(t.overtime)}"
+                    + (" 要確認" if t.lost else "")
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="労働時間・深夜時間・残業時間を集計する")
+    parser.add_argument("date", nargs="?", help="年と月 例: 2024/08, 2024/8, 24/08, 24/8")
+    parser.add_argument(
+        "--so-far", action="store_true", help="今日までの打刻だけを集計する"
+    )
+    parser.add_argument("--detail", action="store_true", help="日ごとの集計も表示する")
+    args = parser.parse_args()
+    if args.date is None:
+        input_str = input("年と月を入力 例: 2024/08, 2024/8, 24/08, 24/8 ->")
+    else:
+        input_str = args.date
+    year, month = time_util.parse_date_string(input_str)
+    employee_mapping = to_csv.load_employee_mapping(Path(config.EMPLOYEE_LIST))
+    results = month_totals(
+        year, month, employee_mapping, datetime.now() if args.so_far else None
+    )
+    print_totals(results, args.detail)
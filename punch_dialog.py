@@ -3,38 +3,40 @@ from PySide6.QtWidgets import (
     QLabel,
     QVBoxLayout,
     QPushButton,
+    QWidget,
 )
 from PySide6.QtCore import QTimer
 import db_alchemy
-from config import TIME_OUT, WINDOW_SIZE, MessageTexts, StyleSheets
+import punch_writer
+from config import DEBUG, TIME_OUT, WINDOW_SIZE, MessageTexts, StyleSheets
+from collections import deque
 from datetime import datetime
+import time
 import time_util
 from typing import Optional
 
 
 class PunchDialog(QDialog):
     """
-    args
-    ic_card_id:str
-    punch_time:QDateTime
-
     MainWindowでICカードの読み取りを検出したときに表示されるウィンドウ。
-    ic_card_id（ICカードのID）とpunch_time（打刻時刻）を引数として受け取る。
+    起動時に1回だけ作成し、タップのたびにpunch(ic_card_id, punch_time)で従業員と打刻時刻を差し替えて表示する。
     ic_card_idと紐づけられた従業員の最終打刻記録を取得し、最終打刻の状態に応じて「出勤」または「退勤」を決定する。
     ウィンドウには従業員名、打刻時刻、および現在の「出勤」または「退勤」の状態が表示され、必要に応じて出勤/退勤を切り替えるためのトグルボタンも表示する。
     ダイアログは一定時間表示され、トグルボタンが押された場合はタイマーがリセットされる。ダイアログが消えるときに、出勤/退勤の情報がデータベースに記録される。
+    出勤・退勤の背景はStyleSheets.punch_dialogをstatusプロパティで切り替えるので、スタイルシートの解析は最初の1回だけで済む。
     """
 
-    def __init__(self, ic_card_id: str, punch_time: datetime, *args, **kwargs):
+    def __init__(self, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
 
         self.timeout = TIME_OUT
-        self.employee = db_alchemy.IC_Card.find_employee_by_ic_card_number(ic_card_id)
-        assert self.employee is not None
-        self.punch_time = punch_time
-        self.last_record = db_alchemy.AttendanceRecord.get_last_record(self.employee)
-        self.current_status: db_alchemy.RecordType = self.determine_status()
+        self.employee: Optional[db_alchemy.Employee] = None
+        self.punch_time: Optional[datetime] = None
+        self.last_record = None
+        self.current_status = db_alchemy.RecordType.IN
+        self.read_at: Optional[float] = None  # 表示までの時間を測っているタップの読み取り時刻
+        self.latencies: deque[float] = deque(maxlen=100)  # 読み取りから描画までの秒数
 
         self._gui_init()
         self._init_timer()
@@ -53,13 +55,6 @@ class PunchDialog(QDialog):
 
         self.ok_button = QPushButton("キャンセル")
         self.ok_button.clicked.connect(self.reject)  # OKを押したらダイアログを閉じる
-        self.status_label.setText(
-            MessageTexts.greeting(
-                self.employee.name,
-                time_util.datetime_to_string(self.punch_time),
-                self.current_status,
-            )
-        )
 
         # レイアウトの設定
         layout = QVBoxLayout()
@@ -69,10 +64,99 @@ class PunchDialog(QDialog):
         layout.setSpacing(50)
         layout.addWidget(self.ok_button)
         self.setLayout(layout)
-        if self.current_status == db_alchemy.RecordType.IN:
-            self.setStyleSheet(StyleSheets.bg_punch_in)
-        elif self.current_status == db_alchemy.RecordType.OUT:
-            self.setStyleSheet(StyleSheets.bg_punch_out)
+        self.setProperty("status", self.current_status.name)
+        self.setStyleSheet(StyleSheets.punch_dialog)
+
+    def bind(
+        self,
+        employee: db_alchemy.Employee,
+        last_state: Optional[db_alchemy.PunchState],
+        punch_time: datetime,
+        read_at: Optional[float] = None,
+    ):
+        """
+        タップされたICカードの従業員と打刻時刻を表示する内容に設定する。
+        DBには問い合わせない
+
+        Args:
+            employee (Employee): ICカードと紐づけられた従業員
+            last_state (Optional[PunchState]): 従業員の最終打刻の状態
+                                               IC_Card.find_employee_and_stateで一緒に読んだもの
+            punch_time (datetime): 打刻時刻
+            read_at (Optional[float]): カードを読み取ったtime.perf_counter()の値
+                                       描画までの時間の計測に使う 省略すると今
+        """
+        self.employee = employee
+        self.punch_time = punch_time
+        # DBへの書き込みを待っている打刻があればそちらが最終打刻
+        self.last_record = (
+            punch_writer.writer.last_pending(self.employee.employee_id) or last_state
+        )
+        self.current_status = self.determine_status()
+        self.read_at = time.perf_counter() if read_at is None else read_at
+        self._show_status()
+        self.timer.start(1000)
+
+    def punch(
+        self,
+        employee: db_alchemy.Employee,
+        last_state: Optional[db_alchemy.PunchState],
+        punch_time: datetime,
+        read_at: Optional[float] = None,
+    ) -> int:
+        """
+        従業員と打刻時刻を差し替えてダイアログを表示し、閉じるまで待つ。
+
+        Args:
+            employee (Employee): ICカードと紐づけられた従業員
+            last_state (Optional[PunchState]): 従業員の最終打刻の状態
+            punch_time (datetime): 打刻時刻
+            read_at (Optional[float]): カードを読み取ったtime.perf_counter()の値
+
+        Returns:
+            int: QDialog.AcceptedかQDialog.Rejected
+        """
+        self.bind(employee, last_state, punch_time, read_at)
+        return self.exec()
+
+    def _show_status(self):
+        """ラベルとstatusプロパティを今の従業員・打刻の状態に合わせる"""
+        self.timeout = TIME_OUT
+        self.countdown_label.setText(MessageTexts.punching(self.timeout))
+        self.status_label.setText(
+            MessageTexts.greeting(
+                self.employee.name,
+                time_util.datetime_to_string(self.punch_time),
+                self.current_status,
+            )
+        )
+        if self.property("status") != self.current_status.name:
+            self.setProperty("status", self.current_status.name)
+            # プロパティのセレクタは再適用しないと反映されない(スタイルシートの解析はしない)
+            for widget in [self, *self.findChildren(QWidget)]:
+                widget.style().unpolish(widget)
+                widget.style().polish(widget)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.read_at is not None:
+            self.latencies.append(time.perf_counter() - self.read_at)
+            self.read_at = None
+            if DEBUG:
+                average, worst = self.latency_stats()
+                print(
+                    f"読み取りから表示まで{self.latencies[-1] * 1000:.1f}ms"
+                    f"(平均{average:.1f}ms, 最大{worst:.1f}ms)"
+                )
+
+    def latency_stats(self) -> tuple[float, float]:
+        """直近の読み取りから描画までの時間(平均, 最大)をミリ秒で返す"""
+        if not self.latencies:
+            return 0.0, 0.0
+        return (
+            sum(self.latencies) / len(self.latencies) * 1000,
+            max(self.latencies) * 1000,
+        )
 
     def determine_status(self) -> db_alchemy.RecordType:
         """本日初めての打刻かどうかを判断する"""
@@ -101,10 +185,9 @@ class PunchDialog(QDialog):
             raise ValueError
 
     def _init_timer(self):
-        # タイマーを設定し、指定した時間後にダイアログを閉じる
+        # タイマーを設定し、指定した時間後にダイアログを閉じる bindで開始する
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.countdown)
-        self.timer.start(1000)
 
     def countdown(self):
         self.timeout -= 1
@@ -113,35 +196,26 @@ class PunchDialog(QDialog):
             self.accept()
 
     def accept(self):
-        # 打刻処理をしてウィンドウを閉じる
-        db_alchemy.AttendanceRecord.punch(
+        # 打刻をジャーナルに記録してウィンドウを閉じる DBへの書き込みはバックグラウンドで行う
+        punch_writer.writer.submit(
             self.employee.employee_id, self.current_status, self.punch_time
         )
         super().accept()
 
+    def done(self, result: int):
+        # ダイアログは使い回すので、閉じたらカウントダウンを止める
+        self.timer.stop()
+        super().done(result)
+
     def toggle_status(self):
-        """トグルボタンがクリックされたときに状態を変更する
-        TODO 背景も変えたい"""
+        """トグルボタンがクリックされたときに状態を変更する"""
 
         self.current_status = (
             db_alchemy.RecordType.IN
             if self.current_status == db_alchemy.RecordType.OUT
             else db_alchemy.RecordType.OUT
         )
-        if self.current_status == db_alchemy.RecordType.IN:
-            self.setStyleSheet(StyleSheets.bg_punch_in)
-        elif self.current_status == db_alchemy.RecordType.OUT:
-            self.setStyleSheet(StyleSheets.bg_punch_out)
-
-        self.timeout = TIME_OUT
-        self.countdown_label.setText(MessageTexts.punching(self.timeout))
-        self.status_label.setText(
-            MessageTexts.greeting(
-                self.employee.name,
-                time_util.datetime_to_string(self.punch_time),
-                self.current_status,
-            )
-        )
+        self._show_status()
 
 
 if __name__ == "__main__":
@@ -153,10 +227,8 @@ if __name__ == "__main__":
     assert test_cards is not None
     test_card = test_cards[0]
     app = QApplication([])
-    window = PunchDialog(
-        test_card.ic_card_number,
-        time_util.current_time(),
+    window = PunchDialog()
+    employee, last_state = db_alchemy.IC_Card.find_employee_and_state(
+        test_card.ic_card_number
     )
-    window.show()
-
-    app.exec()
+    window.punch(employee, last_state, time_util.current_time())
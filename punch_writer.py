@@ -0,0 +1,230 @@
+"""打刻をバックグラウンドのスレッドでデータベースに書き込む
+
+PunchDialogからの打刻はまずジャーナル(追記専用のファイル)にfsyncして記録し、
+キューに入れてすぐに返る。DBへの書き込みは別スレッドで行うため、
+SDカードが遅い場合やDBがロックされている場合でも画面が固まらない。
+起動時にはジャーナルを読み直し、DBに記録されていない打刻を書き込みスレッドが
+キューより先に1回だけ書き込む。
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple, Optional
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from config import PUNCH_JOURNAL_PATH
+import db_alchemy
+from db_alchemy import RecordType
+
+
+class PendingPunch(NamedTuple):
+    """DBへの書き込みを待っている打刻"""
+
+    id: str
+    employee_id: int
+    record_type: RecordType
+    record_time: datetime
+
+
+class PunchJournal:
+    """打刻の追記専用ジャーナル(JSON Lines)
+
+    1行が1つの出来事で、打刻
+        {"id": ..., "employee_id": ..., "record_type": "IN", "record_time": "..."}
+    とDBへの書き込み完了
+        {"id": ..., "committed": true}
+    の2種類がある。すべての打刻が書き込み済みになったら空にする。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._uncommitted: set[str] = set()
+
+    def _append(self, entry: dict):
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _to_entry(punch: PendingPunch) -> dict:
+        return {
+            "id": punch.id,
+            "employee_id": punch.employee_id,
+            "record_type": punch.record_type.name,
+            "record_time": punch.record_time.isoformat(),
+        }
+
+    def append(self, punch: PendingPunch):
+        """打刻を記録する。戻った時点でディスクに書き込まれている"""
+        with self._lock:
+            self._append(self._to_entry(punch))
+            self._uncommitted.add(punch.id)
+
+    def mark_committed(self, punch_id: str):
+        """打刻がDBに書き込まれたことを記録する"""
+        with self._lock:
+            self._uncommitted.discard(punch_id)
+            if not self._uncommitted:
+                # 書き込み待ちがなければジャーナルを空にする
+                self.path.write_text("", encoding="utf-8")
+            else:
+                self._append({"id": punch_id, "committed": True})
+
+    def pending(self) -> list[PendingPunch]:
+        """DBへの書き込みが記録されていない打刻を記録順に返す
+
+        ジャーナルは書き込み待ちの打刻だけに書き直す(壊れた行もここで取り除かれる)
+        """
+        if not self.path.exists():
+            return []
+        punches: dict[str, PendingPunch] = {}
+        with self._lock, self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で電源が落ちた行は読み飛ばす
+                    print(f"ジャーナルの壊れた行を読み飛ばします: {line!r}")
+                    continue
+                if entry.get("committed"):
+                    punches.pop(entry["id"], None)
+                    continue
+                punches[entry["id"]] = PendingPunch(
+                    id=entry["id"],
+                    employee_id=entry["employee_id"],
+                    record_type=RecordType[entry["record_type"]],
+                    record_time=datetime.fromisoformat(entry["record_time"]),
+                )
+            self._uncommitted = set(punches)
+            self._rewrite(list(punches.values()))
+        return list(punches.values())
+
+    def _rewrite(self, punches: list[PendingPunch]):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            for punch in punches:
+                f.write(json.dumps(self._to_entry(punch), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class PunchWriter:
+    """キューに入った打刻をバックグラウンドのスレッドでDBに書き込む"""
+
+    RETRY = 5  # DBへの書き込みに失敗したときに試す回数
+
+    def __init__(self, journal: PunchJournal):
+        self.journal = journal
+        self._queue: queue.Queue[Optional[PendingPunch]] = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._latest: dict[int, PendingPunch] = {}  # 従業員ごとの書き込み待ちの最新の打刻
+
+    def start(self):
+        """書き込みスレッドを起動する
+
+        ジャーナルに残っている打刻は、スレッドがキューより先に書き込む。
+        呼び出したスレッド(GUI)はジャーナルを読むだけで、DBへの書き込みやリトライを待たない
+        """
+        if self._thread is not None:
+            return
+        pending = self.journal.pending()
+        with self._lock:
+            # 書き込むまでは、打刻の状態の判定にジャーナルの打刻を使う
+            for punch in pending:
+                self._latest[punch.employee_id] = punch
+        self._thread = threading.Thread(
+            target=self._run, args=(pending,), name="PunchWriter", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """キューに残っている打刻を書き込んでからスレッドを終了する"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # 書き込めなかった打刻はジャーナルに残り、次回の起動時に書き込まれる
+            print("打刻の書き込みが終わらないまま終了します。")
+            return
+        self._thread = None
+
+    def replay(self, pending: Optional[list[PendingPunch]] = None):
+        """ジャーナルのうちDBに記録されていない打刻を書き込む
+
+        Args:
+            pending (Optional[list[PendingPunch]]): 読み込み済みの書き込み待ちの打刻
+                                                   省略した場合はジャーナルから読む
+        """
+        if pending is None:
+            pending = self.journal.pending()
+        for punch in pending:
+            if db_alchemy.AttendanceRecord.exists(
+                punch.employee_id, punch.record_type, punch.record_time
+            ):
+                # DBへの書き込み後、完了を記録する前に終了していた
+                self._mark_committed(punch)
+                continue
+            print(f"ジャーナルに残っていた打刻を書き込みます: {punch}")
+            self._commit(punch)
+
+    def submit(self, employee_id: int, record_type: RecordType, punch_time: datetime):
+        """打刻をジャーナルに記録し、DBへの書き込みをキューに入れる"""
+        if self._thread is None:
+            self.start()
+        punch = PendingPunch(uuid.uuid4().hex, employee_id, record_type, punch_time)
+        self.journal.append(punch)
+        with self._lock:
+            self._latest[employee_id] = punch
+        self._queue.put(punch)
+
+    def last_pending(self, employee_id: int) -> Optional[PendingPunch]:
+        """DBへの書き込みを待っている従業員の最新の打刻(なければNone)"""
+        with self._lock:
+            return self._latest.get(employee_id)
+
+    def _commit(self, punch: PendingPunch) -> bool:
+        for attempt in range(1, self.RETRY + 1):
+            try:
+                # コミットした後に例外が出た場合もあるので、やり直す前に記録済みか確かめる
+                if attempt == 1 or not db_alchemy.AttendanceRecord.exists(
+                    punch.employee_id, punch.record_type, punch.record_time
+                ):
+                    db_alchemy.AttendanceRecord.punch(
+                        punch.employee_id, punch.record_type, punch.record_time
+                    )
+                break
+            except Exception as e:
+                print(f"打刻の書き込みに失敗しました({attempt}/{self.RETRY}回目): {e}")
+                time.sleep(attempt)
+        else:
+            # ジャーナルに残しておき、次回の起動時に書き込む
+            return False
+        self._mark_committed(punch)
+        return True
+
+    def _mark_committed(self, punch: PendingPunch):
+        self.journal.mark_committed(punch.id)
+        with self._lock:
+            if self._latest.get(punch.employee_id) == punch:
+                del self._latest[punch.employee_id]
+
+    def _run(self, pending: list[PendingPunch]):
+        self.replay(pending)
+        while True:
+            punch = self._queue.get()
+            if punch is None:
+                break
+            self._commit(punch)
+
+
+writer = PunchWriter(PunchJournal(Path(PUNCH_JOURNAL_PATH)))
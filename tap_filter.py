@@ -0,0 +1,55 @@
+from collections import Counter, OrderedDict
+from typing import Callable
+import time
+
+from config import DUPLICATE_TAP_WINDOW
+
+
+class TapFilter:
+    """同じICカードの続けてのタップを一定時間無視するフィルタ
+
+    カードを長めにかざしたときの二重読み取りや、すぐにかざし直したことによる
+    反対の打刻を防ぐ。受け付けたタップの時刻をLRUで保持し、
+    window秒を過ぎたものとmaxsizeを超えた古いものから捨てる。
+    """
+
+    def __init__(
+        self,
+        window: float = DUPLICATE_TAP_WINDOW,
+        maxsize: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = window
+        self.maxsize = maxsize
+        self.clock = clock
+        self._taps: OrderedDict[str, float] = OrderedDict()  # 古い順
+        self.suppressed = 0  # 無視したタップの総数
+        self.suppressed_by_card: Counter[str] = Counter()
+
+    def _expire(self, now: float):
+        while self._taps:
+            ic_card_id, tapped_at = next(iter(self._taps.items()))
+            if now - tapped_at < self.window:
+                break
+            del self._taps[ic_card_id]
+
+    def accept(self, ic_card_id: str) -> bool:
+        """タップを受け付けるならTrue、直前のタップと重複しているならFalse"""
+        now = self.clock()
+        self._expire(now)
+        if ic_card_id in self._taps:
+            self.suppressed += 1
+            self.suppressed_by_card[ic_card_id] += 1
+            return False
+        self._taps[ic_card_id] = now
+        if len(self._taps) > self.maxsize:
+            self._taps.popitem(last=False)
+        return True
+
+    def suppressed_stats(self, top: int = 5) -> tuple[int, list[tuple[str, int]]]:
+        """無視したタップの総数と、多い順のカード(ICカードのID, 回数)top件を返す"""
+        return self.suppressed, self.suppressed_by_card.most_common(top)
+
+    def forget(self, ic_card_id: str):
+        """タップをなかったことにする(打刻をキャンセルしたときなど)"""
+        self._taps.pop(ic_card_id, None)
@@ -0,0 +1,108 @@
+"""テスト共通の設定
+
+リポジトリ直下のモジュールをimportできるようにし、
+データベース・出力フォルダ・テンプレートのキャッシュを一時フォルダに向ける。
+本番のデータベース(config.DATABASE_PATH)には触らない。
+"""
+
+from contextlib import redirect_stdout
+from copy import copy
+from pathlib import Path
+import io
+import os
+import sys
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# offscreenはウィンドウのサイズの通知に対応していないという警告を出さない
+os.environ.setdefault("QT_LOGGING_RULES", "default.warning=false")
+
+import config  # noqa: E402
+import db_alchemy  # noqa: E402
+from openpyxl.worksheet.formula import ArrayFormula  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_config(tmp_path, monkeypatch):
+    """出力先・キャッシュ・従業員リストを一時フォルダに向け、Sessionの接続先を元に戻す"""
+    monkeypatch.setattr(config, "CSV_PATH", str(tmp_path / "csv"))
+    monkeypatch.setattr(config, "TEMPLATE_CACHE_PATH", str(tmp_path / "cache"))
+    monkeypatch.setattr(config, "TEMPLATE_PATH", str(REPO / "template.xlsm"))
+    monkeypatch.setattr(config, "EMPLOYEE_LIST", str(tmp_path / "employee_list.txt"))
+    bind = db_alchemy.Session.kw.get("bind")
+    yield
+    db_alchemy.Session.configure(bind=bind)
+    db_alchemy.card_resolver.invalidate()
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """合成データベースを作成してSessionをそちらに向ける関数を返す"""
+    from synthetic import make_synthetic_db
+
+    engines = []
+
+    def make(employees: int = 3, years: int = 1, name: str = "test.db"):
+        with redirect_stdout(io.StringIO()):
+            engine = make_synthetic_db(tmp_path / name, employees, years)
+        db_alchemy.card_resolver.invalidate()
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    """画面なしのQApplication"""
+    from PySide6.QtWidgets import QApplication
+
+    return QApplication.instance() or QApplication([])
+
+
+def comparable(value):
+    """ArrayFormulaは==で比較できないので範囲と式で比較する"""
+    if isinstance(value, ArrayFormula):
+        return value.ref, value.text
+    return value
+
+
+def sheet_values(path: Path) -> dict[str, list]:
+    """ワークブックのシートごとのセルの値(シートの順番も含む)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path)
+    return {
+        ws.title: [
+            [comparable(value) for value in row] for row in ws.iter_rows(values_only=True)
+        ]
+        for ws in wb
+    }
+
+
+def assert_same_sheet(source_ws, ws):
+    """値・見た目の書式・列幅・行の高さが一致することを確認する"""
+    for row in source_ws.iter_rows():
+        for cell in row:
+            new_cell = ws[cell.coordinate]
+            assert comparable(new_cell.value) == comparable(cell.value), (
+                ws.title,
+                cell.coordinate,
+            )
+            for attr in ("font", "fill", "border", "alignment", "protection"):
+                # StyleProxy同士は==で比較できないので、中身を取り出して比較する
+                assert copy(getattr(new_cell, attr)) == copy(getattr(cell, attr)), (
+                    ws.title,
+                    cell.coordinate,
+                    attr,
+                )
+            assert new_cell.number_format == cell.number_format, cell.coordinate
+    for col_letter, dimension in source_ws.column_dimensions.items():
+        assert ws.column_dimensions[col_letter].width == dimension.width, col_letter
+    for row_number, dimension in source_ws.row_dimensions.items():
+        assert ws.row_dimensions[row_number].height == dimension.height, row_number
@@ -0,0 +1,78 @@
+"""テストと性能計測で使う合成データ
+
+benchmark.pyからも使うので、pytestのフィクスチャではなく普通の関数にしている
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import random
+
+from sqlalchemy import insert
+
+import db_alchemy
+from db_alchemy import AttendanceRecord, Base, Employee, RecordType
+
+
+def make_synthetic_db(path: Path, employees: int, years: int, seed: int = 0):
+    """従業員数×年数分の打刻を持つデータベースを作成し、Sessionをそちらに向ける
+
+    各従業員は毎日、出勤・退勤を1組(たまに2組、たまに押し忘れ)打刻する
+    """
+    rng = random.Random(seed)
+    engine = db_alchemy.create_db_engine(str(path))
+    Base.metadata.create_all(engine)
+    db_alchemy.Session.configure(bind=engine)
+
+    now = datetime(2024, 1, 1)
+    with db_alchemy.Session() as session:
+        session.execute(
+            insert(Employee),
+            [
+                {"name": f"従業員{i:04d}", "created_at": now, "updated_at": now}
+                for i in range(employees)
+            ],
+        )
+        session.commit()
+
+    first_day = now - timedelta(days=365 * years)
+    for employee_id in range(1, employees + 1):
+        records = []
+        day = first_day
+        while day < now:
+            punch_in = day.replace(hour=rng.randint(7, 10), minute=rng.randint(0, 59))
+            punch_out = punch_in + timedelta(hours=rng.randint(4, 9))
+            records.append((RecordType.IN, punch_in))
+            if rng.random() > 0.01:  # 1%は退勤の押し忘れ
+                records.append((RecordType.OUT, punch_out))
+            if rng.random() < 0.05:  # 5%は中抜けで2組打刻
+                records.append((RecordType.IN, punch_out + timedelta(minutes=30)))
+                records.append((RecordType.OUT, punch_out + timedelta(hours=2)))
+            day += timedelta(days=1)
+        with db_alchemy.Session() as session:
+            session.execute(
+                insert(AttendanceRecord),
+                [
+                    {
+                        "employee_id": employee_id,
+                        "record_type": record_type,
+                        "record_time": record_time,
+                        "created_at": record_time,
+                        "updated_at": record_time,
+                    }
+                    for record_type, record_time in records
+                ],
+            )
+            session.commit()
+    # 打刻はpunchを通さずに挿入したので、最終打刻の状態と日ごとの集計を作る
+    db_alchemy.PunchState.rebuild(engine)
+    db_alchemy.DailySummary.rebuild(engine)
+    return engine
+
+
+def synthetic_mapping(employees: int) -> dict[str, str]:
+    """合成DBの従業員にテンプレートを順番に割り当てる"""
+    template_types = ["正社員", "パート", "ドクター"]
+    return {
+        f"従業員{i:04d}": template_types[i % len(template_types)]
+        for i in range(employees)
+    }
@@ -0,0 +1,86 @@
+from pathlib import Path
+import json
+import zipfile
+
+import pytest
+
+from conftest import sheet_values
+import batch_export
+import config
+import csv_to_xlsx
+from synthetic import synthetic_mapping
+import time_util
+import to_csv
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_batch_matches_per_month(make_db, tmp_path, capsys, streaming):
+    employees = 4
+    make_db(employees, 2)
+    mapping = synthetic_mapping(employees)
+    Path(config.EMPLOYEE_LIST).write_text(json.dumps(mapping, ensure_ascii=False), "utf-8")
+    year_months = time_util.parse_month_range("2023/10-2023/12")
+
+    for year, month in year_months:
+        output_dir = tmp_path / "per_month" / f"{year:04d}-{month:02d}"
+        csv_to_xlsx.db_to_excel(
+            year,
+            month,
+            Path(config.TEMPLATE_PATH),
+            mapping,
+            output_dir / "data.xlsm",
+            True,
+            incremental=False,
+        )
+    config.CSV_PATH = str(tmp_path / "batch")
+    batch_export.batch_export(year_months, incremental=False, streaming=streaming)
+
+    for year, month in year_months:
+        name = f"{year:04d}-{month:02d}"
+        a = tmp_path / "per_month" / name
+        b = tmp_path / "batch" / name
+        assert sheet_values(a / "data.xlsm") == sheet_values(b / "data.xlsm"), name
+        csv_files = list(a.glob("*.csv"))
+        assert len(csv_files) == employees
+        for csv_file in csv_files:
+            assert csv_file.read_bytes() == (b / csv_file.name).read_bytes()
+
+
+
+def test_streaming_batch_keeps_template_unchanged(make_db, tmp_path, capsys):
+    """書き込み専用モードで複数の月を続けて書き出しても、前の月の出力が後の月に影響しない"""
+    employees = 3
+    make_db(employees, 2)
+    mapping = synthetic_mapping(employees)
+    Path(config.EMPLOYEE_LIST).write_text(json.dumps(mapping, ensure_ascii=False), "utf-8")
+    template = csv_to_xlsx.load_template(Path(config.TEMPLATE_PATH))
+    tables = {
+        attr: list(getattr(template, attr))
+        for attr in csv_to_xlsx.WORKBOOK_STYLE_TABLES
+        if isinstance(getattr(template, attr), (list, set, tuple))
+    }
+    archive = template.vba_archive
+    vba_parts = {name: archive.read(name) for name in archive.namelist()}
+    year_months = time_util.parse_month_range("2023/10-2023/12")
+    for year, month, employee_rows in to_csv.iter_months_rows(year_months):
+        output_file = tmp_path / f"{year:04d}-{month:02d}" / "data.xlsm"
+        output_file.parent.mkdir()
+        csv_to_xlsx.stream_rows_to_excel(
+            year,
+            month,
+            employee_rows,
+            Path(config.TEMPLATE_PATH),
+            mapping,
+            output_file,
+            template,
+        )
+        assert template.vba_archive is archive
+        assert {name: archive.read(name) for name in archive.namelist()} == vba_parts
+        for attr, before in tables.items():
+            assert list(getattr(template, attr)) == before, attr
+
+    parts = []
+    for year, month in year_months:
+        with zipfile.ZipFile(tmp_path / f"{year:04d}-{month:02d}" / "data.xlsm") as f:
+            parts.append((f.read("xl/styles.xml"), f.read("xl/vbaProject.bin")))
+    assert parts[1:] == parts[:-1]
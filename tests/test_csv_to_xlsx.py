@@ -0,0 +1,311 @@
+from pathlib import Path
+import random
+import zipfile
+
+from openpyxl import load_workbook
+import pytest
+
+from conftest import assert_same_sheet, comparable, sheet_values
+import config
+import csv_to_xlsx
+from synthetic import synthetic_mapping
+import to_csv
+
+
+@pytest.fixture(scope="module")
+def template():
+    return load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+
+
+def template_types(template) -> list[str]:
+    return [name for name in template.sheetnames if name != "button"]
+
+
+@pytest.mark.parametrize("same_workbook", [False, True], ids=["styles", "copy_worksheet"])
+def test_copy_sheet_matches_template(template, same_workbook):
+    wb = load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+    source = wb if same_workbook else template
+    for i, template_type in enumerate(template_types(template) * 2):
+        name = f"従業員{i:04d}"
+        assert csv_to_xlsx.copy_sheet(source[template_type], wb, name)
+        csv_to_xlsx.initialize_sheet(wb[name])
+        ws = wb[name]
+        assert_same_sheet(template[template_type], ws)
+        assert ws.print_area.endswith("!$O$1:$V$38"), ws.print_area
+        assert len(ws.data_validations.dataValidation) == 1
+    assert not csv_to_xlsx.copy_sheet(source[template_type], wb, name)
+
+
+SHEET_SETTINGS = (
+    "merged_cells",
+    "page_setup",
+    "print_options",
+    "page_margins",
+    "sheet_properties",
+    "sheet_format",
+)
+
+
+def sheet_settings(ws) -> dict:
+    """シートの設定 結合セルは==で比較できないので文字列にする"""
+    settings = {attr: getattr(ws, attr) for attr in SHEET_SETTINGS}
+    settings["merged_cells"] = str(ws.merged_cells)
+    return settings
+
+
+def test_copy_sheet_paths_keep_same_settings(template, tmp_path):
+    """別のワークブックからのコピーでも、copy_worksheetと同じシートの設定になる(保存後も)"""
+    wb = load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+    pairs = []
+    for template_type in template_types(template):
+        csv_to_xlsx.copy_sheet(wb[template_type], wb, f"{template_type}_same")
+        csv_to_xlsx.copy_sheet(template[template_type], wb, f"{template_type}_other")
+        pairs.append((template_type, f"{template_type}_same", f"{template_type}_other"))
+    for template_type, same, other in pairs:
+        assert sheet_settings(wb[same]) == sheet_settings(template[template_type])
+        assert sheet_settings(wb[other]) == sheet_settings(wb[same]), template_type
+
+    wb.save(tmp_path / "copied.xlsm")
+    saved = load_workbook(tmp_path / "copied.xlsm", keep_vba=True)
+    for template_type, same, other in pairs:
+        assert sheet_settings(saved[other]) == sheet_settings(saved[same]), template_type
+
+
+def test_diff_rows_keeps_entered_values():
+    current = [
+        ("日付", None, ""),
+        ("12/01", to_csv.BLANK, "09:00"),
+        ("12/02", to_csv.LOST, "有給"),
+    ]
+    rows = [
+        ["日付", "出勤", "退勤"],
+        ["12/01", "09:00", "18:00"],
+        ["12/02", "10:00", "19:00"],
+    ]
+    # 空のセルと未定・押し忘れの表示だけを上書きし、値が同じセルは書き込まない
+    assert list(csv_to_xlsx.diff_rows(current, rows)) == [
+        (1, 2, "出勤"),
+        (1, 3, "退勤"),
+        (2, 2, "09:00"),
+        (3, 2, "10:00"),
+    ]
+
+
+def write_rows_by_cell(ws, rows) -> None:
+    """1セルずつ読み書きする(以前の方法)"""
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, value in enumerate(row, start=1):
+            if ws.cell(row=row_idx, column=col_idx).value in csv_to_xlsx.OVERWRITABLE_VALUES:
+                ws.cell(row=row_idx, column=col_idx, value=value)
+
+
+def test_write_rows_to_sheet_matches_cell_by_cell(template):
+    rng = random.Random(0)
+    rows = [["日付", "出勤", "退勤"]] + [
+        [f"12/{day:02d}", f"{rng.randint(7, 10):02d}:00", rng.choice(("18:00", to_csv.LOST))]
+        for day in range(1, 32)
+    ]
+    # 押し忘れを後から直した場合を想定して、一部のセルを押し忘れの表示にしておく
+    lost = [(rng.randint(2, 32), rng.randint(2, 5)) for _ in range(5)]
+    results = []
+    for write in (write_rows_by_cell, csv_to_xlsx.write_rows_to_sheet):
+        wb = load_workbook(config.TEMPLATE_PATH, keep_vba=True)
+        ws = wb[template_types(template)[0]]
+        for row_idx, col_idx in lost:
+            ws.cell(row=row_idx, column=col_idx, value=to_csv.LOST)
+        write(ws, rows)
+        results.append([[comparable(v) for v in row] for row in ws.iter_rows(values_only=True)])
+    assert results[0] == results[1]
+
+
+def test_template_cache(tmp_path):
+    template_file = tmp_path / "template.xlsm"
+    template_file.write_bytes(Path(config.TEMPLATE_PATH).read_bytes())
+
+    # キャッシュを作成した後も、保存したファイルの中身(VBAを含む)が同じになる
+    csv_to_xlsx.load_template(template_file)
+    load_workbook(template_file, keep_vba=True).save(tmp_path / "direct.xlsm")
+    csv_to_xlsx.load_template(template_file).save(tmp_path / "cached.xlsm")
+    assert sheet_values(tmp_path / "direct.xlsm") == sheet_values(tmp_path / "cached.xlsm")
+    with zipfile.ZipFile(tmp_path / "direct.xlsm") as direct, zipfile.ZipFile(
+        tmp_path / "cached.xlsm"
+    ) as cached:
+        assert "xl/vbaProject.bin" in cached.namelist()
+        for name in direct.namelist():
+            if name.startswith("xl/vba") or name.endswith(".bin"):
+                assert direct.read(name) == cached.read(name), name
+
+    # テンプレートを変更するとキャッシュを作り直す
+    wb = load_workbook(template_file, keep_vba=True)
+    wb.worksheets[0]["A1"] = "変更"
+    wb.save(template_file)
+    assert csv_to_xlsx.load_template(template_file).worksheets[0]["A1"].value == "変更"
+    # 古いキャッシュは残さない
+    assert len(list(Path(config.TEMPLATE_CACHE_PATH).glob("*.pickle"))) == 1
+
+
+def test_template_cache_hit_skips_template(tmp_path, monkeypatch):
+    """キャッシュがあればテンプレートを解析しない"""
+    template_file = tmp_path / "template.xlsm"
+    template_file.write_bytes(Path(config.TEMPLATE_PATH).read_bytes())
+    csv_to_xlsx.load_template(template_file)
+    with monkeypatch.context() as m:
+        m.setattr(csv_to_xlsx, "load_workbook", None)
+        wb = csv_to_xlsx.load_template(template_file)
+    assert "xl/vbaProject.bin" in wb.vba_archive.namelist()
+
+
+def test_template_cache_is_rebuilt(tmp_path, monkeypatch, capsys):
+    """openpyxlのバージョンが変わるか、キャッシュが壊れていれば作り直す"""
+    template_file = tmp_path / "template.xlsm"
+    template_file.write_bytes(Path(config.TEMPLATE_PATH).read_bytes())
+    expected = csv_to_xlsx.load_template(template_file).sheetnames
+    cache_dir = Path(config.TEMPLATE_CACHE_PATH)
+    (first,) = cache_dir.glob("*.pickle")
+
+    monkeypatch.setattr(csv_to_xlsx.openpyxl, "__version__", "0.0.0")
+    assert csv_to_xlsx.load_template(template_file).sheetnames == expected
+    (second,) = cache_dir.glob("*.pickle")
+    assert second != first
+
+    second.write_bytes(b"broken")
+    assert csv_to_xlsx.load_template(template_file).sheetnames == expected
+    assert "作り直します" in capsys.readouterr().out
+
+
+def test_streaming_matches_normal(make_db, tmp_path, capsys):
+    employees = 6
+    make_db(employees)
+    mapping = synthetic_mapping(employees)
+    outputs = {}
+    for streaming in (False, True):
+        output_file = tmp_path / f"streaming{streaming}" / "data.xlsm"
+        csv_to_xlsx.db_to_excel(
+            2023,
+            12,
+            Path(config.TEMPLATE_PATH),
+            mapping,
+            output_file,
+            incremental=False,
+            streaming=streaming,
+        )
+        outputs[streaming] = output_file
+
+    normal = load_workbook(outputs[False], keep_vba=True)
+    stream = load_workbook(outputs[True], keep_vba=True)
+    assert normal.sheetnames == stream.sheetnames
+    for name in ("year", "month"):
+        assert normal.defined_names[name].attr_text == stream.defined_names[name].attr_text
+    for ws in normal:
+        stream_ws = stream[ws.title]
+        assert_same_sheet(ws, stream_ws)
+        assert stream_ws.print_area == ws.print_area, ws.title
+        assert str(stream_ws.merged_cells) == str(ws.merged_cells), ws.title
+        assert len(stream_ws.data_validations.dataValidation) == len(
+            ws.data_validations.dataValidation
+        ), ws.title
+        assert stream_ws.legacy_drawing == ws.legacy_drawing, ws.title
+    with zipfile.ZipFile(outputs[False]) as a, zipfile.ZipFile(outputs[True]) as b:
+        assert a.read("xl/vbaProject.bin") == b.read("xl/vbaProject.bin")
+
+
+def test_rows_to_excel_writes_each_sheet_as_read(make_db, tmp_path, monkeypatch, capsys):
+    """行は1人ずつ読んで書き込み、変更がなければワークブックを開かない"""
+    employees = 4
+    make_db(employees)
+    mapping = synthetic_mapping(employees)
+    output_file = tmp_path / "out" / "data.xlsm"
+    output_file.parent.mkdir()
+    events = []
+
+    def employee_rows():
+        for name, rows in to_csv.iter_employee_rows(2023, 12):
+            events.append(("read", name))
+            yield name, rows
+
+    write_rows_to_sheet = csv_to_xlsx.write_rows_to_sheet
+
+    def logged_write(ws, rows):
+        events.append(("write", ws.title))
+        return write_rows_to_sheet(ws, rows)
+
+    monkeypatch.setattr(csv_to_xlsx, "write_rows_to_sheet", logged_write)
+    args = (Path(config.TEMPLATE_PATH), mapping, output_file)
+    csv_to_xlsx.rows_to_excel(2023, 12, employee_rows(), *args)
+    names = [name for _, name in events[::2]]
+    assert events == [(event, name) for name in names for event in ("read", "write")]
+    assert csv_to_xlsx.sheet_names(output_file) == load_workbook(output_file).sheetnames
+
+    # 変更がなければワークブックを読み込まない
+    events.clear()
+    monkeypatch.setattr(csv_to_xlsx, "load_workbook", None)
+    csv_to_xlsx.rows_to_excel(2023, 12, employee_rows(), *args)
+    assert all(event == "read" for event, _ in events)
+
+
+@pytest.mark.parametrize("manifest", ["keep", "missing", "corrupt"])
+def test_rows_to_excel_rewrites_only_changed(make_db, tmp_path, monkeypatch, capsys, manifest):
+    """変更のない従業員のシートは省略し、マニフェストがないか壊れていればすべて書き込む"""
+    employees = 3
+    make_db(employees)
+    mapping = synthetic_mapping(employees)
+    output_file = tmp_path / "out" / "data.xlsm"
+    output_file.parent.mkdir()
+    employee_rows = list(to_csv.iter_employee_rows(2023, 12))
+    args = (Path(config.TEMPLATE_PATH), mapping, output_file)
+    csv_to_xlsx.rows_to_excel(2023, 12, employee_rows, *args)
+
+    written = []
+    write_rows_to_sheet = csv_to_xlsx.write_rows_to_sheet
+
+    def logged_write(ws, rows):
+        written.append(ws.title)
+        return write_rows_to_sheet(ws, rows)
+
+    monkeypatch.setattr(csv_to_xlsx, "write_rows_to_sheet", logged_write)
+    # 1人目の2組目を打刻していない日に、2組目の出勤を加える
+    # (シートに入力済みの時刻は上書きしないので、空いているセルを変える)
+    name, rows = employee_rows[0]
+    rows = [list(row) for row in rows]
+    day = next(row for row in rows[1:-1] if row[3] == to_csv.BLANK)
+    day[3] = "23:59"
+    employee_rows[0] = (name, rows)
+    manifest_path = output_file.parent / to_csv.MANIFEST_FILE
+    if manifest == "missing":
+        manifest_path.unlink()
+    elif manifest == "corrupt":
+        manifest_path.write_text("{壊れた", encoding="utf-8")
+    csv_to_xlsx.rows_to_excel(2023, 12, employee_rows, *args)
+    if manifest == "keep":
+        assert written == [name]
+    else:
+        assert written == [n for n, _ in employee_rows]
+    assert "23:59" in [
+        str(cell) for row in sheet_values(output_file)[name] for cell in row
+    ]
+
+    # 書き込んだ内容がマニフェストに記録され、次は何も書き込まない
+    written.clear()
+    csv_to_xlsx.rows_to_excel(2023, 12, employee_rows, *args)
+    assert written == []
+
+
+def test_streaming_keeps_existing_file_unless_full(make_db, tmp_path, capsys):
+    """既存のファイルがあれば、--fullでない限り書き込み専用モードで作り直さない"""
+    employees = 3
+    make_db(employees)
+    mapping = synthetic_mapping(employees)
+    output_file = tmp_path / "out" / "data.xlsm"
+    args = (2023, 12, Path(config.TEMPLATE_PATH), mapping, output_file)
+    csv_to_xlsx.db_to_excel(*args)
+    # 備考欄に入力する
+    wb = load_workbook(output_file, keep_vba=True)
+    wb["従業員0000"]["G3"] = "有給"
+    wb.save(output_file)
+
+    csv_to_xlsx.db_to_excel(*args, streaming=True)
+    assert load_workbook(output_file)["従業員0000"]["G3"].value == "有給"
+    assert "--full" in capsys.readouterr().out
+
+    csv_to_xlsx.db_to_excel(*args, incremental=False, streaming=True)
+    assert load_workbook(output_file)["従業員0000"]["G3"].value != "有給"
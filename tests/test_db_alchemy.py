@@ -0,0 +1,431 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import io
+import random
+import time
+
+import pytest
+from sqlalchemy import event, insert, inspect, select
+
+import db_alchemy
+from db_alchemy import AttendanceRecord, Employee, IC_Card, RecordQuery, RecordType
+import time_util
+import to_csv
+
+
+def capture_queries(engine, func, *args, **kwargs) -> list[tuple[str, tuple]]:
+    """funcの実行中に発行されたSELECT文とパラメータを記録する"""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func(*args, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return queries
+
+
+def explain(engine, statement: str, parameters) -> list[str]:
+    """EXPLAIN QUERY PLANの結果(detail列)を返す"""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def summary_rows(bind) -> list[tuple]:
+    """DailySummaryの全行(updated_atを除く)"""
+    columns = [
+        c for c in db_alchemy.DailySummary.__table__.columns if c.name != "updated_at"
+    ]
+    with bind.connect() as connection:
+        return connection.execute(
+            select(*columns).order_by(*db_alchemy.DailySummary.__table__.primary_key)
+        ).all()
+
+
+@pytest.fixture
+def card(make_db):
+    """合成DBを作り、従業員0000にカードを紐づける"""
+    engine = make_db(10)
+    employee = Employee.get_by_name("従業員0000")
+    with redirect_stdout(io.StringIO()):
+        IC_Card.assign("TEST_CARD", employee)
+    return engine, employee
+
+
+@pytest.mark.parametrize(
+    "index_name, func",
+    [
+        (
+            "ix_IC_Card_ic_card_number",
+            lambda employee: IC_Card.find_by_ic_card_number("TEST_CARD"),
+        ),
+        (
+            "ix_AttendanceRecord_employee_id_record_time",
+            lambda employee: AttendanceRecord.get_last_record(employee),
+        ),
+        (
+            "ix_AttendanceRecord_employee_id_record_time",
+            lambda employee: AttendanceRecord.get_employee_records(
+                employee.employee_id, datetime(2023, 11, 16), datetime(2023, 12, 16)
+            ),
+        ),
+        (
+            "ix_AttendanceRecord_employee_id_record_time",
+            lambda employee: list(
+                RecordQuery().employees(1, 2, 3).pay_period(2023, 12).iter()
+            ),
+        ),
+    ],
+    ids=["find_by_ic_card_number", "get_last_record", "get_employee_records", "RecordQuery"],
+)
+def test_tap_path_queries_use_index(card, index_name, func):
+    engine, employee = card
+    queries = capture_queries(engine, func, employee)
+    details = [detail for query in queries for detail in explain(engine, *query)]
+    assert any(index_name in detail for detail in details), details
+    # テーブル全体の走査・並べ替えがない
+    assert not any(d.startswith("SCAN") and "USING" not in d for d in details), details
+    assert not any("TEMP B-TREE" in d for d in details), details
+
+
+def test_tap_path_runs_one_query(card, qapp, monkeypatch):
+    """キャッシュ済みのカードのタップは、update_labelからbindまでで1回しか問い合わせない"""
+    from PySide6.QtWidgets import QDialog
+
+    from main_window import MainWindow
+    from punch_dialog import PunchDialog
+
+    engine, employee = card
+    db_alchemy.card_resolver.preload()
+    window = MainWindow()
+    window.punch_dialog = PunchDialog()
+    bound = []
+    monkeypatch.setattr(
+        window.punch_dialog, "exec", lambda: bound.append(window.punch_dialog.employee)
+        or QDialog.Accepted,
+    )
+    window.nfc_reader = type("Reader", (), {"resume": lambda self: None})()
+    queries = capture_queries(engine, window.update_label, "TEST_CARD")
+    assert [e.name for e in bound] == [employee.name]
+    assert len(queries) == 1, [q for q, _ in queries]
+    # 最終打刻の状態も同じクエリで読んでいる
+    assert "PunchState" in queries[0][0]
+
+
+def test_card_changed_elsewhere_is_resolved(card):
+    """別のプロセスでカードを付け替え・削除しても、キャッシュから古い従業員を返さない"""
+    engine, employee = card
+    assert IC_Card.find_employee_by_ic_card_number("TEST_CARD").name == employee.name
+    other = Employee.get_by_name("従業員0001")
+    # card_resolverを通さずに書き換える
+    with db_alchemy.Session() as session:
+        ic_card = session.query(IC_Card).filter_by(ic_card_number="TEST_CARD").one()
+        ic_card.employee_id = other.employee_id
+        ic_card.updated_at = time_util.current_time()
+        session.commit()
+    assert IC_Card.find_employee_by_ic_card_number("TEST_CARD").name == other.name
+
+    with db_alchemy.Session() as session:
+        session.query(IC_Card).filter_by(ic_card_number="TEST_CARD").delete()
+        session.commit()
+    with redirect_stdout(io.StringIO()):
+        assert IC_Card.find_employee_by_ic_card_number("TEST_CARD") is None
+
+
+def test_summary_after_punches_matches_rebuild(make_db):
+    """punchで更新した日ごとの集計が、打刻履歴から作り直したものと一致する"""
+    engine = make_db(3)
+    rng = random.Random(1)
+    with redirect_stdout(io.StringIO()):
+        for _ in range(50):
+            # 過去の日への追加・同じ日の2組目・押し忘れが混ざるようにする
+            punch_time = datetime(2023, 12, rng.randint(1, 31), rng.randint(0, 23))
+            AttendanceRecord.punch(
+                rng.randint(1, 3),
+                rng.choice((RecordType.IN, RecordType.OUT)),
+                punch_time.replace(minute=rng.randint(0, 59)),
+            )
+    incremental = summary_rows(engine)
+    db_alchemy.DailySummary.rebuild(engine)
+    assert incremental == summary_rows(engine)
+
+
+def last_states(bind) -> dict[int, tuple]:
+    """従業員ごとの最終打刻を、PunchStateと打刻履歴の両方から読む"""
+    with db_alchemy.Session(bind=bind) as session:
+        states = {
+            state.employee_id: (state.record_type, state.record_time)
+            for state in session.query(db_alchemy.PunchState)
+        }
+    history = {}
+    for employee in Employee.get_all():
+        record = AttendanceRecord.get_last_record(employee)
+        if record is not None:
+            history[employee.employee_id] = (record.record_type, record.record_time)
+    return states, history
+
+
+def test_punch_state_follows_punches(make_db):
+    """punchのたびに、最終打刻の状態が打刻履歴の最後の打刻と一致する"""
+    engine = make_db(3)
+    states, history = last_states(engine)
+    assert states == history and len(states) == 3
+    rng = random.Random(2)
+    punch_time = datetime(2024, 1, 1, 8)
+    with redirect_stdout(io.StringIO()):
+        for i in range(30):
+            punch_time += timedelta(minutes=rng.randint(1, 600))
+            employee_id = rng.randint(1, 3)
+            if i % 5 == 4:
+                # 過去の日に追加した打刻では最終打刻は変わらない
+                AttendanceRecord.punch(employee_id, RecordType.OUT, datetime(2023, 6, 1, 18))
+            else:
+                AttendanceRecord.punch(
+                    employee_id, rng.choice((RecordType.IN, RecordType.OUT)), punch_time
+                )
+            states, history = last_states(engine)
+            assert states == history, i
+
+
+def test_punch_state_rebuild_matches_history(make_db):
+    """壊れた・空の状態も、rebuildで打刻履歴の最後の打刻に作り直される"""
+    engine = make_db(4)
+    with db_alchemy.Session() as session:
+        session.query(db_alchemy.PunchState).filter_by(employee_id=1).delete()
+        state = session.get(db_alchemy.PunchState, 2)
+        state.record_type = RecordType.OUT if state.record_type == RecordType.IN else RecordType.IN
+        state.record_time = datetime(2000, 1, 1)
+        session.commit()
+    states, history = last_states(engine)
+    assert states != history
+    with redirect_stdout(io.StringIO()):
+        db_alchemy.PunchState.rebuild(engine)
+    states, history = last_states(engine)
+    assert states == history and len(states) == 4
+
+
+@pytest.mark.parametrize("year", range(2020, 2026))
+def test_record_query_pay_period(year):
+    for month in range(1, 13):
+        start_date, end_date, _ = to_csv.pay_period(year, month)
+        query = RecordQuery().pay_period(year, month)
+        assert (query.start_date, query.end_date) == (start_date, end_date)
+
+
+def test_record_query_matches_per_employee(make_db):
+    make_db(5)
+    employee_ids = list(range(1, 6))
+    query = RecordQuery().employees(*employee_ids).pay_period(2023, 12)
+    per_employee = [
+        (employee_id, record_type, record_time)
+        for employee_id in employee_ids
+        for record_type, record_time in AttendanceRecord.iter_employee_records(
+            employee_id, query.start_date, query.end_date
+        )
+    ]
+    assert list(query.iter()) == per_employee
+
+
+def test_punch_after_import_is_readable(make_db):
+    """起動後(モジュールのimport後)の打刻も、期間を省略すれば読める"""
+    make_db(1)
+    time.sleep(0.01)
+    punch_time = datetime.now()
+    with redirect_stdout(io.StringIO()):
+        AttendanceRecord.punch(1, RecordType.IN, punch_time)
+    records = AttendanceRecord.get_employee_records(1)
+    assert records[-1].record_time == punch_time
+    assert list(RecordQuery().employees(1).between(punch_time).iter()) == [
+        (1, RecordType.IN, punch_time)
+    ]
+
+
+def test_refresh_stale_follows_records_changed_outside_punch(make_db):
+    """punchを通さずに追加・変更・削除した打刻も、refresh_staleで集計に反映される"""
+    engine = make_db(3)
+    start, end = datetime(2023, 11, 16), datetime(2023, 12, 16)
+    with db_alchemy.Session() as session:
+        # 追加
+        session.add(
+            AttendanceRecord(
+                employee_id=1,
+                record_type=RecordType.IN,
+                record_time=datetime(2023, 12, 1, 23),
+                created_at=datetime(2023, 12, 1, 23),
+                updated_at=datetime(2023, 12, 1, 23),
+            )
+        )
+        # 1日分の打刻をすべて削除
+        session.query(AttendanceRecord).filter(
+            AttendanceRecord.employee_id == 2,
+            datetime(2023, 12, 2) <= AttendanceRecord.record_time,
+            AttendanceRecord.record_time < datetime(2023, 12, 3),
+        ).delete()
+        # 時刻を手で修正(件数は変わらない)
+        record = (
+            session.query(AttendanceRecord)
+            .filter(
+                AttendanceRecord.employee_id == 3,
+                datetime(2023, 12, 3) <= AttendanceRecord.record_time,
+            )
+            .order_by(AttendanceRecord.record_time)
+            .first()
+        )
+        record.record_time = record.record_time.replace(hour=6, minute=0)
+        record.updated_at = time_util.current_time()
+        session.commit()
+
+    with redirect_stdout(io.StringIO()):
+        assert db_alchemy.DailySummary.refresh_stale(start, end) == 3
+        # 作り直した後は食い違いがない
+        assert db_alchemy.DailySummary.refresh_stale(start, end) == 0
+    refreshed = summary_rows(engine)
+    with redirect_stdout(io.StringIO()):
+        db_alchemy.DailySummary.rebuild(engine)
+    assert refreshed == summary_rows(engine)
+
+
+def test_migrate_adds_summary_columns(make_db):
+    """集計の列が足りない古いデータベースは、列を追加して作り直す"""
+    engine = make_db(2)
+    expected = summary_rows(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE DailySummary DROP COLUMN record_count")
+    with redirect_stdout(io.StringIO()):
+        db_alchemy.migrate(engine)
+    assert summary_rows(engine) == expected
+
+
+# 最初のリリースのスキーマ(インデックス・PunchState・DailySummaryがない)
+BASELINE_SCHEMA = (
+    """CREATE TABLE Employee (
+        employee_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )""",
+    """CREATE TABLE IC_Card (
+        card_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id INTEGER,
+        ic_card_number TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
+    )""",
+    """CREATE TABLE AttendanceRecord (
+        record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id INTEGER NOT NULL,
+        record_type TEXT NOT NULL CHECK (record_type IN ('IN', 'OUT')),
+        record_time TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY(employee_id) REFERENCES Employee(employee_id)
+    )""",
+)
+
+
+def baseline_db(path):
+    """最初のリリースのスキーマで、同じカードが2人に登録されたデータベースを作る"""
+    engine = db_alchemy.create_db_engine(str(path))
+    now = datetime(2023, 12, 1)
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.execute(
+            insert(Employee),
+            [{"name": name, "created_at": now, "updated_at": now} for name in ("A", "B")],
+        )
+        connection.execute(
+            insert(IC_Card),
+            [
+                {
+                    "employee_id": employee_id,
+                    "ic_card_number": number,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for employee_id, number in ((1, "DUP"), (2, "DUP"), (2, "OK"))
+            ],
+        )
+        connection.execute(
+            insert(AttendanceRecord),
+            [
+                {
+                    "employee_id": employee_id,
+                    "record_type": record_type,
+                    "record_time": record_time,
+                    "created_at": record_time,
+                    "updated_at": record_time,
+                }
+                for employee_id, record_type, record_time in (
+                    (1, RecordType.IN, datetime(2023, 12, 1, 9)),
+                    (1, RecordType.OUT, datetime(2023, 12, 1, 18)),
+                    (2, RecordType.IN, datetime(2023, 12, 2, 22)),
+                )
+            ],
+        )
+    db_alchemy.Session.configure(bind=engine)
+    return engine
+
+
+def table_rows(engine, *tables) -> dict[str, list]:
+    """テーブルごとの全行"""
+    with engine.connect() as connection:
+        return {
+            table: connection.exec_driver_sql(f"SELECT * FROM {table}").all()
+            for table in tables
+        }
+
+
+def test_migrate_baseline_schema(tmp_path):
+    """最初のリリースのデータベースを、データを変えずに今のスキーマに合わせる"""
+    engine = baseline_db(tmp_path / "baseline.db")
+    before = table_rows(engine, "Employee", "IC_Card", "AttendanceRecord")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        db_alchemy.migrate(engine)
+    # 重複したカードがあるので一意インデックスだけは作らずに重複を表示する
+    assert "ix_IC_Card_ic_card_number" in output.getvalue()
+    assert "('DUP',)" in output.getvalue()
+    indexes = {
+        index["name"]
+        for table in ("IC_Card", "AttendanceRecord")
+        for index in inspect(engine).get_indexes(table)
+    }
+    assert "ix_AttendanceRecord_employee_id_record_time" in indexes
+    assert "ix_IC_Card_ic_card_number" not in indexes
+    assert table_rows(engine, *before) == before
+    # 最終打刻の状態と日ごとの集計は打刻履歴から作られている
+    states, history = last_states(engine)
+    assert states == history and len(states) == 2
+    summaries = summary_rows(engine)
+    assert len(summaries) == 2
+
+    # 何度実行しても結果は同じ
+    with redirect_stdout(io.StringIO()):
+        db_alchemy.migrate(engine)
+    assert table_rows(engine, *before) == before
+    assert summary_rows(engine) == summaries
+    assert last_states(engine) == (states, history)
+
+    # 重複を解消すれば一意インデックスを作成する
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "DELETE FROM IC_Card WHERE employee_id = 2 AND ic_card_number = 'DUP'"
+        )
+    output = io.StringIO()
+    with redirect_stdout(output):
+        db_alchemy.migrate(engine)
+    assert "インデックスix_IC_Card_ic_card_numberを作成しました" in output.getvalue()
+    assert "ix_IC_Card_ic_card_number" in {
+        index["name"] for index in inspect(engine).get_indexes("IC_Card")
+    }
@@ -0,0 +1,65 @@
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+
+import config
+from conftest import REPO
+
+# 時計を表示するまでに読み込まないはずのモジュール
+DEFERRED_MODULES = ("nfc", "sqlalchemy", "db_alchemy", "punch_dialog", "register_dialog")
+
+# 子プロセスでmain.pyと同じ手順でウィンドウを表示し、描画した時点で読み込まれているモジュールを返す
+STARTUP_SCRIPT = """
+import json, sys
+import main
+app = main.QApplication([])
+window = main.MainWindow()
+window.show()
+app.processEvents()
+print(json.dumps([name for name in json.loads(sys.argv[1]) if name in sys.modules]))
+window.close()
+"""
+
+
+def test_clock_is_painted_before_deferred_modules(make_db, tmp_path):
+    # 本番のデータベース・ジャーナルに触らないよう、一時フォルダで起動する
+    make_db(1, name=config.DATABASE_PATH)
+    env = dict(os.environ, PYTHONPATH=str(REPO), PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, json.dumps(DEFERRED_MODULES)],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert json.loads(proc.stdout.splitlines()[-1]) == []
+
+
+def test_time_display_updates_only_changed_label(qapp):
+    """秒が変わっても日付のラベルは書き換えず、日付が変わったときだけ書き換える"""
+    import time_util
+    from main_window import TimeDisplay
+
+    now = [datetime(2024, 8, 31, 23, 59, 58, tzinfo=time_util.TZ).timestamp()]
+    display = TimeDisplay(clock=time_util.LocalClock(clock=lambda: now[0]))
+    display.timer.stop()
+    assert display.text() == "08/31 23:59:58"
+    updated = []
+    for label in (display.date_label, display.time_label):
+        label.setText = lambda text, set_text=label.setText: (
+            updated.append(text),
+            set_text(text),
+        )
+
+    for _ in range(2):
+        now[0] += 0.5
+        display.update_time()
+    assert updated == ["23:59:59"]
+    now[0] += 1
+    display.update_time()
+    assert updated == ["23:59:59", "09/01", "00:00:00"]
+    assert display.text() == "09/01 00:00:00"
+    display.timer.stop()
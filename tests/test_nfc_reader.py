@@ -0,0 +1,40 @@
+import threading
+
+from nfc_reader_QThread import NfcReader, ScriptedFrontend
+
+
+def test_held_card_is_reported_once():
+    """各タップは「同じカードを2回検出(かざしたまま)→カードなし」の台本で、
+    かざしたままの検出は通知されない"""
+    script: list = []
+    expected = []
+    for i in range(10):
+        ic_card_id = f"{i % 3:016x}"
+        script += [ic_card_id, ic_card_id, None, None, None]
+        expected.append(ic_card_id)
+
+    received = []
+    done = threading.Event()
+
+    def on_connect(tag):
+        received.append(tag.identifier.hex())
+        if len(received) == len(expected):
+            done.set()
+        # ダイアログを閉じたときのMainWindowと同じようにポーリングを再開する
+        reader.resume()
+
+    reader = NfcReader(
+        ScriptedFrontend(script),
+        on_connect=on_connect,
+        continuous=True,
+        # 台本のNone1回はsenseのinterval(0.1秒)なので、3回分より短くする
+        debounce=0.15,
+        activate=ScriptedFrontend.activate,
+    )
+    thread = threading.Thread(target=reader.run)
+    thread.start()
+    finished = done.wait(timeout=50)
+    reader.stop()
+    thread.join()
+    assert finished, received
+    assert received == expected
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+import random
+
+from hypothesis import given, strategies as st
+import pytest
+
+from db_alchemy import RecordType
+import pair_engine
+
+MODES = [False] + ([True] if pair_engine.np is not None else [])
+BASE_TIME = datetime(2023, 12, 30, 20)  # 月末・年末をまたぐ
+
+# 3日分の範囲の分単位の時刻と種類。同じ時刻の打刻も混ざる
+punch_sequences = st.lists(
+    st.tuples(st.integers(0, 3 * 1440), st.sampled_from([RecordType.IN, RecordType.OUT])),
+    max_size=60,
+).map(
+    lambda items: [
+        (record_type, BASE_TIME + timedelta(minutes=minute))
+        for minute, record_type in sorted(items, key=lambda item: item[0])
+    ]
+)
+
+
+def random_punches(rng: random.Random, count: int, start: datetime):
+    """ペアになる打刻と押し忘れが混ざった、時刻順の打刻を作る"""
+    punches = []
+    t = start
+    for _ in range(count):
+        t += timedelta(minutes=rng.choice((1, 30, 240, 600, 1440)))
+        punches.append((rng.choice((RecordType.IN, RecordType.OUT)), t))
+    return punches
+
+
+def pairs_by_make_pairs(punches) -> dict:
+    """日ごとに分けてmake_pairsでペアにする"""
+    daily = {}
+    for record_type, record_time in punches:
+        daily.setdefault(record_time.date(), []).append((record_type, record_time))
+    return {day: pair_engine.make_pairs(day_punches) for day, day_punches in daily.items()}
+
+
+def pairs_by_engine(punches, use_numpy: bool) -> dict:
+    """pair_engineの配列で期間全体を1回でペアにする(打刻の数によらずuse_numpyに従う)"""
+    types = pair_engine.encode_types(t for t, _ in punches)
+    times = [t for _, t in punches]
+    days = pair_engine.day_keys(times, use_numpy)
+    pairs = pair_engine.pair_punches(types, days, use_numpy)
+    return {
+        datetime.fromordinal(day).date(): result
+        for day, result in pair_engine.pairs_by_day(pairs, times).items()
+    }
+
+
+@given(punch_sequences)
+def test_pair_days_matches_make_pairs(punches):
+    before = list(punches)
+    assert pair_engine.pair_days(punches) == pairs_by_make_pairs(punches)
+    # 渡したリストは変更しない
+    assert punches == before
+
+
+@pytest.mark.parametrize("use_numpy", MODES)
+@given(punches=punch_sequences)
+def test_pair_punches_matches_make_pairs(use_numpy, punches):
+    assert pairs_by_engine(punches, use_numpy) == pairs_by_make_pairs(punches)
+
+
+@pytest.mark.parametrize("use_numpy", MODES)
+def test_pair_days_matches_make_pairs_on_long_history(use_numpy):
+    """NUMPY_MIN_PUNCHESを超える長い打刻でも一致する"""
+    rng = random.Random(0)
+    sample = random_punches(rng, 2000, datetime(2023, 1, 1))
+    assert pair_engine.pair_days(sample, use_numpy) == pairs_by_make_pairs(sample)
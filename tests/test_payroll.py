@@ -0,0 +1,58 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import io
+import random
+
+import config
+from db_alchemy import Employee
+import payroll
+import time_util
+import to_csv
+
+
+def night_minutes_by_step(punch_in: datetime, punch_out: datetime) -> int:
+    """深夜時間を1秒ずつ数える"""
+    start_hour, end_hour = config.NIGHT_HOURS
+    seconds = 0
+    t = punch_in
+    while t < punch_out:
+        if start_hour <= t.hour or t.hour < end_hour:
+            seconds += 1
+        t += timedelta(seconds=1)
+    return seconds // 60
+
+
+def test_night_seconds_matches_step_count():
+    rng = random.Random(0)
+    for _ in range(100):
+        punch_in = datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 2880))
+        punch_out = punch_in + timedelta(minutes=rng.randint(0, 900))
+        assert int(
+            time_util.night_seconds(punch_in, punch_out, config.NIGHT_HOURS) // 60
+        ) == night_minutes_by_step(punch_in, punch_out), (punch_in, punch_out)
+
+
+def test_totals_from_summary_match_records(make_db):
+    """日ごとの集計から求めた時間が、打刻をペアにして計算したものと一致する"""
+    make_db(4)
+    start_date, end_date = datetime(2023, 11, 16), datetime(2023, 12, 16)
+    mapping = {f"従業員{i:04d}": "正社員" for i in range(4)}
+    with redirect_stdout(io.StringIO()):
+        results = payroll.compute_totals(start_date, end_date, mapping)
+        expected = list(
+            to_csv._iter_daily_pairs(Employee.get_all(), start_date, end_date)
+        )
+    overtime_after = config.PAYROLL_RULES["正社員"]["overtime_after"]
+    for result, (name, daily_pairs) in zip(results, expected):
+        assert result.name == name
+        assert result.daily.keys() == daily_pairs.keys()
+        for day, (punch_pairs, has_lost) in daily_pairs.items():
+            complete = [(i, o) for i, o in punch_pairs if i is not None and o is not None]
+            worked = int(sum((o - i).total_seconds() for i, o in complete) // 60)
+            night = int(
+                sum(time_util.night_seconds(i, o, config.NIGHT_HOURS) for i, o in complete)
+                // 60
+            )
+            assert result.daily[day] == payroll.Totals(
+                worked, night, max(0, worked - overtime_after), int(has_lost)
+            ), (name, day)
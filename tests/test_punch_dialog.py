@@ -0,0 +1,85 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import db_alchemy
+from db_alchemy import AttendanceRecord, Employee, IC_Card, PunchState
+
+# 合成データの最後の日の翌日 表示に打刻時刻が含まれるので固定する
+PUNCH_TIME = datetime(2024, 1, 1, 9)
+
+
+@pytest.fixture
+def cards(make_db, qapp):
+    make_db(3)
+    cards = []
+    with redirect_stdout(io.StringIO()):
+        for employee in Employee.get_all():
+            cards.append(f"TEST_CARD_{employee.employee_id}")
+            IC_Card.assign(cards[-1], employee)
+    db_alchemy.card_resolver.preload()
+    return cards
+
+
+def tap(dialog, ic_card_id: str) -> tuple[str, str]:
+    """ダイアログに打刻を表示し、表示内容と背景色(左上の画素)を返す"""
+    from PySide6.QtWidgets import QApplication
+
+    dialog.bind(*IC_Card.find_employee_and_state(ic_card_id), PUNCH_TIME)
+    dialog.show()
+    painted = len(dialog.latencies)
+    while len(dialog.latencies) == painted:
+        QApplication.processEvents()
+    color = dialog.grab().toImage().pixelColor(1, 1).name()
+    text = dialog.status_label.text()
+    dialog.reject()
+    return text, color
+
+
+def test_reused_dialog_matches_new_dialogs(cards, capsys):
+    from punch_dialog import PunchDialog
+
+    new = [tap(PunchDialog(), card) for card in cards * 2]
+    dialog = PunchDialog()
+    reused = [tap(dialog, card) for card in cards * 2]
+    assert new == reused
+    # 当日の打刻がないので、どのタップも出勤になる
+    assert len({color for _, color in reused}) == 1
+
+
+def test_toggle_switches_background(cards, capsys):
+    from punch_dialog import PunchDialog
+
+    dialog = PunchDialog()
+    dialog.bind(*IC_Card.find_employee_and_state(cards[0]), PUNCH_TIME)
+    before = dialog.grab().toImage().pixelColor(1, 1).name()
+    dialog.toggle_status()
+    after = dialog.grab().toImage().pixelColor(1, 1).name()
+    dialog.reject()
+    assert before != after
+
+
+def test_status_from_punch_state_matches_full_history(make_db, capsys):
+    """PunchStateから判定した出勤・退勤が、打刻履歴の最後の打刻から判定したものと一致する"""
+    from punch_dialog import PunchDialog
+
+    make_db(3)
+    punch_time = datetime(2023, 12, 31, 6)
+    for i in range(40):
+        punch_time += timedelta(hours=3)
+        for employee in Employee.get_all():
+            statuses = [
+                PunchDialog.determine_status(
+                    SimpleNamespace(last_record=last_record, punch_time=punch_time)
+                )
+                for last_record in (
+                    PunchState.get(employee.employee_id),
+                    AttendanceRecord.get_last_record(employee),
+                )
+            ]
+            assert statuses[0] == statuses[1], (employee.name, punch_time)
+            if i % 3 == 0:
+                AttendanceRecord.punch(employee.employee_id, statuses[0], punch_time)
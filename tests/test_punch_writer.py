@@ -0,0 +1,119 @@
+from contextlib import redirect_stdout
+from datetime import datetime
+import io
+import threading
+
+import pytest
+
+import db_alchemy
+
+from db_alchemy import AttendanceRecord, RecordType
+from punch_writer import PendingPunch, PunchJournal, PunchWriter
+
+
+@pytest.fixture
+def writer(make_db, tmp_path):
+    make_db(2)
+    writer = PunchWriter(PunchJournal(tmp_path / "journal.jsonl"))
+    yield writer
+    writer.stop(1)
+
+
+def test_replay_runs_on_writer_thread(writer, monkeypatch):
+    """ジャーナルに残っていた打刻は、startを呼んだスレッドではなく書き込みスレッドで書き込む"""
+    punch = PendingPunch("left", 1, RecordType.IN, datetime(2023, 12, 1, 9))
+    writer.journal.append(punch)
+    threads = []
+    release = threading.Event()
+    original = AttendanceRecord.punch
+
+    def slow_punch(*args):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+        return original(*args)
+
+    monkeypatch.setattr(AttendanceRecord, "punch", slow_punch)
+    with redirect_stdout(io.StringIO()):
+        writer.start()
+        # 書き込みの前から、打刻の状態の判定にはジャーナルの打刻が使われる
+        assert writer.last_pending(1) == punch
+        writer.submit(1, RecordType.OUT, datetime(2023, 12, 1, 18))
+        release.set()
+        writer.stop()
+    assert threads == ["PunchWriter", "PunchWriter"]
+    assert writer.last_pending(1) is None
+    assert writer.journal.pending() == []
+    assert AttendanceRecord.exists(1, RecordType.IN, datetime(2023, 12, 1, 9))
+    assert AttendanceRecord.exists(1, RecordType.OUT, datetime(2023, 12, 1, 18))
+
+
+def test_stop_keeps_thread_until_it_finishes(writer, monkeypatch):
+    """joinがタイムアウトしたら、スレッドが終わるまで参照を残す"""
+    release = threading.Event()
+    original = AttendanceRecord.punch
+
+    def blocked_punch(*args):
+        release.wait(5)
+        return original(*args)
+
+    monkeypatch.setattr(AttendanceRecord, "punch", blocked_punch)
+    with redirect_stdout(io.StringIO()):
+        writer.submit(1, RecordType.IN, datetime(2023, 12, 1, 9))
+        writer.stop(0.05)
+        thread = writer._thread
+        assert thread is not None and thread.is_alive()
+        # 残っているスレッドがある間は、2つ目のスレッドを起動しない
+        writer.start()
+        assert writer._thread is thread
+        release.set()
+        thread.join(5)
+        writer.stop()
+    assert writer._thread is None
+    assert AttendanceRecord.exists(1, RecordType.IN, datetime(2023, 12, 1, 9))
+
+
+
+def count_records(employee_id: int, record_time: datetime) -> int:
+    with db_alchemy.Session() as session:
+        return (
+            session.query(AttendanceRecord)
+            .filter_by(employee_id=employee_id, record_time=record_time)
+            .count()
+        )
+
+
+def test_replay_skips_punch_already_in_db(writer):
+    """DBに書き込んだ後、完了を記録する前に終了していた打刻は書き込み直さない"""
+    punch = PendingPunch("written", 1, RecordType.IN, datetime(2023, 12, 1, 9))
+    writer.journal.append(punch)
+    with redirect_stdout(io.StringIO()):
+        AttendanceRecord.punch(punch.employee_id, punch.record_type, punch.record_time)
+        writer.start()
+        writer.stop()
+    assert count_records(1, punch.record_time) == 1
+    assert writer.journal.pending() == []
+    assert writer.last_pending(1) is None
+
+
+def test_retry_after_commit_does_not_insert_twice(writer, monkeypatch):
+    """コミットした後に例外が出ても、やり直しで同じ打刻を2回書き込まない"""
+    import punch_writer
+
+    original = AttendanceRecord.punch
+    calls = []
+
+    def punch_then_fail(*args):
+        calls.append(args)
+        original(*args)
+        if len(calls) == 1:
+            raise OSError("disk I/O error")
+
+    monkeypatch.setattr(AttendanceRecord, "punch", punch_then_fail)
+    monkeypatch.setattr(punch_writer.time, "sleep", lambda seconds: None)
+    punch_time = datetime(2023, 12, 1, 9)
+    with redirect_stdout(io.StringIO()):
+        writer.submit(1, RecordType.IN, punch_time)
+        writer.stop()
+    assert len(calls) == 1
+    assert count_records(1, punch_time) == 1
+    assert writer.journal.pending() == []
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from conftest import REPO
+
+# 時計を描画する前に読み込んではいけない(start_servicesやスロットの中で読み込む)モジュール
+DEFERRED = ("nfc", "sqlalchemy", "db_alchemy", "punch_dialog", "register_dialog")
+
+
+def imported_modules(statement: str, tmp_path) -> set[str]:
+    """-X importtimeでstatementを実行し、読み込まれたモジュール名を返す"""
+    env = dict(
+        os.environ,
+        QT_QPA_PLATFORM="offscreen",
+        PYTHONPATH=str(REPO),
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def test_main_window_import_defers_heavy_modules(tmp_path):
+    modules = imported_modules("import main_window", tmp_path)
+    assert "main_window" in modules and "time_util" in modules
+    loaded = {name for name in modules if name.split(".")[0] in DEFERRED}
+    assert not loaded, sorted(loaded)
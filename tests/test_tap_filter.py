@@ -0,0 +1,61 @@
+import pytest
+
+from tap_filter import TapFilter
+
+
+class FakeClock:
+    """進める量をテストで決める時計"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_repeat_inside_window_is_suppressed(clock):
+    tap_filter = TapFilter(window=30, clock=clock)
+    assert tap_filter.accept("A")
+    clock.now = 29.9
+    assert not tap_filter.accept("A")
+    assert not tap_filter.accept("A")
+    # 別のカードは影響を受けない
+    assert tap_filter.accept("B")
+    assert tap_filter.suppressed == 2
+    assert tap_filter.suppressed_stats() == (2, [("A", 2)])
+
+
+def test_tap_after_window_is_accepted(clock):
+    tap_filter = TapFilter(window=30, clock=clock)
+    assert tap_filter.accept("A")
+    clock.now = 30
+    assert tap_filter.accept("A")
+    # 受け付けた時刻から数え直す
+    clock.now = 59
+    assert not tap_filter.accept("A")
+    assert tap_filter.suppressed == 1
+
+
+def test_forget_allows_card_again(clock):
+    tap_filter = TapFilter(window=30, clock=clock)
+    assert tap_filter.accept("A")
+    tap_filter.forget("A")
+    assert tap_filter.accept("A")
+    # 覚えていないカードを忘れてもよい
+    tap_filter.forget("B")
+    assert tap_filter.suppressed == 0
+
+
+def test_oldest_card_is_evicted_at_capacity(clock):
+    tap_filter = TapFilter(window=30, maxsize=2, clock=clock)
+    for ic_card_id in ("A", "B", "C"):
+        assert tap_filter.accept(ic_card_id)
+    # いちばん古いAが追い出され、B・Cは覚えている
+    assert tap_filter.accept("A")
+    assert not tap_filter.accept("C")
+    assert tap_filter.suppressed == 1
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import time
+
+import pytest
+
+import config
+import time_util
+import to_csv
+
+
+def pay_period_by_loop(year: int, month: int) -> tuple[datetime, datetime, list[str]]:
+    """以前のto_csv.pay_period(1日ずつwhileで進める方法)"""
+    one_day = timedelta(days=1)
+    day = config.START_DAY
+    if month == 1:
+        year -= 1
+        month = 13
+    now = datetime(year=year, month=month - 1, day=day)
+    start_date = now
+    period = []
+    while day != config.START_DAY - 1:
+        period.append(now.date().strftime(to_csv.TIME_FORMAT))
+        now += one_day
+        day = now.day
+    period.append(now.date().strftime(to_csv.TIME_FORMAT))
+    return start_date, now + one_day, period
+
+
+@pytest.mark.parametrize("year", range(2000, 2031))
+def test_pay_period_matches_loop(year):
+    for month in range(1, 13):
+        start_date, end_date, period = to_csv.pay_period(year, month)
+        assert (start_date, end_date, list(period)) == pay_period_by_loop(year, month)
+
+
+def strftime_text(timestamp: float, tz) -> str:
+    return datetime.fromtimestamp(timestamp, tz).strftime("%m/%d %H:%M:%S")
+
+
+def test_local_clock_matches_strftime():
+    clock = time_util.LocalClock()
+    start = time.time()
+    for i in range(0, 1_000_000, 997):
+        t = start + i * 0.37
+        assert clock.text(t) == strftime_text(t, time_util.TZ), t
+
+
+@pytest.mark.parametrize(
+    "day", [datetime(2024, 3, 10), datetime(2024, 11, 3)], ids=["spring", "fall"]
+)
+def test_local_clock_across_dst_change(day):
+    """時差が途中で変わる日も、strftimeと同じ表示になる"""
+    tz = ZoneInfo("America/New_York")
+    clock = time_util.LocalClock(tz)
+    start = day.replace(tzinfo=tz).timestamp() - 3600
+    for i in range(0, 30 * 3600, 7):
+        assert clock.text(start + i) == strftime_text(start + i, tz), start + i
+
+
+def test_until_next_second():
+    clock = time_util.LocalClock(clock=lambda: 100.25)
+    assert clock.until_next_second() == pytest.approx(0.75)
@@ -0,0 +1,142 @@
+from pathlib import Path
+
+import pytest
+
+import config
+import to_csv
+
+
+def export(**kwargs) -> dict[str, bytes]:
+    """2023年12月分のCSVを出力し、ファイル名 -> 中身を返す"""
+    to_csv.export_employee_attendance_to_csv(2023, 12, incremental=False, **kwargs)
+    folder = Path(config.CSV_PATH) / "2023-12"
+    return {p.name: p.read_bytes() for p in folder.iterdir() if p.suffix == ".csv"}
+
+
+def test_export_paths_write_same_csv(make_db, capsys):
+    make_db(10)
+    per_employee = export(single_query=False, use_summary=False)
+    assert len(per_employee) == 10
+    assert export(single_query=True, use_summary=False) == per_employee
+    assert export(use_summary=True) == per_employee
+
+
+def test_parallel_export_matches_serial(make_db, capsys, monkeypatch):
+    make_db(10)
+    serial = export(use_summary=False)
+    pools = []
+
+    class RecordingExecutor(to_csv.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(kwargs["max_workers"])
+
+    monkeypatch.setattr(to_csv, "ProcessPoolExecutor", RecordingExecutor)
+    assert export(use_summary=False, jobs=2) == serial
+    # 実際にワーカープロセスで作っている
+    assert pools == [2]
+
+
+def test_jobs_rejected_for_summary_export(make_db, capsys):
+    """日ごとの集計からの出力ではjobsを黙って無視せずにエラーにする"""
+    make_db(2)
+    with pytest.raises(ValueError):
+        export(use_summary=True, jobs=2)
+
+
+def test_summary_export_follows_direct_inserts(make_db, capsys):
+    """punchを通さずに挿入した打刻も、refresh_staleの後は日ごとの集計からの出力に反映される"""
+    from datetime import datetime
+
+    import db_alchemy
+    from db_alchemy import AttendanceRecord, RecordType
+
+    make_db(3)
+    with db_alchemy.Session() as session:
+        for hour, record_type in ((20, RecordType.IN), (22, RecordType.OUT)):
+            record_time = datetime(2023, 12, 5, hour)
+            session.add(
+                AttendanceRecord(
+                    employee_id=1,
+                    record_type=record_type,
+                    record_time=record_time,
+                    created_at=record_time,
+                    updated_at=record_time,
+                )
+            )
+        session.commit()
+    from_records = export(use_summary=False)
+    # 出力は集計を読むだけなので、refreshするまでは反映されない
+    assert export(use_summary=True) != from_records
+    db_alchemy.DailySummary.refresh_stale(datetime.min, datetime.max)
+    assert export(use_summary=True) == from_records
+
+
+def test_summary_export_does_not_write(make_db, capsys):
+    """日ごとの集計からの出力は、データベースに書き込まない(打刻アプリと競合しない)"""
+    from sqlalchemy import event
+
+    engine = make_db(3)
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append(statement.lstrip().split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        export(use_summary=True)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert statements and set(statements) == {"SELECT"}
+
+
+def csv_rows(name: str, value: str) -> list[list[str]]:
+    return [["日付", "出勤"], ["2023/12/01", value]]
+
+
+def test_manifest_missing_or_corrupt_is_empty(tmp_path):
+    empty = {"csv": {}, "xlsx": {}}
+    assert to_csv.load_manifest(tmp_path) == empty
+    manifest = {"csv": {"A": "1"}, "xlsx": {"B": "2"}}
+    to_csv.save_manifest(tmp_path, manifest)
+    assert to_csv.load_manifest(tmp_path) == manifest
+    (tmp_path / to_csv.MANIFEST_FILE).write_text("{壊れた", encoding="utf-8")
+    assert to_csv.load_manifest(tmp_path) == empty
+
+
+def test_incremental_csv_writes_only_changed(tmp_path, capsys):
+    """変更のない従業員は省略し、変わった従業員・ファイルがない従業員は書き直す"""
+    rows = {name: csv_rows(name, "09:00") for name in ("A", "B", "C")}
+    assert to_csv.write_employee_csvs(tmp_path, rows.items()) == ["A", "B", "C"]
+    assert to_csv.write_employee_csvs(tmp_path, rows.items()) == []
+
+    rows["B"] = csv_rows("B", "10:00")
+    (tmp_path / "C.csv").unlink()
+    assert to_csv.write_employee_csvs(tmp_path, rows.items()) == ["B", "C"]
+    assert "10:00" in (tmp_path / "B.csv").read_text(encoding="utf-8")
+
+    # incremental=Falseならすべて書き直す
+    assert to_csv.write_employee_csvs(tmp_path, rows.items(), False) == ["A", "B", "C"]
+
+
+@pytest.mark.parametrize("manifest", [None, "{壊れた"])
+def test_csv_without_manifest_writes_all(tmp_path, capsys, manifest):
+    """マニフェストがないか壊れていれば、すべての従業員を書き直す"""
+    rows = {name: csv_rows(name, "09:00") for name in ("A", "B")}
+    to_csv.write_employee_csvs(tmp_path, rows.items())
+    path = tmp_path / to_csv.MANIFEST_FILE
+    if manifest is None:
+        path.unlink()
+    else:
+        path.write_text(manifest, encoding="utf-8")
+    assert to_csv.write_employee_csvs(tmp_path, rows.items()) == ["A", "B"]
+    # 書き直したあとはマニフェストが作り直されている
+    assert to_csv.write_employee_csvs(tmp_path, rows.items()) == []
+
+
+def test_make_pairs_is_importable_from_to_csv():
+    """pair_engineに移したmake_pairsも、これまで通りto_csvからimportできる"""
+    import pair_engine
+    from to_csv import make_pairs
+
+    assert make_pairs is pair_engine.make_pairs
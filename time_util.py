@@ -1,9 +1,12 @@
-from datetime import datetime
-import pytz
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+from zoneinfo import ZoneInfo
 import re
+import time
 
 TIME_FORMAT: str = "%Y-%m-%d %H:%M:%S"
-TZ = pytz.timezone("Asia/Tokyo")
+TZ = ZoneInfo("Asia/Tokyo")
 
 
 def current_time():
@@ -38,6 +41,167 @@ def string_to_datetime(date_str: str, format: str = TIME_FORMAT) -> datetime:
     return datetime.strptime(date_str, format)
 
 
+class LocalClock:
+    """画面に表示する時刻の文字列を作る時計
+
+    UTCからの時差と日付の表示は日付が変わるまで計算し直さず、
+    時・分・秒はUNIX時刻に時差を足した秒数から求める(strftimeを使わない)。
+    時差が途中で変わる日(夏時間の切り替え)は1秒ごとに計算し直す
+    """
+
+    def __init__(
+        self,
+        tz=TZ,
+        date_format: str = "%m/%d",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.tz = tz
+        self.date_format = date_format
+        self.clock = clock
+        self._valid_from = 0.0
+        self._valid_until = 0.0  # この時刻(UNIX時刻)までは時差と日付の表示を使い回す
+        self._offset = 0  # UTCからの時差(秒)
+        self._date_text = ""
+
+    def _refresh(self, timestamp: float):
+        now = datetime.fromtimestamp(timestamp, self.tz)
+        midnight = datetime.combine(now.date(), datetime.min.time(), self.tz)
+        next_midnight = datetime.combine(
+            now.date() + timedelta(days=1), datetime.min.time(), self.tz
+        )
+        self._offset = int(now.utcoffset().total_seconds())
+        self._date_text = now.strftime(self.date_format)
+        self._valid_from = midnight.timestamp()
+        self._valid_until = next_midnight.timestamp()
+        if midnight.utcoffset() != next_midnight.utcoffset():
+            self._valid_until = int(timestamp) + 1
+
+    def fields(self, timestamp: Optional[float] = None) -> tuple[str, str]:
+        """「月/日」と「時:分:秒」の文字列を別々に返す
+
+        Args:
+            timestamp (Optional[float]): UNIX時刻 省略すると現在時刻
+
+        Returns:
+            tuple[str, str]: 例 ("08/31", "09:05:07")
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        if not self._valid_from <= timestamp < self._valid_until:
+            self._refresh(timestamp)
+        seconds = (int(timestamp) + self._offset) % 86400
+        hour, seconds = divmod(seconds, 3600)
+        minute, second = divmod(seconds, 60)
+        return self._date_text, f"{hour:02d}:{minute:02d}:{second:02d}"
+
+    def text(self, timestamp: Optional[float] = None) -> str:
+        """「月/日 時:分:秒」の文字列を返す
+
+        Args:
+            timestamp (Optional[float]): UNIX時刻 省略すると現在時刻
+
+        Returns:
+            str: 例 "08/31 09:05:07"
+        """
+        return " ".join(self.fields(timestamp))
+
+    def until_next_second(self, timestamp: Optional[float] = None) -> float:
+        """次の秒の変わり目までの秒数"""
+        if timestamp is None:
+            timestamp = self.clock()
+        return 1 - timestamp % 1
+
+
+def pay_period_range(year: int, month: int, start_day: int) -> tuple[datetime, datetime]:
+    """指定された月の集計期間の開始日時と終了日時を返す
+
+    前の月のstart_day日から、その月のstart_day日の前日まで
+
+    Args:
+        year (int): 年
+        month (int): 月
+        start_day (int): 集計期間の開始日(config.START_DAY)
+
+    Returns:
+        tuple: (start_date, end_date) 開始日時(含む)と終了日時(含まない)
+    """
+    if month == 1:
+        start_date = datetime(year - 1, 12, start_day)
+    else:
+        start_date = datetime(year, month - 1, start_day)
+    return start_date, datetime(year, month, start_day)
+
+
+class PayPeriod(NamedTuple):
+    """集計期間
+
+    start_date: 開始日時(含む)
+    end_date: 終了日時(含まない)
+    days: 期間内の日付
+    labels: 期間内の日付をフォーマットした文字列(daysと同じ順番)
+    """
+
+    start_date: datetime
+    end_date: datetime
+    days: tuple[date, ...]
+    labels: tuple[str, ...]
+
+
+@lru_cache(maxsize=128)
+def pay_period(year: int, month: int, start_day: int, format: str) -> PayPeriod:
+    """指定された月の集計期間を計算する
+
+    同じ引数の結果はキャッシュするので、複数の月・年をまとめて出力しても
+    カレンダーの計算と日付のフォーマットは月ごとに1回だけ行われる
+
+    Args:
+        year (int): 年
+        month (int): 月
+        start_day (int): 集計期間の開始日(config.START_DAY)
+        format (str): 日付の文字列のフォーマット
+
+    Returns:
+        PayPeriod: 集計期間
+    """
+    start_date, end_date = pay_period_range(year, month, start_day)
+    days = tuple(
+        (start_date + timedelta(days=i)).date()
+        for i in range((end_date - start_date).days)
+    )
+    return PayPeriod(
+        start_date, end_date, days, tuple(day.strftime(format) for day in days)
+    )
+
+
+def night_seconds(
+    punch_in: datetime, punch_out: datetime, night_hours: tuple[int, int]
+) -> float:
+    """出勤から退勤までのうち、深夜の時間帯に含まれる秒数
+
+    Args:
+        punch_in (datetime): 出勤時刻
+        punch_out (datetime): 退勤時刻
+        night_hours (tuple[int, int]): 深夜の時間帯の開始と終了の時(config.NIGHT_HOURS)
+
+    Returns:
+        float: 深夜の時間帯に含まれる秒数
+    """
+    start_hour, end_hour = night_hours
+    one_day = timedelta(days=1)
+    seconds = 0.0
+    day = datetime.combine(punch_in.date() - one_day, datetime.min.time())
+    while day <= punch_out:
+        night_start = day.replace(hour=start_hour)
+        night_end = day.replace(hour=end_hour)
+        if end_hour <= start_hour:  # 日付をまたぐ
+            night_end += one_day
+        overlap = min(punch_out, night_end) - max(punch_in, night_start)
+        if overlap > timedelta(0):
+            seconds += overlap.total_seconds()
+        day += one_day
+    return seconds
+
+
 def parse_date_string(date_str):
     # Validate input format using regex (allows YYYY/MM, YY/MM, YYYY/M, YY/M, etc.)
     if not re.match(r"^\d{2,4}[-/]\d{1,2}$", date_str):
@@ -65,3 +229,32 @@ def parse_date_string(date_str):
     month = int(month_str)
 
     return (year, month)
+
+
+def parse_month_range(range_str: str) -> list[tuple[int, int]]:
+    """年月の範囲の文字列を、範囲内の(年, 月)のリストに変換する
+
+    "2023/04-2024/03"、"2023/04~2024/03"のように2つの年月をつなげて指定する。
+    年月が1つだけならその月だけのリストを返す
+
+    Args:
+        range_str (str): 年月の範囲
+
+    Returns:
+        list[tuple[int, int]]: 古い順の(年, 月)のリスト(両端を含む)
+    """
+    match = re.match(r"^(\d{2,4}[-/]\d{1,2})\s*[-~〜]\s*(\d{2,4}[-/]\d{1,2})$", range_str)
+    if match is None:
+        first = last = parse_date_string(range_str)
+    else:
+        first = parse_date_string(match.group(1))
+        last = parse_date_string(match.group(2))
+    if last < first:
+        raise ValueError("範囲の終わりの年月が始めの年月より前になっています")
+
+    months = []
+    year, month = first
+    while (year, month) <= last:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
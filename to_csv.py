@@ -1,10 +1,18 @@
 import csv
+import hashlib
+import json
 from datetime import datetime, timedelta
-from db_alchemy import Employee, AttendanceRecord
+from db_alchemy import Employee, AttendanceRecord, DailySummary, RecordQuery
+import db_alchemy
+from pair_engine import make_pairs, pair_days  # noqa: F401 make_pairsは互換性のため残す
 import time_util
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, repeat
+from operator import attrgetter, itemgetter
 import config
-from typing import Optional, Union
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
+import argparse
 from pathlib import Path
 import sys
 
@@ -21,147 +29,608 @@ HEADER = [
     "要確認",
 ]
 BLANK_LINE = [BLANK] * len(HEADER)
+MANIFEST_FILE = "manifest.json"  # 出力フォルダごとの前回の出力内容の記録
 
 
-def make_pairs(punches):
+def pay_period(year: int, month: int) -> tuple[datetime, datetime, tuple[str, ...]]:
+    """指定された月の集計期間を計算する
+
+    その月の締め日の次の日から次の月の締め日まで
+    計算結果はtime_util.pay_periodがキャッシュする
+
+    Returns:
+        tuple: (start_date, end_date, period)
+               start_date: 期間の開始日時(含む)
+               end_date: 期間の終了日時(含まない)
+               period: 期間内の日付文字列のタプル
     """
-    打刻データをペアリングする関数。
+    period = time_util.pay_period(year, month, config.START_DAY, TIME_FORMAT)
+    return period.start_date, period.end_date, period.labels
+
+
+def make_rows(
+    name: str, period: Sequence[str], daily_pairs: dict
+) -> list[list[str]]:
+    """日付ごとのペアからCSVの行のリストを作る
+
+    Args:
+        name (str): 従業員名(最終行に書き込まれる)
+        period (Sequence[str]): 期間内の日付文字列
+        daily_pairs (dict): 日付文字列 -> (punch_pairs, has_lost) pair_engine.pair_daysの結果
+
+    Returns:
+        list[list[str]]: ヘッダーを含むCSVの行のリスト
+    """
+    rows = [HEADER]
+
+    # 日付ごとに出勤・退勤のペアを書き込む
+    for date in period:
+        pairs = daily_pairs.get(date)
+        if pairs is None:
+            rows.append(BLANK_LINE)
+            continue
+
+        row = [date]
+
+        punch_pairs, has_lost = pairs
+
+        # 最大2ペアまで対応（出勤1～2、退勤1～2）
+        for i in range(2):
+            if i >= len(punch_pairs):
+                # 出勤退勤のペアが4未満の場合、空白を追加してフォーマットを揃える
+                row.append(BLANK)
+                row.append(BLANK)
+                continue
+            punch_in, punch_out = punch_pairs[i]
+            if punch_in is not None:
+                row.append(time_util.datetime_to_string(punch_in, "%H:%M"))
+            else:
+                row.append(LOST)
+            if punch_out is not None:
+                row.append(time_util.datetime_to_string(punch_out, "%H:%M"))
+            else:
+                row.append(LOST)
+
+        # 押し忘れがあるかどうか
+        row.append("有り" if has_lost else "-")
+
+        rows.append(row)
+    rows.append([name])
+    return rows
+
+
+def make_summary_rows(
+    name: str, period: Sequence[str], summaries: dict
+) -> list[list[str]]:
+    """日ごとの集計からCSVの行のリストを作る(make_rowsと同じ行になる)
 
     Args:
-        punches (list[tuple]): 打刻データ [(type, time), ...]。
-                               type は "IN" または "OUT"。
+        name (str): 従業員名(最終行に書き込まれる)
+        period (Sequence[str]): 期間内の日付文字列
+        summaries (dict): 日付文字列 -> DailySummaryの行
+
     Returns:
-        tuple: (punch_pairs, has_lost)
-               punch_pairs: [(IN_time, OUT_time), ...]
-               has_lost: True ifペアリングに失敗した打刻がある場合。
+        list[list[str]]: ヘッダーを含むCSVの行のリスト
     """
-    has_lost = False
-    punch_pairs = []
+    rows = [HEADER]
+    for date in period:
+        summary = summaries.get(date)
+        if summary is None:
+            rows.append(BLANK_LINE)
+            continue
 
-    punches.reverse()  # リストを逆順にして処理しやすくする
+        row = [date]
+        for i, pair in enumerate(
+            ((summary.in1, summary.out1), (summary.in2, summary.out2))
+        ):
+            if i >= summary.pair_count:
+                row.append(BLANK)
+                row.append(BLANK)
+                continue
+            for punch_time in pair:
+                if punch_time is not None:
+                    row.append(time_util.datetime_to_string(punch_time, "%H:%M"))
+                else:
+                    row.append(LOST)
+        row.append("有り" if summary.lost else "-")
+        rows.append(row)
+    rows.append([name])
+    return rows
 
-    while punches:
-        punch_type, punch_time = punches.pop()
-        if punch_type.name == "IN":  # "IN"の場合
-            if punches and punches[-1][0].name == "OUT":  # 次が"OUT"ならペアにする
-                _, next_time = punches.pop()
-                punch_pairs.append((punch_time, next_time))
-            else:  # 次が"OUT"でない、または打刻がない場合
-                punch_pairs.append((punch_time, None))
-                has_lost = True
-        elif punch_type.name == "OUT":  # "OUT"のみの場合
-            punch_pairs.append((None, punch_time))
-            has_lost = True
 
-    return punch_pairs, has_lost
+def write_employee_csv(output_dir: Path, name: str, rows: list[list[str]]):
+    """従業員一人分の行をCSVファイルに書き出す"""
+    # CSVファイルを従業員名で開く
+    with open(
+        output_dir / f"{name}.csv",
+        mode="w",
+        newline="",
+        # encoding="utf-8",
+        encoding="utf-8-sig",  # UTF-8 (BOM付き)を指定
+    ) as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerows(rows)
+    print(f"{name} の勤怠データを {output_dir}/{name}.csv に書き出しました。")
+
+
+def parallel_map(
+    func: Callable,
+    *iterables: Iterable,
+    jobs: int = 1,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> Iterator:
+    """mapと同じ。jobsが2以上ならプロセスプールで並列に実行する
+
+    結果は入力と同じ順番で返るため、ワーカーの終わる順番によらず出力は同じになる。
+    実行中と取り出し待ちの結果はjobsの2倍までにして、すべての結果をためないようにする
+    initializer(*initargs)は各ワーカーの起動時に1回呼ばれる
+    """
+    if jobs <= 1:
+        yield from map(func, *iterables)
+        return
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=initializer, initargs=initargs
+    ) as executor:
+        pending: deque = deque()
+        for args in zip(*iterables):
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
-def export_employee_attendance_to_csv(year: int, month: int):
+def check_jobs(jobs: int, use_summary: bool):
+    """jobsを使えない組み合わせならValueErrorを投げる
+
+    日ごとの集計からの出力は1回のクエリで読んで行を並べるだけなので並列にしない。
+    黙ってjobsを無視しないように、打刻から作るとき以外は2以上を受け付けない
+    """
+    if jobs > 1 and use_summary:
+        raise ValueError("jobsは打刻から作るとき(use_summary=False)だけ指定できます")
+
+
+def rows_hash(rows: list[list[str]]) -> str:
+    """行の内容のハッシュ値(内容が変わったかどうかの判定に使う)"""
+    return hashlib.sha256(
+        json.dumps(rows, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def load_employee_mapping(file_path: Path) -> dict:
+    """
+    従業員名とテンプレート種別のマッピング情報を読み込む。
+
+    Args:
+        file_path (Path): JSON形式のマッピングファイルパス
+
+    Returns:
+        dict: 従業員名とテンプレート種別のマッピング
+    """
+    try:
+        with file_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"{file_path} が見つかりません。")
+        exit()
+    except json.JSONDecodeError:
+        print(f"{file_path} の形式が正しくありません。")
+        exit()
+
+
+def load_manifest(output_dir: Path) -> dict[str, dict[str, str]]:
+    """出力フォルダのマニフェストを読み込む
+
+    マニフェストは出力先("csv"と"xlsx")ごとに、従業員名 -> 最後に書き出した行のハッシュ値
+    を記録している。存在しないか壊れている場合は空のマニフェストを返す
+    """
+    manifest: dict[str, dict[str, str]] = {"csv": {}, "xlsx": {}}
+    try:
+        with (output_dir / MANIFEST_FILE).open("r", encoding="utf-8") as f:
+            manifest.update(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return manifest
+
+
+def save_manifest(output_dir: Path, manifest: dict[str, dict[str, str]]):
+    """出力フォルダにマニフェストを保存する"""
+    with (output_dir / MANIFEST_FILE).open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def export_employee_attendance_to_csv(
+    year: int,
+    month: int,
+    single_query: bool = True,
+    jobs: int = 1,
+    incremental: bool = True,
+    use_summary: bool = True,
+) -> list[str]:
+    """従業員ごとの勤怠記録をCSVに出力する
+
+    Args:
+        year (int): 年
+        month (int): 月
+        single_query (bool): Trueなら全従業員の打刻を1回のクエリで取得する。
+                             Falseなら従業員ごとにクエリを発行する(従来の方法)
+        jobs (int): 打刻の読み込み・ペアリング・行の作成を従業員ごとに並列に行うプロセス数
+                    (single_queryのとき)
+        incremental (bool): Trueなら前回の出力から内容が変わった従業員のCSVだけを書き出す
+        use_summary (bool): Trueなら打刻の代わりに日ごとの集計(DailySummary)を読む。
+                            single_queryとjobsは打刻から作るときだけ使う
+
+    Returns:
+        list[str]: CSVを書き出した従業員名のリスト
+
+    Raises:
+        ValueError: use_summaryがTrueでjobsが2以上のとき
+    """
+    check_jobs(jobs, use_summary)
     output_dir = Path(config.CSV_PATH) / f"{year}-{month:02d}"
 
     # 出力フォルダを作成 存在する場合は上書き
     output_dir.mkdir(exist_ok=True, parents=True)
     # 調べる期間のdatetimeのリスト
-    # その月の締め日の次の日から次の月の締め日まで
-    one_day = timedelta(days=1)
-    day = config.START_DAY
-    if month == 1:
-        # 1月が指定された場合、前の年の12月から計算する
-        year -= 1
-        month = 13
-    now = datetime(year=year, month=month - 1, day=day)
-    start_date = now
-    period: list[str] = []
-    while day != config.START_DAY - 1:
-        period.append(now.date().strftime(TIME_FORMAT))
-        now += one_day
-        day = now.day
-    period.append(now.date().strftime(TIME_FORMAT))
-    end_date = now + one_day
-    """従業員ごとの勤怠記録をCSVに出力する"""
+    start_date, end_date, period = pay_period(year, month)
     # 全従業員を取得
     employees = Employee.get_all()
 
+    if use_summary:
+        employee_rows = _iter_rows_from_summary(
+            employees, start_date, end_date, period
+        )
+    elif single_query:
+        employee_rows = _iter_rows_single_query(
+            employees, start_date, end_date, period, jobs
+        )
+    else:
+        employee_rows = _iter_rows_per_employee(
+            employees, start_date, end_date, period
+        )
+
+    return write_employee_csvs(output_dir, employee_rows, incremental)
+
+
+def write_employee_csvs(
+    output_dir: Path,
+    employee_rows: Iterable[tuple[str, list[list[str]]]],
+    incremental: bool = True,
+) -> list[str]:
+    """従業員ごとの行をCSVに書き出し、マニフェストを更新する
+
+    Args:
+        output_dir (Path): 出力フォルダ
+        employee_rows (Iterable): (従業員名, 行)
+        incremental (bool): Trueなら前回の出力から内容が変わった従業員のCSVだけを書き出す
+
+    Returns:
+        list[str]: CSVを書き出した従業員名のリスト
+    """
+    output_dir.mkdir(exist_ok=True, parents=True)
+    manifest = load_manifest(output_dir)
+    written = []
+    # CSVの書き出しはこのプロセスだけで行う
+    for name, rows in employee_rows:
+        digest = rows_hash(rows)
+        if (
+            incremental
+            and manifest["csv"].get(name) == digest
+            and (output_dir / f"{name}.csv").exists()
+        ):
+            continue
+        write_employee_csv(output_dir, name, rows)
+        manifest["csv"][name] = digest
+        written.append(name)
+    save_manifest(output_dir, manifest)
+    print(f"{len(written)}人分のCSVを書き出しました(変更のない従業員は省略)。")
+    return written
+
+
+def iter_months_rows(
+    months: Sequence[tuple[int, int]], use_summary: bool = True
+) -> Iterator[tuple[int, int, list[tuple[str, list[list[str]]]]]]:
+    """複数の月の従業員ごとのCSVの行を、1回のクエリで読んで月ごとに返す
+
+    全期間の日ごとの集計(または打刻)を1回で読み、従業員ごとに日付文字列で引けるようにしておく。
+    日付文字列は年を含むので、月ごとの期間の日付で引けばその月の行になる
+
+    Args:
+        months (Sequence[tuple[int, int]]): (年, 月)のリスト 古い順で連続していること
+        use_summary (bool): Trueなら打刻の代わりに日ごとの集計(DailySummary)を読む
+
+    Yields:
+        tuple: (年, 月, [(従業員名, ヘッダーを含むCSVの行のリスト), ...])
+    """
+    periods = [
+        time_util.pay_period(year, month, config.START_DAY, TIME_FORMAT)
+        for year, month in months
+    ]
+    start_date = periods[0].start_date
+    end_date = periods[-1].end_date
+    employees = Employee.get_all()
+
+    labels = {}
+    for period in periods:
+        labels.update(zip(period.days, period.labels))
+    if use_summary:
+        dailies = list(iter_daily_summaries(employees, start_date, end_date, labels))
+        make = make_summary_rows
+    else:
+        dailies = list(_iter_daily_pairs(employees, start_date, end_date, labels))
+        make = make_rows
+
+    for (year, month), period in zip(months, periods):
+        yield year, month, [
+            (name, make(name, period.labels, daily)) for name, daily in dailies
+        ]
+
+
+def _iter_rows_per_employee(
+    employees: list,
+    start_date: datetime,
+    end_date: datetime,
+    period: Sequence[str],
+) -> Iterator[tuple[str, list[list[str]]]]:
+    """従業員ごとにクエリを発行して行を返す(従来の方法)"""
     for employee in employees:
-        # 従業員の全勤怠記録を取得、ここで昇順になっていることが保証される
-        records = AttendanceRecord.get_employee_records(
+        # 従業員の勤怠記録をストリーミングで取得、ここで昇順になっていることが保証される
+        records = AttendanceRecord.iter_employee_records(
             employee_id=employee.employee_id, start_date=start_date, end_date=end_date
         )
-        if not records:
+
+        # 期間内の打刻をまとめてペアにし、日付文字列で引けるようにする
+        daily_pairs = {
+            date.strftime(TIME_FORMAT): pairs
+            for date, pairs in pair_days(list(records)).items()
+        }
+
+        if not daily_pairs:
             print(f"{employee.name} の勤怠記録が見つかりませんでした。")
             # continue 勤怠記録なしでもcsv出力する
 
-        # 日付ごとに勤怠を整理するためのデータ構造を用意
-        daily_attendance = defaultdict(list)
-
-        # 勤怠記録を日付ごとに整理
-        for record in records:
-            date_ = record.record_time.date()
-            date = date_.strftime(TIME_FORMAT)
-            record_type = record.record_type
-            record_time = record.record_time
-            daily_attendance[date].append((record_type, record_time))
-
-        # CSVファイルを従業員名で開く
-        with open(
-            output_dir / f"{employee.name}.csv",
-            mode="w",
-            newline="",
-            # encoding="utf-8",
-            encoding="utf-8-sig",  # UTF-8 (BOM付き)を指定
-        ) as csv_file:
-            writer = csv.writer(csv_file)
-
-            # ヘッダー行を書き込む
-
-            writer.writerow(HEADER)
-
-            # 日付ごとに出勤・退勤をペアにして書き込む
-            for date in period:
-                punches = daily_attendance[date]
-                if len(punches) == 0:
-                    writer.writerow(BLANK_LINE)
-                    continue
-
-                row = [date]
-
-                punch_pairs, has_lost = make_pairs(punches)
-
-                if punch_pairs is None:
-                    continue
-
-                # 最大2ペアまで対応（出勤1～2、退勤1～2）
-                for i in range(2):
-                    if i >= len(punch_pairs):
-                        # 出勤退勤のペアが4未満の場合、空白を追加してフォーマットを揃える
-                        row.append(BLANK)
-                        row.append(BLANK)
-                        continue
-                    punch_in, punch_out = punch_pairs[i]
-                    if punch_in is not None:
-                        row.append(time_util.datetime_to_string(punch_in, "%H:%M"))
-                    else:
-                        row.append(LOST)
-                    if punch_out is not None:
-                        row.append(time_util.datetime_to_string(punch_out, "%H:%M"))
-                    else:
-                        row.append(LOST)
-
-                # 押し忘れがあるかどうか
-                row.append("有り" if has_lost else "-")
-
-                # 行をCSVに書き込む
-                writer.writerow(row)
-            writer.writerow([employee.name])
-        print(
-            f"{employee.name} の勤怠データを {output_dir}/{employee.name}.csv に書き出しました。"
+        yield employee.name, make_rows(employee.name, period, daily_pairs)
+
+
+def iter_employee_rows(
+    year: int, month: int, jobs: int = 1, use_summary: bool = True
+) -> Iterator[tuple[str, list[list[str]]]]:
+    """指定された月の従業員ごとのCSVの行を、ファイルに書き出さずに返す
+
+    csv_to_xlsxでCSVを経由せずにワークブックに書き込むために使う
+
+    Args:
+        year (int): 年
+        month (int): 月
+        jobs (int): 打刻の読み込み・ペアリング・行の作成を並列に行うプロセス数(打刻から作るとき)
+        use_summary (bool): Trueなら打刻の代わりに日ごとの集計(DailySummary)を読む
+
+    Yields:
+        tuple: (従業員名, ヘッダーを含むCSVの行のリスト) employee_idの順
+
+    Raises:
+        ValueError: use_summaryがTrueでjobsが2以上のとき
+    """
+    check_jobs(jobs, use_summary)
+    start_date, end_date, period = pay_period(year, month)
+    if use_summary:
+        yield from _iter_rows_from_summary(
+            Employee.get_all(), start_date, end_date, period
         )
+        return
+    yield from _iter_rows_single_query(
+        Employee.get_all(), start_date, end_date, period, jobs
+    )
+
+
+def _iter_rows_single_query(
+    employees: list,
+    start_date: datetime,
+    end_date: datetime,
+    period: Sequence[str],
+    jobs: int = 1,
+) -> Iterator[tuple[str, list[list[str]]]]:
+    """期間内の全打刻を1回のクエリで読み、従業員ごとの行を返す
+
+    jobsが2以上なら従業員を分けて、ワーカーごとに担当する従業員の打刻を
+    1回のクエリで読み、ペアにして行を作る。このプロセスは行を受け取るだけでよい
+    """
+    if jobs <= 1:
+        # 従業員ごとにまとまった時点で行を作る
+        for name, daily_pairs in _iter_daily_pairs(
+            employees, start_date, end_date, _period_labels(start_date, period)
+        ):
+            yield name, make_rows(name, period, daily_pairs)
+        return
+
+    employees = sorted(employees, key=attrgetter("employee_id"))
+    # ワーカーの処理時間が偏らないように、プロセス数より細かく分ける
+    chunk_size = max(1, -(-len(employees) // (jobs * 4)))
+    chunks = [
+        [(employee.employee_id, employee.name) for employee in employees[i : i + chunk_size]]
+        for i in range(0, len(employees), chunk_size)
+    ]
+    database = db_alchemy.Session.kw["bind"].url.database
+    for chunk_rows in parallel_map(
+        _chunk_rows,
+        chunks,
+        repeat(start_date),
+        repeat(end_date),
+        repeat(period),
+        jobs=jobs,
+        initializer=_connect_worker,
+        initargs=(database,),
+    ):
+        yield from chunk_rows
+
+
+def _connect_worker(database: str):
+    """ワーカープロセスのSessionを同じデータベースの新しいエンジンに向ける"""
+    db_alchemy.Session.configure(bind=db_alchemy.create_db_engine(database))
+
+
+def _chunk_rows(
+    employees: list[tuple[int, str]],
+    start_date: datetime,
+    end_date: datetime,
+    period: Sequence[str],
+) -> list[tuple[str, list[list[str]]]]:
+    """ワーカープロセスで、従業員(employee_id, 従業員名)の打刻を読んで行を作る"""
+    records = (
+        RecordQuery()
+        .employees(*(employee_id for employee_id, _ in employees))
+        .between(start_date, end_date)
+        .iter()
+    )
+    # (employee_id, record_time)の昇順なので、従業員ごとにまとめられる
+    grouped = {
+        employee_id: [(record_type, record_time) for _, record_type, record_time in group]
+        for employee_id, group in groupby(records, key=itemgetter(0))
+    }
+    labels = _period_labels(start_date, period)
+    rows = []
+    for employee_id, name in employees:
+        punches = grouped.get(employee_id, [])
+        if not punches:
+            print(f"{name} の勤怠記録が見つかりませんでした。")
+        daily_pairs = {labels[day]: pairs for day, pairs in pair_days(punches).items()}
+        rows.append((name, make_rows(name, period, daily_pairs)))
+    return rows
+
+
+def _iter_rows_from_summary(
+    employees: list,
+    start_date: datetime,
+    end_date: datetime,
+    period: Sequence[str],
+) -> Iterator[tuple[str, list[list[str]]]]:
+    """期間内の日ごとの集計を1回のクエリで読み、従業員ごとの行を返す"""
+    for name, daily_summaries in iter_daily_summaries(
+        employees, start_date, end_date, _period_labels(start_date, period)
+    ):
+        yield name, make_summary_rows(name, period, daily_summaries)
+
+
+def _period_labels(start_date: datetime, period: Sequence[str]) -> dict:
+    """日付 -> 日付文字列 (行ごとにstrftimeしない)"""
+    return dict(
+        zip(
+            (start_date.date() + timedelta(days=i) for i in range(len(period))),
+            period,
+        )
+    )
+
+
+def iter_daily_summaries(
+    employees: list,
+    start_date: datetime,
+    end_date: datetime,
+    labels: Optional[dict] = None,
+) -> Iterator[tuple[str, dict]]:
+    """期間内の日ごとの集計を1回のクエリで読み、従業員ごとに日付ごとの集計の行を返す
+
+    CSVの出力とpayrollの労働時間の集計で使う。
+    labels(日付 -> 日付文字列)を渡せば日付文字列を、省略すれば日付(date)をキーにする
+
+    Args:
+        employees (list): 従業員のリスト
+        start_date (datetime): 期間の開始(この日を含む)
+        end_date (datetime): 期間の終了(この日を含まない)
+        labels (Optional[dict]): 期間内の日付 -> 日付文字列
+
+    Yields:
+        tuple: (従業員名, 日付 -> DailySummary.iter_periodの行) employee_idの順
+    """
+    summaries = DailySummary.iter_period(start_date, end_date)
+    # (employee_id, work_date)の昇順なので、従業員ごとにまとめられる
+    grouped = groupby(summaries, key=attrgetter("employee_id"))
+    current = next(grouped, None)
+
+    for employee in sorted(employees, key=attrgetter("employee_id")):
+        # 従業員テーブルに存在しないemployee_idの集計は読み飛ばす
+        while current is not None and current[0] < employee.employee_id:
+            current = next(grouped, None)
+
+        daily_summaries: dict = {}
+        if current is not None and current[0] == employee.employee_id:
+            for summary in current[1]:
+                key = summary.work_date if labels is None else labels[summary.work_date]
+                daily_summaries[key] = summary
+            current = next(grouped, None)
+        else:
+            print(f"{employee.name} の勤怠記録が見つかりませんでした。")
+            # 勤怠記録なしでもcsv出力する
+
+        yield employee.name, daily_summaries
+
+
+def _iter_daily_pairs(
+    employees: list,
+    start_date: datetime,
+    end_date: datetime,
+    labels: Optional[dict] = None,
+) -> Iterator[tuple[str, dict]]:
+    """期間内の全打刻を1回のクエリで読み、従業員ごとに日付ごとのペアを返す
+
+    従業員ごとに期間内の打刻をpair_engine.pair_daysでまとめてペアにする。
+    labels(日付 -> 日付文字列)を渡せば日付文字列を、省略すれば日付(date)をキーにする
+    """
+    records = AttendanceRecord.iter_period_records(start_date, end_date)
+    # (employee_id, record_time)の昇順なので、従業員ごとにまとめられる
+    grouped = groupby(records, key=itemgetter(0))
+    current = next(grouped, None)
+
+    for employee in sorted(employees, key=attrgetter("employee_id")):
+        # 従業員テーブルに存在しないemployee_idの打刻は読み飛ばす
+        while current is not None and current[0] < employee.employee_id:
+            current = next(grouped, None)
+
+        daily_pairs: dict = {}
+        if current is not None and current[0] == employee.employee_id:
+            daily_pairs = pair_days(
+                [(record_type, record_time) for _, record_type, record_time in current[1]]
+            )
+            if labels is not None:
+                daily_pairs = {labels[date]: pairs for date, pairs in daily_pairs.items()}
+            current = next(grouped, None)
+        else:
+            print(f"{employee.name} の勤怠記録が見つかりませんでした。")
+            # 勤怠記録なしでもcsv出力する
+
+        yield employee.name, daily_pairs
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="勤怠データを従業員ごとのCSVに出力する")
+    parser.add_argument("date", nargs="?", help="年と月 例: 2024/08, 2024/8, 24/08, 24/8")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="--from-recordsのときに従業員ごとの処理を並列に行うプロセス数",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="前回から変更のない従業員も含めてすべて書き出す",
+    )
+    parser.add_argument(
+        "--from-records",
+        action="store_true",
+        help="日ごとの集計を使わずに打刻から作る",
+    )
+    args = parser.parse_args()
+    if args.jobs > 1 and not args.from_records:
+        parser.error("--jobsは--from-recordsと一緒に指定してください")
     input_str: str
-    if len(sys.argv) != 2:
+    if args.date is None:
         input_str = input("年と月を入力 例: 2024/08, 2024/8, 24/08, 24/8 ->")
     else:
-        input_str = sys.argv[1]
-    export_employee_attendance_to_csv(*time_util.parse_date_string(input_str))
+        input_str = args.date
+    export_employee_attendance_to_csv(
+        *time_util.parse_date_string(input_str),
+        jobs=args.jobs,
+        incremental=not args.full,
+        use_summary=not args.from_records,
+    )